@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Compare the ORM-based fetch path with the columnar one of `TargetDB.fetch_all`.
+
+Usage:
+
+    python benchmarks/bench_fetch.py -c dbconf.toml -t target -t fluxstd -n 3
+
+The ORM path selects the model, builds an instance for every row, and reads
+every column back with `getattr`, which is what `fetch_all` used to do.
+"""
+
+import argparse
+import time
+
+import pandas as pd
+from sqlalchemy import select
+
+from targetdb import TargetDB, models
+from targetdb.utils import load_config
+
+
+def fetch_all_orm(db, tablename):
+    model = getattr(models, tablename)
+    data = db.session.execute(select(model)).fetchall()
+    columns = [c.key for c in model.__mapper__.columns]
+    rows = [[getattr(row[0], col) for col in columns] for row in data]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def best_of(n_repeat, func, *args, **kwargs):
+    elapsed = []
+    for _ in range(n_repeat):
+        t_begin = time.perf_counter()
+        res = func(*args, **kwargs)
+        elapsed.append(time.perf_counter() - t_begin)
+    return min(elapsed), res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-c", "--config", required=True, help="Database config file.")
+    parser.add_argument(
+        "-t", "--table", action="append", help="Table name (can be repeated)."
+    )
+    parser.add_argument(
+        "--columns", nargs="+", help="Column projection for the columnar path."
+    )
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repetitions.")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    db = TargetDB(**config["targetdb"]["db"])
+    db.connect()
+
+    print(
+        f"{'table':>14s} {'rows':>10s} {'orm [s]':>9s} {'columnar [s]':>13s} "
+        f"{'arrow [s]':>10s} {'speedup':>8s}"
+    )
+    for tablename in args.table or ["target", "fluxstd"]:
+        t_orm, df_orm = best_of(args.repeat, fetch_all_orm, db, tablename)
+        t_col, df_col = best_of(
+            args.repeat, db.fetch_all, tablename, columns=args.columns
+        )
+        t_arrow, _ = best_of(
+            args.repeat, db.fetch_all, tablename, columns=args.columns, as_arrow=True
+        )
+        if args.columns is None:
+            pd.testing.assert_frame_equal(df_orm, df_col)
+        print(
+            f"{tablename:>14s} {df_orm.index.size:10d} {t_orm:9.3f} {t_col:13.3f} "
+            f"{t_arrow:10.3f} {t_orm / t_col:7.1f}x"
+        )
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from .targetdb import TargetDB
+from .targetdb import TargetDB, dispose_engines, get_engine
 
 try:
     from ._version import version as __version__
@@ -8,4 +8,4 @@ except ImportError:
     # Fallback for development without build
     __version__ = "0.0.0+unknown"
 
-__all__ = ["TargetDB", "__version__"]
+__all__ = ["TargetDB", "dispose_engines", "get_engine", "__version__"]
@@ -1,19 +1,30 @@
 #!/usr/bin/env python3
 import json
 import time
+from datetime import timedelta
 from enum import Enum
 from pathlib import Path
 from typing import Annotated
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 import rich
 import typer
+from astropy import units as u
 from loguru import logger
 from sqlalchemy import create_engine
 from sqlalchemy_utils import create_database, database_exists, drop_database
 
+from ..clustering import cluster_targets
+from ..snapshot import sync_snapshot
+from ..targetdb import PFS_FIELD_RADIUS
 from ..utils import (
     add_database_rows,
     check_duplicates,
+    check_positional_duplicates,
     draw_diagram,
     generate_schema_markdown,
     get_url_object,
@@ -24,6 +35,7 @@ from ..utils import (
     load_input_data,
     parse_allocation_file,
     prep_fluxstd_data,
+    targetdb_session,
     transfer_data_from_uploader,
     transfer_data_from_uploader_via_webapi,
     update_input_catalog_active,
@@ -60,11 +72,51 @@ class TargetdbTable(str, Enum):
     user_pointing = "user_pointing"
 
 
+class FieldTable(str, Enum):
+    target = "target"
+    fluxstd = "fluxstd"
+    sky = "sky"
+
+
 class FluxType(str, Enum):
     total = "total"
     psf = "psf"
 
 
+class InsertMethod(str, Enum):
+    mappings = "mappings"
+    copy = "copy"
+    upsert = "upsert"
+
+
+class OnConflict(str, Enum):
+    update = "update"
+    nothing = "nothing"
+
+
+class UpdateMethod(str, Enum):
+    mappings = "mappings"
+    staging = "staging"
+
+
+class CommitPolicy(str, Enum):
+    single = "single"
+    chunk = "chunk"
+
+
+class BatchTransaction(str, Enum):
+    single = "single"
+    savepoint = "savepoint"
+
+
+class ParquetCompression(str, Enum):
+    zstd = "zstd"
+    snappy = "snappy"
+    gzip = "gzip"
+    lz4 = "lz4"
+    none = "none"
+
+
 config_help_msg = "Database configuration file in the TOML format."
 
 
@@ -223,10 +275,90 @@ def checkdups(
             help="File format of the merged data file.",
         ),
     ] = PyArrowFileFormat.parquet,
+    out_of_core: Annotated[
+        bool,
+        typer.Option(
+            "--out-of-core",
+            help="Stream the input files and check duplicates in on-disk hash buckets to bound the memory usage.",
+        ),
+    ] = False,
+    n_buckets: Annotated[
+        int,
+        typer.Option(
+            "--buckets",
+            help="Number of on-disk buckets with `--out-of-core`.",
+        ),
+    ] = 64,
+    batch_size: Annotated[
+        int,
+        typer.Option(
+            "--batch-size",
+            help="Number of rows read at a time with `--out-of-core`.",
+        ),
+    ] = 1_000_000,
+    tmpdir: Annotated[
+        str | None,
+        typer.Option(
+            "--tmpdir",
+            show_default=False,
+            help="Directory to spill the buckets with `--out-of-core`. The system temporary directory is used by default.",
+        ),
+    ] = None,
+    n_jobs: Annotated[
+        int,
+        typer.Option(
+            "-j",
+            "--jobs",
+            help="Number of processes to read the input files (or check the buckets with `--out-of-core`) in parallel.",
+        ),
+    ] = 1,
+    positional: Annotated[
+        bool,
+        typer.Option(
+            "--positional",
+            help="Find groups of sources within `--radius` across all input files instead of key duplicates. "
+            "The groups are saved in clusters.csv with the columns of the cluster table.",
+        ),
+    ] = False,
+    radius: Annotated[
+        float,
+        typer.Option(
+            "--radius",
+            help="Linking length in arcsec with `--positional`.",
+        ),
+    ] = 1.0,
+    id_column: Annotated[
+        str,
+        typer.Option(
+            "--id-column",
+            help="Column saved as target_id in clusters.csv with `--positional`. "
+            "Use obj_id for files without target IDs (e.g., prepared flux standards or uploaded targets).",
+        ),
+    ] = "target_id",
+    cluster_id_start: Annotated[
+        int,
+        typer.Option(
+            "--cluster-id-start",
+            help="First cluster_id in clusters.csv with `--positional`. "
+            "Set it above the largest cluster_id in the cluster table to avoid collisions.",
+        ),
+    ] = 1,
 ):
     if additional_columns is None:
         additional_columns = []
 
+    if positional:
+        check_positional_duplicates(
+            indir=directory,
+            outdir=output_dir,
+            radius=radius,
+            file_format=file_format.value,
+            id_column=id_column,
+            n_jobs=n_jobs,
+            cluster_id_start=cluster_id_start,
+        )
+        return
+
     check_duplicates(
         indir=directory,
         outdir=output_dir,
@@ -234,6 +366,11 @@ def checkdups(
         skip_save_merged=skip_save_merged,
         additional_columns=additional_columns,
         check_columns=check_columns,
+        out_of_core=out_of_core,
+        n_buckets=n_buckets,
+        batch_size=batch_size,
+        n_jobs=n_jobs,
+        tmpdir=tmpdir,
     )
 
 
@@ -294,6 +431,22 @@ def prep_fluxstd(
             help="File format of the output data file.",
         ),
     ] = PyArrowFileFormat.parquet,
+    n_jobs: Annotated[
+        int,
+        typer.Option(
+            "-j",
+            "--jobs",
+            help="Number of processes to convert the input files in parallel.",
+        ),
+    ] = 1,
+    healpix_nside: Annotated[
+        int | None,
+        typer.Option(
+            "--healpix-nside",
+            show_default=False,
+            help="Repartition the rows by the HEALPix pixel with the nside (up to 32) into `{output_dir}/healpix={pixel}/` instead of one output file per input file.",
+        ),
+    ] = None,
 ):
 
     if input_catalog_id is None and input_catalog_name is None:
@@ -312,6 +465,8 @@ def prep_fluxstd(
         input_catalog_name,
         rename_cols=rename_cols,
         file_format=file_format.value,
+        n_jobs=n_jobs,
+        healpix_nside=healpix_nside,
     )
 
 
@@ -439,6 +594,46 @@ def insert(
             help="Proposal ID (e.g., S24B-QT001). Only required for the `target` table.",
         ),
     ] = None,
+    method: Annotated[
+        InsertMethod,
+        typer.Option(
+            "--method",
+            help="Insert method. `copy` streams rows with the binary COPY protocol, "
+            "which is much faster and uses less memory for large tables. "
+            "`upsert` inserts new rows and updates existing ones matched by the natural key "
+            "of the `target`, `fluxstd`, or `sky` table.",
+        ),
+    ] = InsertMethod.mappings,
+    on_conflict: Annotated[
+        OnConflict,
+        typer.Option(
+            "--on-conflict",
+            help="Action on existing rows with `--method upsert`. "
+            "`update` requires the natural keys to be unique in the input.",
+        ),
+    ] = OnConflict.update,
+    batch_size: Annotated[
+        int,
+        typer.Option(
+            "--batch-size",
+            help="Number of rows encoded at a time with `--method copy` or `--method upsert`.",
+        ),
+    ] = 100_000,
+    chunk_size: Annotated[
+        int | None,
+        typer.Option(
+            "--chunk-size",
+            show_default=False,
+            help="Process the input file in chunks of this number of rows to bound the memory usage.",
+        ),
+    ] = None,
+    commit_policy: Annotated[
+        CommitPolicy,
+        typer.Option(
+            "--commit-policy",
+            help="Commit all chunks in a single transaction (`single`) or each chunk separately (`chunk`).",
+        ),
+    ] = CommitPolicy.single,
     verbose: Annotated[
         bool, typer.Option("-v", "--verbose", help="Verbose output.")
     ] = False,
@@ -446,11 +641,15 @@ def insert(
     logger.info(f"Loading config file: {config_file}")
     config = load_config(config_file)
 
-    logger.info(f"Loading input data from {input_file} into a DataFrame")
-    t_begin = time.time()
-    df = load_input_data(input_file)
-    t_end = time.time()
-    logger.info(f"Loaded input data in {t_end - t_begin:.2f} seconds")
+    if chunk_size is None:
+        logger.info(f"Loading input data from {input_file} into a DataFrame")
+        t_begin = time.time()
+        df = load_input_data(input_file)
+        t_end = time.time()
+        logger.info(f"Loaded input data in {t_end - t_begin:.2f} seconds")
+    else:
+        # the input file is read chunk by chunk in add_database_rows
+        df = None
 
     add_database_rows(
         input_file=input_file,
@@ -465,6 +664,11 @@ def insert(
         proposal_id=proposal_id,
         upload_id=upload_id,
         insert=True,
+        insert_method=method.value,
+        on_conflict=on_conflict.value,
+        batch_size=batch_size,
+        chunk_size=chunk_size,
+        commit_policy=commit_policy.value,
     )
 
 
@@ -522,20 +726,54 @@ def update(
             help="Proposal ID (e.g., S24B-QT001). Only required for the `target` table",
         ),
     ] = None,
+    method: Annotated[
+        UpdateMethod,
+        typer.Option(
+            "--method",
+            help="Update method. `staging` copies the rows into a temporary table and "
+            "applies them with a single UPDATE statement, which is much faster for many rows.",
+        ),
+    ] = UpdateMethod.mappings,
+    batch_size: Annotated[
+        int,
+        typer.Option(
+            "--batch-size",
+            help="Number of rows copied into the staging table at a time with `--method staging`.",
+        ),
+    ] = 100_000,
+    chunk_size: Annotated[
+        int | None,
+        typer.Option(
+            "--chunk-size",
+            show_default=False,
+            help="Process the input file in chunks of this number of rows to bound the memory usage.",
+        ),
+    ] = None,
+    commit_policy: Annotated[
+        CommitPolicy,
+        typer.Option(
+            "--commit-policy",
+            help="Commit all chunks in a single transaction (`single`) or each chunk separately (`chunk`).",
+        ),
+    ] = CommitPolicy.single,
     verbose: Annotated[bool, typer.Option("--verbose", help="Verbose output.")] = False,
 ):
     logger.info(f"Loading config file: {config_file}")
     config = load_config(config_file)
 
-    logger.info(f"Loading input data from {input_file} into a DataFrame")
-    t_begin = time.time()
-    df = load_input_data(input_file)
-    t_end = time.time()
-    logger.info(f"Loaded input data in {t_end - t_begin:.2f} seconds")
+    if chunk_size is None:
+        logger.info(f"Loading input data from {input_file} into a DataFrame")
+        t_begin = time.time()
+        df = load_input_data(input_file)
+        t_end = time.time()
+        logger.info(f"Loaded input data in {t_end - t_begin:.2f} seconds")
+    else:
+        # the input file is read chunk by chunk in add_database_rows
+        df = None
 
     add_database_rows(
         input_file=input_file,
-        table=table,
+        table=table.value,
         commit=commit,
         fetch=fetch,
         verbose=verbose,
@@ -545,6 +783,10 @@ def update(
         proposal_id=proposal_id,
         upload_id=upload_id,
         update=True,
+        update_method=method.value,
+        batch_size=batch_size,
+        chunk_size=chunk_size,
+        commit_policy=commit_policy.value,
     )
 
 
@@ -614,6 +856,21 @@ def transfer_targets(
         ),
     ] = Path("."),
     force: Annotated[bool, typer.Option(help="Force download.")] = False,
+    batch: Annotated[
+        bool,
+        typer.Option(
+            "--batch",
+            help="List the upload directories at once and transfer them concurrently over a shared SSH connection.",
+        ),
+    ] = False,
+    n_workers: Annotated[
+        int,
+        typer.Option(
+            "-j",
+            "--jobs",
+            help="Number of uploads transferred concurrently with `--batch`.",
+        ),
+    ] = 4,
 ):
 
     # print(check_ppc)
@@ -628,6 +885,8 @@ def transfer_targets(
         config,
         local_dir=local_dir,
         force=force,
+        batch=batch,
+        n_workers=n_workers,
     )
 
 
@@ -664,6 +923,21 @@ def transfer_targets_api(
         ),
     ] = Path("."),
     force: Annotated[bool, typer.Option(help="Force download.")] = False,
+    n_workers: Annotated[
+        int,
+        typer.Option(
+            "-j",
+            "--jobs",
+            help="Number of uploads downloaded concurrently.",
+        ),
+    ] = 4,
+    verify_checksum: Annotated[
+        bool,
+        typer.Option(
+            "--verify-checksum",
+            help="Check CRC-32 of the extracted files against the ZIP archives.",
+        ),
+    ] = False,
 ):
 
     logger.info(f"Loading config file: {config_file}")
@@ -677,6 +951,8 @@ def transfer_targets_api(
         config,
         local_dir=local_dir,
         force=force,
+        n_workers=n_workers,
+        verify_checksum=verify_checksum,
     )
 
 
@@ -727,6 +1003,29 @@ def insert_targets(
     verbose: Annotated[
         bool, typer.Option("-v", "--verbose", help="Verbose output.")
     ] = False,
+    batch: Annotated[
+        bool,
+        typer.Option(
+            "--batch",
+            help="Insert all uploads in a single transaction, written by a single COPY with `--transaction single`. "
+            "NaN values are stored as NULL unlike without `--batch`.",
+        ),
+    ] = False,
+    transaction: Annotated[
+        BatchTransaction,
+        typer.Option(
+            "--transaction",
+            help="Transaction handling with `--batch`: `single` inserts nothing if any upload fails, and `savepoint` skips failed uploads.",
+        ),
+    ] = BatchTransaction.single,
+    n_jobs: Annotated[
+        int,
+        typer.Option(
+            "-j",
+            "--jobs",
+            help="Number of processes to load the input files with `--batch`.",
+        ),
+    ] = 1,
 ):
     logger.info(f"Loading config file: {config_file}")
     config = load_config(config_file)
@@ -734,7 +1033,7 @@ def insert_targets(
     logger.info(f"Loading input catalog data from {input_catalogs} into a DataFrame")
     df_input_catalogs = load_input_data(input_catalogs)
 
-    insert_targets_from_uploader(
+    df_status = insert_targets_from_uploader(
         df_input_catalogs,
         config,
         data_dir=data_dir,
@@ -742,7 +1041,12 @@ def insert_targets(
         commit=commit,
         fetch=fetch,
         verbose=verbose,
+        batch=batch,
+        transaction=transaction.value,
+        n_jobs=n_jobs,
     )
+    if df_status is not None and df_status["status"].isin(["FAILED", "ABORTED"]).any():
+        raise typer.Exit(code=1)
 
 
 @app.command(
@@ -788,6 +1092,29 @@ def insert_pointings(
     verbose: Annotated[
         bool, typer.Option("-v", "--verbose", help="Verbose output.")
     ] = False,
+    batch: Annotated[
+        bool,
+        typer.Option(
+            "--batch",
+            help="Insert all uploads in a single transaction, written by a single COPY with `--transaction single`. "
+            "NaN values are stored as NULL unlike without `--batch`.",
+        ),
+    ] = False,
+    transaction: Annotated[
+        BatchTransaction,
+        typer.Option(
+            "--transaction",
+            help="Transaction handling with `--batch`: `single` inserts nothing if any upload fails, and `savepoint` skips failed uploads.",
+        ),
+    ] = BatchTransaction.single,
+    n_jobs: Annotated[
+        int,
+        typer.Option(
+            "-j",
+            "--jobs",
+            help="Number of processes to load the input files with `--batch`.",
+        ),
+    ] = 1,
 ):
     logger.info(f"Loading config file: {config_file}")
     config = load_config(config_file)
@@ -795,14 +1122,19 @@ def insert_pointings(
     logger.info(f"Loading input catalog data from {input_catalogs} into a DataFrame")
     df_input_catalogs = load_input_data(input_catalogs)
 
-    insert_userppc_from_uploader(
+    df_status = insert_userppc_from_uploader(
         df_input_catalogs,
         config,
         data_dir=data_dir,
         commit=commit,
         fetch=fetch,
         verbose=verbose,
+        batch=batch,
+        transaction=transaction.value,
+        n_jobs=n_jobs,
     )
+    if df_status is not None and df_status["status"].isin(["FAILED", "ABORTED"]).any():
+        raise typer.Exit(code=1)
     # insert_targets_from_uploader(
     #     df_input_catalogs,
     #     config,
@@ -861,5 +1193,519 @@ def update_catalog_active(
     )
 
 
+@app.command(
+    help="Cluster targets within a distance and write the clusters to the cluster table."
+)
+def cluster(
+    config_file: Annotated[
+        str,
+        typer.Option(
+            "-c",
+            "--config",
+            show_default=False,
+            help=config_help_msg,
+        ),
+    ],
+    radius: Annotated[
+        float,
+        typer.Option(
+            "--radius",
+            help="Linking length in arcsec. Targets within the radius are in the same cluster.",
+        ),
+    ] = 1.0,
+    proposal_id: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--proposal-id",
+            show_default=False,
+            help="Proposal ID of targets to cluster (can be repeated). All targets are clustered if neither this nor `--input-catalog-id` is given.",
+        ),
+    ] = None,
+    input_catalog_id: Annotated[
+        list[int] | None,
+        typer.Option(
+            "--input-catalog-id",
+            show_default=False,
+            help="Input catalog ID of targets to cluster (can be repeated).",
+        ),
+    ] = None,
+    incremental: Annotated[
+        bool,
+        typer.Option(
+            "--incremental",
+            help="Cluster newly added targets of `--input-catalog-id` with the existing targets and clusters nearby.",
+        ),
+    ] = False,
+    commit: Annotated[
+        bool,
+        typer.Option("--commit", help="Commit changes to the database."),
+    ] = False,
+):
+    if incremental and not input_catalog_id:
+        raise typer.BadParameter("--input-catalog-id is required with --incremental.")
+
+    logger.info(f"Loading config file: {config_file}")
+    config = load_config(config_file)
+
+    with targetdb_session(config) as db:
+        cluster_targets(
+            db,
+            radius * u.arcsec,
+            proposal_id=proposal_id or None,
+            input_catalog_id=input_catalog_id or None,
+            incremental=incremental,
+            dry_run=not commit,
+        )
+
+
+@app.command(
+    help="Fetch targets, flux standards, and sky positions in a PFS field of view."
+)
+def fetch_field(
+    config_file: Annotated[
+        str,
+        typer.Option(
+            "-c",
+            "--config",
+            show_default=False,
+            help=config_help_msg,
+        ),
+    ],
+    ra: Annotated[
+        float,
+        typer.Option(
+            "--ra", show_default=False, help="RA of the field center in degree."
+        ),
+    ],
+    dec: Annotated[
+        float,
+        typer.Option(
+            "--dec", show_default=False, help="Dec of the field center in degree."
+        ),
+    ],
+    position_angle: Annotated[
+        float | None,
+        typer.Option(
+            "--pa",
+            show_default=False,
+            help="Position angle of the field in degree. If given, rows are limited to the hexagonal field of view; otherwise to the circle of `--radius`.",
+        ),
+    ] = None,
+    radius: Annotated[
+        float,
+        typer.Option(
+            "--radius",
+            help="Radius of the field (the circumradius of the hexagon) in degree.",
+        ),
+    ] = PFS_FIELD_RADIUS,
+    tables: Annotated[
+        list[FieldTable] | None,
+        typer.Option(
+            "--table",
+            show_default=False,
+            help="Table to query (can be repeated). All of target, fluxstd, and sky are queried by default.",
+        ),
+    ] = None,
+    filters: Annotated[
+        str | None,
+        typer.Option(
+            "--filters",
+            show_default=False,
+            help='Filters per table in JSON. A list is a set of values and "min"/"max" are an inclusive range '
+            '(e.g., \'{"fluxstd": {"prob_f_star": {"min": 0.5}}, "target": {"proposal_id": ["S24B-QN001"]}}\').',
+        ),
+    ] = None,
+    all_catalogs: Annotated[
+        bool,
+        typer.Option(
+            "--all-catalogs",
+            help="Include rows of inactive input catalogs.",
+        ),
+    ] = False,
+    output_dir: Annotated[
+        Path,
+        typer.Option(
+            "-o",
+            "--outdir",
+            help="Directory path to save the output files.",
+        ),
+    ] = Path("."),
+    file_format: Annotated[
+        PyArrowFileFormat,
+        typer.Option(
+            "--format",
+            help="File format of the output data files.",
+        ),
+    ] = PyArrowFileFormat.parquet,
+):
+    logger.info(f"Loading config file: {config_file}")
+    config = load_config(config_file)
+
+    tables = [t.value for t in tables] if tables else [t.value for t in FieldTable]
+    if filters is not None:
+        filters = json.loads(filters)
+
+    with targetdb_session(config) as db:
+        results = db.fetch_field(
+            ra,
+            dec,
+            position_angle=position_angle,
+            radius=radius,
+            tables=tables,
+            filters=filters,
+            active=not all_catalogs,
+        )
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for tablename, tb in results.items():
+        _write_arrow_table(
+            tb, output_dir / f"{tablename}.{file_format.value}", file_format
+        )
+
+
+@app.command(
+    help="Fetch targets, flux standards, and sky positions in the fields of view of many pointings."
+)
+def fetch_fields(
+    input_file: Annotated[
+        Path,
+        typer.Argument(
+            show_default=False,
+            help="Pointing list with the ra, dec, and optionally pa columns in degree "
+            "(CSV, ECSV, Feather, or Parquet).",
+        ),
+    ],
+    config_file: Annotated[
+        str,
+        typer.Option(
+            "-c",
+            "--config",
+            show_default=False,
+            help=config_help_msg,
+        ),
+    ],
+    radius: Annotated[
+        float,
+        typer.Option(
+            "--radius",
+            help="Radius of the fields (the circumradius of the hexagons) in degree.",
+        ),
+    ] = PFS_FIELD_RADIUS,
+    id_column: Annotated[
+        str | None,
+        typer.Option(
+            "--id-column",
+            show_default=False,
+            help="Column of the pointing list saved as the pointing key. The row number (pointing_index) is used by default.",
+        ),
+    ] = None,
+    tables: Annotated[
+        list[FieldTable] | None,
+        typer.Option(
+            "--table",
+            show_default=False,
+            help="Table to query (can be repeated). All of target, fluxstd, and sky are queried by default.",
+        ),
+    ] = None,
+    filters: Annotated[
+        str | None,
+        typer.Option(
+            "--filters",
+            show_default=False,
+            help="Filters per table in JSON (see `fetch-field`).",
+        ),
+    ] = None,
+    all_catalogs: Annotated[
+        bool,
+        typer.Option(
+            "--all-catalogs",
+            help="Include rows of inactive input catalogs.",
+        ),
+    ] = False,
+    split: Annotated[
+        bool,
+        typer.Option(
+            "--split",
+            help="Save one file per pointing and table instead of one file per table with the pointing key column.",
+        ),
+    ] = False,
+    output_dir: Annotated[
+        Path,
+        typer.Option(
+            "-o",
+            "--outdir",
+            help="Directory path to save the output files.",
+        ),
+    ] = Path("."),
+    file_format: Annotated[
+        PyArrowFileFormat,
+        typer.Option(
+            "--format",
+            help="File format of the output data files.",
+        ),
+    ] = PyArrowFileFormat.parquet,
+):
+    logger.info(f"Loading config file: {config_file}")
+    config = load_config(config_file)
+
+    df_pointings = load_input_data(input_file)
+    pa_column = None
+    if "pa" in df_pointings.columns:
+        # empty values in CSV are circular fields
+        pa_column = "pa"
+        df_pointings["pa"] = pd.to_numeric(df_pointings["pa"], errors="coerce")
+    tables = [t.value for t in tables] if tables else [t.value for t in FieldTable]
+    if filters is not None:
+        filters = json.loads(filters)
+
+    with targetdb_session(config) as db:
+        results = db.fetch_fields(
+            df_pointings,
+            radius=radius,
+            tables=tables,
+            filters=filters,
+            active=not all_catalogs,
+            pa_column=pa_column,
+        )
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for tablename, tb in results.items():
+        key = "pointing_index"
+        if id_column is not None:
+            key = id_column
+            tb = tb.set_column(
+                0,
+                id_column,
+                pa.array(
+                    df_pointings[id_column].to_numpy()[
+                        tb.column("pointing_index").to_numpy()
+                    ]
+                ),
+            )
+        if split:
+            # one file per pointing including those with no rows
+            keys = (
+                df_pointings[id_column]
+                if id_column is not None
+                else range(df_pointings.index.size)
+            )
+            for k in keys:
+                _write_arrow_table(
+                    tb.filter(pc.equal(tb.column(key), k)),
+                    output_dir / f"{tablename}_{k}.{file_format.value}",
+                    file_format,
+                )
+        else:
+            _write_arrow_table(
+                tb, output_dir / f"{tablename}.{file_format.value}", file_format
+            )
+
+
+@app.command(
+    help="Materialize a table in a local parquet dataset, synced incrementally by the update time of rows."
+)
+def snapshot(
+    table: Annotated[
+        TargetdbTable,
+        typer.Argument(show_default=False, help="Table name to snapshot."),
+    ],
+    config_file: Annotated[
+        str,
+        typer.Option(
+            "-c",
+            "--config",
+            show_default=False,
+            help=config_help_msg,
+        ),
+    ],
+    snapshot_dir: Annotated[
+        Path,
+        typer.Option(
+            "-o",
+            "--outdir",
+            help="Directory of the snapshots. The snapshot is written to `{outdir}/{name}`.",
+        ),
+    ] = Path("."),
+    name: Annotated[
+        str | None,
+        typer.Option(
+            "--name",
+            show_default=False,
+            help="Name of the snapshot. The table name is used by default.",
+        ),
+    ] = None,
+    filters: Annotated[
+        str | None,
+        typer.Option(
+            "--filters",
+            show_default=False,
+            help='Filters of the rows in JSON. A list is a set of values and "min"/"max" are an inclusive range '
+            '(e.g., \'{"version": "3.3"}\').',
+        ),
+    ] = None,
+    full: Annotated[
+        bool,
+        typer.Option("--full", help="Rebuild the snapshot from scratch."),
+    ] = False,
+    reconcile: Annotated[
+        bool,
+        typer.Option(
+            "--reconcile",
+            help="Compare the primary keys with the database to detect deleted rows regardless of `--reconcile-interval`.",
+        ),
+    ] = False,
+    reconcile_interval: Annotated[
+        float,
+        typer.Option(
+            "--reconcile-interval",
+            help="Hours after which the primary keys are compared with the database again.",
+        ),
+    ] = 24.0,
+    n_partitions: Annotated[
+        int,
+        typer.Option(
+            "--partitions",
+            help="Number of parquet files the rows are split into by the primary key.",
+        ),
+    ] = 16,
+):
+    logger.info(f"Loading config file: {config_file}")
+    config = load_config(config_file)
+
+    if filters is not None:
+        filters = json.loads(filters)
+
+    with targetdb_session(config) as db:
+        sync_snapshot(
+            db,
+            table.value,
+            snapshot_dir,
+            name=name,
+            filters=filters,
+            full=full,
+            reconcile=True if reconcile else None,
+            reconcile_interval=timedelta(hours=reconcile_interval),
+            n_partitions=n_partitions,
+        )
+
+
+@app.command(
+    help="Export a table to a Hive-partitioned parquet dataset without loading it into memory."
+)
+def export(
+    table: Annotated[
+        TargetdbTable,
+        typer.Argument(show_default=False, help="Table name to export."),
+    ],
+    config_file: Annotated[
+        str,
+        typer.Option(
+            "-c",
+            "--config",
+            show_default=False,
+            help=config_help_msg,
+        ),
+    ],
+    output_dir: Annotated[
+        Path,
+        typer.Option(
+            "-o",
+            "--outdir",
+            show_default=False,
+            help="Base directory of the dataset.",
+        ),
+    ],
+    columns: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--column",
+            show_default=False,
+            help="Column to export (can be repeated). All columns are exported by default.",
+        ),
+    ] = None,
+    filters: Annotated[
+        str | None,
+        typer.Option(
+            "--filters",
+            show_default=False,
+            help='Filters of the rows in JSON. A list is a set of values and "min"/"max" are an inclusive range '
+            '(e.g., \'{"version": "3.3", "psf_mag_r": {"max": 18.0}}\').',
+        ),
+    ] = None,
+    partition_by: Annotated[
+        list[str] | None,
+        typer.Option(
+            "--partition-by",
+            show_default=False,
+            help="Column to partition the dataset by (can be repeated).",
+        ),
+    ] = None,
+    healpix_nside: Annotated[
+        int | None,
+        typer.Option(
+            "--healpix-nside",
+            show_default=False,
+            help="Also partition by the NESTED HEALPix pixel of ra and dec with the nside, saved in the `healpix` column.",
+        ),
+    ] = None,
+    batch_size: Annotated[
+        int,
+        typer.Option("--batch-size", help="Number of rows fetched at a time."),
+    ] = 100_000,
+    row_group_size: Annotated[
+        int,
+        typer.Option(
+            "--row-group-size", help="Number of rows in a row group of the files."
+        ),
+    ] = 250_000,
+    compression: Annotated[
+        ParquetCompression,
+        typer.Option("--compression", help="Compression codec of the files."),
+    ] = ParquetCompression.zstd,
+    compression_level: Annotated[
+        int | None,
+        typer.Option(
+            "--compression-level",
+            show_default=False,
+            help="Compression level of the codec. The default of the codec is used if not given.",
+        ),
+    ] = None,
+    overwrite: Annotated[
+        bool,
+        typer.Option(
+            "--overwrite",
+            help="Replace the files of the partitions written. Otherwise, the output directory must be empty.",
+        ),
+    ] = False,
+):
+    logger.info(f"Loading config file: {config_file}")
+    config = load_config(config_file)
+
+    filters = json.loads(filters) if filters is not None else {}
+
+    with targetdb_session(config) as db:
+        db.export_dataset(
+            table.value,
+            output_dir,
+            columns=columns or None,
+            partition_by=partition_by,
+            healpix_nside=healpix_nside,
+            batch_size=batch_size,
+            row_group_size=row_group_size,
+            compression=compression.value,
+            compression_level=compression_level,
+            overwrite=overwrite,
+            **filters,
+        )
+
+
+def _write_arrow_table(tb, outfile, file_format):
+    if file_format == PyArrowFileFormat.parquet:
+        pq.write_table(tb, outfile)
+    else:
+        feather.write_feather(tb, outfile)
+    logger.info(f"{tb.num_rows} rows are saved in {outfile}")
+
+
 if __name__ == "__main__":
     pass
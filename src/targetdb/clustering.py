@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+import time
+
+import numpy as np
+import pandas as pd
+from astropy import units as u
+from loguru import logger
+from sqlalchemy import text
+
+from . import spatial
+
+# columns of the target table used for clustering
+TARGET_COLUMNS = ["target_id", "ra", "dec", "input_catalog_id", "is_cluster"]
+
+
+def _to_degree(distance_threshold):
+    if isinstance(distance_threshold, u.Quantity):
+        return float(distance_threshold.to_value(u.degree))
+    return float(distance_threshold)
+
+
+def run_clustering(ra, dec, distance_threshold):
+    """
+    Group positions by the friends-of-friends algorithm.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degree.
+    dec : array_like
+        Declination in degree.
+    distance_threshold : astropy.units.Quantity or float
+        The linking length. A float is taken as degree.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        Cluster labels from 0. Two positions within the distance_threshold are in
+        the same cluster, and a position without such a neighbour forms its own cluster.
+    """
+    return spatial.friends_of_friends(ra, dec, _to_degree(distance_threshold))
+
+
+def cluster_targets(
+    db,
+    distance_threshold,
+    proposal_id=None,
+    input_catalog_id=None,
+    incremental=False,
+    dry_run=False,
+):
+    """
+    Cluster targets and write the results to the cluster table.
+
+    Parameters
+    ----------
+    db : TargetDB
+        A connected TargetDB instance.
+    distance_threshold : astropy.units.Quantity or float
+        The linking length. A float is taken as degree.
+    proposal_id : str or list of str, optional
+        Proposal IDs of the targets to cluster. Defaults to None.
+    input_catalog_id : int or list of int, optional
+        Input catalog IDs of the targets to cluster. Defaults to None.
+    incremental : bool, optional
+        If True, the targets of `input_catalog_id` are newly added ones. They are
+        clustered together with the existing targets of the other input catalogs
+        (of `proposal_id` if given) linked to them through chains of targets
+        within the distance_threshold, and the other members of the existing
+        clusters of such targets. Defaults to False.
+    dry_run : bool, optional
+        If True, the changes are rolled back. Defaults to False.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        The rows written to the cluster table.
+
+    Raises
+    ------
+    ValueError
+        If `incremental` is True and `input_catalog_id` is not given.
+
+    Notes
+    -----
+    Without `incremental`, all targets selected by `proposal_id` and
+    `input_catalog_id` (all targets if neither is given) are clustered. The
+    other members of the existing clusters of those targets are included, so
+    that a target belongs to at most one cluster. The existing clusters are
+    replaced by the new ones with new cluster IDs following the largest one
+    in the table, and `target.is_cluster` is updated for all of the targets
+    involved. All changes are made in a single transaction.
+
+    Neighbours of the new targets in the incremental mode are searched in the
+    database with `q3c_join`, so the Q3C extension is required. The search is
+    repeated from the targets found in the previous one until no new target is
+    found, so that the clusters are the same as those of a full run over the
+    new and existing targets.
+    """
+    radius = _to_degree(distance_threshold)
+
+    filters = {}
+    if proposal_id is not None:
+        filters["proposal_id"] = np.atleast_1d(proposal_id).tolist()
+    if input_catalog_id is not None:
+        filters["input_catalog_id"] = np.atleast_1d(input_catalog_id).tolist()
+
+    t_begin = time.time()
+    if incremental:
+        if input_catalog_id is None:
+            logger.error("input_catalog_id must be given in the incremental mode")
+            raise ValueError("input_catalog_id must be given in the incremental mode")
+        df, df_members = _fetch_linked_targets(
+            db,
+            db.fetch_columns("target", columns=TARGET_COLUMNS, **filters),
+            filters,
+            radius,
+        )
+    else:
+        df = db.fetch_columns("target", columns=TARGET_COLUMNS, **filters)
+        df_members = _fetch_cluster_members(db, df["target_id"])
+
+    # include the other members of the existing clusters
+    old_cluster_ids = df_members["cluster_id"].unique()
+    df = _append_targets(df, df_members.loc[:, TARGET_COLUMNS])
+    logger.info(
+        f"Fetched {df.index.size} targets including {old_cluster_ids.size} "
+        f"existing clusters in {time.time() - t_begin:.2f} s"
+    )
+
+    t_begin = time.time()
+    labels = run_clustering(df["ra"], df["dec"], radius)
+    cluster_id_start = db.fetch_query(
+        "SELECT COALESCE(MAX(cluster_id), 0) + 1 AS cluster_id_start FROM cluster"
+    )["cluster_id_start"].iloc[0]
+    df_cluster = spatial.make_cluster_table(
+        df["ra"],
+        df["dec"],
+        labels,
+        df["target_id"],
+        input_catalog_id=df["input_catalog_id"],
+        cluster_id_start=int(cluster_id_start),
+    )
+    logger.info(
+        f"Found {df_cluster['cluster_id'].nunique()} clusters of "
+        f"{df_cluster.index.size} targets in {time.time() - t_begin:.2f} s"
+    )
+
+    t_begin = time.time()
+    try:
+        if old_cluster_ids.size > 0:
+            db.session.execute(
+                text(
+                    "DELETE FROM cluster WHERE cluster_id IN "
+                    "(SELECT unnest(CAST(:cluster_ids AS bigint[])))"
+                ),
+                {"cluster_ids": old_cluster_ids.tolist()},
+            )
+        if df_cluster.index.size > 0:
+            db.insert("cluster", df_cluster, method="copy", autocommit=False)
+        # only the targets of which is_cluster changes are updated
+        is_cluster = df["target_id"].isin(df_cluster["target_id"])
+        is_changed = is_cluster != df["is_cluster"].eq(True)
+        if is_changed.any():
+            db.update_by_staging(
+                "target",
+                pd.DataFrame(
+                    {
+                        "target_id": df.loc[is_changed, "target_id"],
+                        "is_cluster": is_cluster[is_changed],
+                    }
+                ),
+                autocommit=False,
+            )
+    except Exception:
+        db.rollback()
+        raise
+    if dry_run:
+        db.rollback()
+    else:
+        db.commit()
+    logger.info(f"Wrote the clusters in {time.time() - t_begin:.2f} s")
+
+    return df_cluster
+
+
+def _append_targets(df, df_other):
+    if df_other.empty:
+        return df
+    return pd.concat([df, df_other], ignore_index=True).drop_duplicates(
+        subset=["target_id"], ignore_index=True
+    )
+
+
+def _fetch_linked_targets(db, df, filters, radius):
+    # the targets linked to those in df by chains of neighbours and of members
+    # of the existing clusters, and the cluster members among them
+    df_members = _fetch_cluster_members(db, df["target_id"])
+    df = _append_targets(df, df_members.loc[:, TARGET_COLUMNS])
+    list_members = [df_members] if not df_members.empty else []
+    df_frontier = df
+    n_hops = 0
+    while not df_frontier.empty:
+        n_hops += 1
+        df_new = _fetch_neighbours(db, df_frontier["target_id"], filters, radius)
+        df_new = df_new[~df_new["target_id"].isin(df["target_id"])]
+        df_members = _fetch_cluster_members(db, df_new["target_id"])
+        if not df_members.empty:
+            list_members.append(df_members)
+        df_new = _append_targets(df_new, df_members.loc[:, TARGET_COLUMNS])
+        df_frontier = df_new[~df_new["target_id"].isin(df["target_id"])]
+        df = _append_targets(df, df_frontier)
+    logger.info(f"Searched neighbours of the new targets in {n_hops} steps")
+    if not list_members:
+        return df, pd.DataFrame(columns=TARGET_COLUMNS + ["cluster_id"])
+    df_members = pd.concat(list_members, ignore_index=True).drop_duplicates(
+        ignore_index=True
+    )
+    return df, df_members
+
+
+def _fetch_neighbours(db, target_ids, filters, radius):
+    # existing targets of the other input catalogs near the given targets
+    conditions = ["t.input_catalog_id <> ALL(:input_catalog_id)"]
+    if "proposal_id" in filters:
+        conditions.append("t.proposal_id = ANY(:proposal_id)")
+    query = (
+        f"SELECT DISTINCT {', '.join(f't.{c}' for c in TARGET_COLUMNS)} "
+        "FROM target AS n "
+        "JOIN unnest(CAST(:target_ids AS bigint[])) AS k(target_id) USING (target_id) "
+        "JOIN target AS t ON q3c_join(n.ra, n.dec, t.ra, t.dec, :radius) "
+        f"WHERE {' AND '.join(conditions)}"
+    )
+    df = db.fetch_query(
+        query,
+        {
+            **filters,
+            "target_ids": np.asarray(target_ids).tolist(),
+            "radius": radius,
+        },
+    )
+    if df.empty:
+        return pd.DataFrame(columns=TARGET_COLUMNS)
+    return df
+
+
+def _fetch_cluster_members(db, target_ids):
+    # all members of the existing clusters of the given targets; the IDs are
+    # joined through unnest rather than compared with = ANY, which is linear in
+    # the number of IDs for each row
+    query = (
+        f"SELECT {', '.join(f't.{c}' for c in TARGET_COLUMNS)}, c.cluster_id "
+        "FROM cluster AS c JOIN target AS t USING (target_id) "
+        "WHERE c.cluster_id IN "
+        "(SELECT cluster_id FROM cluster "
+        "JOIN unnest(CAST(:target_ids AS bigint[])) AS k(target_id) USING (target_id))"
+    )
+    df = db.fetch_query(query, {"target_ids": np.asarray(target_ids).tolist()})
+    if df.empty:
+        return pd.DataFrame(columns=TARGET_COLUMNS + ["cluster_id"])
+    return df
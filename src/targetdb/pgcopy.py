@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+
+import enum
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import types
+
+# Header of the PostgreSQL binary COPY format: signature, flags field, and
+# header extension area length.
+# ref: https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + np.array([0, 0], dtype=">i4").tobytes()
+PGCOPY_TRAILER = np.array([-1], dtype=">i2").tobytes()
+
+# PostgreSQL timestamps are microseconds since 2000-01-01 00:00:00
+PG_EPOCH_OFFSET_US = 946_684_800_000_000
+
+# kind: (Arrow type used for the conversion, big-endian wire dtype)
+# A wire dtype of None means a variable-length (text) field.
+PG_BINARY_KINDS = {
+    "bool": (pa.bool_(), np.dtype("u1")),
+    "int2": (pa.int16(), np.dtype(">i2")),
+    "int4": (pa.int32(), np.dtype(">i4")),
+    "int8": (pa.int64(), np.dtype(">i8")),
+    "float4": (pa.float32(), np.dtype(">f4")),
+    "float8": (pa.float64(), np.dtype(">f8")),
+    "timestamp": (pa.timestamp("us"), np.dtype(">i8")),
+    "text": (pa.large_string(), None),
+}
+
+
+def column_kind(column):
+    """
+    Return the binary COPY field kind of a SQLAlchemy column.
+
+    Parameters
+    ----------
+    column : sqlalchemy.Column
+        A column of one of the targetdb models.
+
+    Returns
+    -------
+    kind : str
+        One of the keys of `PG_BINARY_KINDS`.
+
+    Raises
+    ------
+    TypeError
+        If the column type is not supported by the binary COPY encoder.
+
+    Notes
+    -----
+    Enum columns are sent as their labels, which is the binary representation
+    of a PostgreSQL enum value.
+    """
+    sqltype = column.type
+    if isinstance(sqltype, types.Boolean):
+        return "bool"
+    if isinstance(sqltype, types.BigInteger):
+        return "int8"
+    if isinstance(sqltype, types.SmallInteger):
+        return "int2"
+    if isinstance(sqltype, types.Integer):
+        return "int4"
+    if isinstance(sqltype, types.Float):
+        # Float without precision is "double precision" on PostgreSQL
+        if sqltype.precision is not None and sqltype.precision <= 24:
+            return "float4"
+        return "float8"
+    if isinstance(sqltype, types.DateTime):
+        return "timestamp"
+    if isinstance(sqltype, (types.Enum, types.String)):
+        return "text"
+    raise TypeError(f"Unsupported column type for binary COPY: {column.name} {sqltype}")
+
+
+def arrow_schema(model, columns=None):
+    """
+    Build an Arrow schema from the columns of a SQLAlchemy model.
+
+    Parameters
+    ----------
+    model : sqlalchemy.orm.DeclarativeMeta
+        One of the targetdb models (e.g., `models.fluxstd`).
+    columns : list of str, optional
+        Column names to include. All columns of the table are used if None.
+
+    Returns
+    -------
+    schema : pyarrow.Schema
+        Arrow schema with the types used to encode the columns.
+    """
+    table_columns = model.__table__.columns
+    if columns is None:
+        columns = [c.name for c in table_columns]
+    return pa.schema(
+        [
+            pa.field(
+                name,
+                PG_BINARY_KINDS[column_kind(table_columns[name])][0],
+                nullable=True,
+            )
+            for name in columns
+        ]
+    )
+
+
+def _enum_to_label(value):
+    return value.name if isinstance(value, enum.Enum) else value
+
+
+def dataframe_to_arrow(dataframe, model, fill_defaults=True):
+    """
+    Convert a DataFrame into an Arrow table matching the columns of a model.
+
+    Parameters
+    ----------
+    dataframe : pandas.DataFrame
+        Input data. Columns not mapped to the table are ignored.
+    model : sqlalchemy.orm.DeclarativeMeta
+        One of the targetdb models.
+    fill_defaults : bool, optional
+        Passed to `cast_to_model`. Defaults to True.
+
+    Returns
+    -------
+    table : pyarrow.Table
+        Arrow table cast with `cast_to_model`. Missing values (None, NaN,
+        NaT) become nulls.
+    """
+    table_columns = model.__table__.columns
+    df = dataframe.loc[:, [c for c in dataframe.columns if c in table_columns]]
+
+    enum_columns = [
+        name for name in df.columns if isinstance(table_columns[name].type, types.Enum)
+    ]
+    if enum_columns:
+        df = df.copy()
+        for name in enum_columns:
+            df[name] = df[name].map(_enum_to_label)
+
+    return cast_to_model(
+        pa.Table.from_pandas(df, preserve_index=False),
+        model,
+        fill_defaults=fill_defaults,
+    )
+
+
+def cast_to_model(table, model, fill_defaults=True):
+    """
+    Cast the columns of an Arrow table or record batch to the model types.
+
+    Only columns mapped to the table are kept. Columns missing in the input
+    but having a scalar Python-side default in the model are filled with the
+    default, which is what `bulk_insert_mappings` does for missing keys.
+    Empty strings in non-text columns and NaN in floating-point columns are
+    treated as missing values, so that the same data is stored as NULL
+    whether it is given as a DataFrame or as an Arrow table.
+
+    Parameters
+    ----------
+    table : pyarrow.Table or pyarrow.RecordBatch
+        Input data.
+    model : sqlalchemy.orm.DeclarativeMeta
+        One of the targetdb models.
+    fill_defaults : bool, optional
+        If False, missing columns are not added (e.g., for updates). Defaults to True.
+
+    Returns
+    -------
+    table : pyarrow.Table or pyarrow.RecordBatch
+        Data with the schema given by `arrow_schema`.
+    """
+    table_columns = model.__table__.columns
+    names = [name for name in table.schema.names if name in table_columns]
+    defaults = [
+        c
+        for c in table_columns
+        if fill_defaults
+        and c.name not in names
+        and c.default is not None
+        and c.default.is_scalar
+    ]
+    schema = arrow_schema(model, names + [c.name for c in defaults])
+    arrays = []
+    for name in names:
+        arr = table.column(name)
+        if pa.types.is_timestamp(arr.type) and arr.type.tz is not None:
+            # timestamp columns are "without time zone" and stored in UTC
+            arr = arr.cast(pa.timestamp(arr.type.unit, tz="UTC")).cast(
+                pa.timestamp(arr.type.unit)
+            )
+        target_type = schema.field(name).type
+        if (
+            pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type)
+        ) and not pa.types.is_large_string(target_type):
+            # empty strings in non-text columns (e.g., from CSV files read with
+            # keep_default_na=False) are missing values
+            arr = pc.if_else(pc.equal(arr, ""), pa.scalar(None, arr.type), arr)
+        arr = arr.cast(target_type)
+        if pa.types.is_floating(target_type):
+            # NaN of Arrow input is a value unlike that of pandas input
+            arr = pc.if_else(pc.is_nan(arr), pa.scalar(None, target_type), arr)
+        arrays.append(arr)
+    for c in defaults:
+        arrays.append(
+            pa.array(
+                [_enum_to_label(c.default.arg)] * table.num_rows,
+                type=schema.field(c.name).type,
+            )
+        )
+    if isinstance(table, pa.RecordBatch):
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _fixed_width_payload(arr, kind, wire_dtype):
+    if kind == "bool":
+        values = arr.fill_null(False).to_numpy(zero_copy_only=False)
+    elif kind == "timestamp":
+        values = arr.cast(pa.int64()).fill_null(0).to_numpy() - PG_EPOCH_OFFSET_US
+    else:
+        values = arr.fill_null(0).to_numpy(zero_copy_only=False)
+    return values.astype(wire_dtype).view(np.uint8).reshape(-1, wire_dtype.itemsize)
+
+
+def _text_buffers(arr):
+    arr = arr.cast(pa.large_string())
+    _, offsets_buf, data_buf = arr.buffers()
+    offsets = np.frombuffer(offsets_buf, dtype=np.int64)[
+        arr.offset : arr.offset + len(arr) + 1
+    ]
+    if data_buf is None:
+        data = np.empty(0, dtype=np.uint8)
+    else:
+        data = np.frombuffer(data_buf, dtype=np.uint8)
+    return offsets[:-1], np.diff(offsets), data
+
+
+def encode_record_batch(batch, kinds):
+    """
+    Encode a record batch into PostgreSQL binary COPY tuples.
+
+    Parameters
+    ----------
+    batch : pyarrow.RecordBatch
+        Data to encode. Columns must already have the Arrow types of `kinds`
+        (see `cast_to_model`).
+    kinds : list of str
+        Binary field kinds of the columns (see `column_kind`).
+
+    Returns
+    -------
+    data : bytes
+        Encoded tuples without the COPY header and trailer.
+
+    Notes
+    -----
+    The whole batch is encoded with vectorized NumPy operations. Each field
+    is laid out as a 4-byte length (-1 for NULL) followed by its payload, and
+    each tuple starts with the 2-byte number of fields.
+    """
+    n_rows = batch.num_rows
+    n_cols = batch.num_columns
+    if n_rows == 0:
+        return b""
+
+    columns = []
+    field_sizes = np.empty((n_rows, n_cols), dtype=np.int64)
+    for i in range(n_cols):
+        arr = batch.column(i)
+        if isinstance(arr, pa.ChunkedArray):
+            arr = arr.combine_chunks()
+        is_null = arr.is_null().to_numpy(zero_copy_only=False)
+        wire_dtype = PG_BINARY_KINDS[kinds[i]][1]
+        if wire_dtype is None:
+            src_start, lengths, data = _text_buffers(arr)
+            lengths = np.where(is_null, -1, lengths)
+            columns.append(("var", lengths, (src_start, data)))
+        else:
+            lengths = np.where(is_null, -1, wire_dtype.itemsize)
+            payload = _fixed_width_payload(arr, kinds[i], wire_dtype)
+            columns.append(("fixed", lengths, payload))
+        field_sizes[:, i] = 4 + np.maximum(lengths, 0)
+
+    row_sizes = 2 + field_sizes.sum(axis=1)
+    row_start = np.zeros(n_rows, dtype=np.int64)
+    np.cumsum(row_sizes[:-1], out=row_start[1:])
+    out = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+
+    out[row_start[:, None] + np.arange(2)] = np.frombuffer(
+        np.array([n_cols], dtype=">i2").tobytes(), dtype=np.uint8
+    )
+
+    field_start = row_start + 2
+    for kind, lengths, payload in columns:
+        out[field_start[:, None] + np.arange(4)] = (
+            lengths.astype(">i4").view(np.uint8).reshape(-1, 4)
+        )
+        valid = lengths >= 0
+        dest = field_start[valid] + 4
+        if kind == "fixed":
+            width = payload.shape[1]
+            out[dest[:, None] + np.arange(width)] = payload[valid]
+        else:
+            src_start, data = payload
+            valid_lengths = lengths[valid]
+            n_bytes = int(valid_lengths.sum())
+            if n_bytes > 0:
+                pos = np.arange(n_bytes, dtype=np.int64)
+                cum_start = np.zeros(valid_lengths.size, dtype=np.int64)
+                np.cumsum(valid_lengths[:-1], out=cum_start[1:])
+                out[np.repeat(dest - cum_start, valid_lengths) + pos] = data[
+                    np.repeat(src_start[valid] - cum_start, valid_lengths) + pos
+                ]
+        field_start = field_start + 4 + np.maximum(lengths, 0)
+
+    return out.tobytes()
+
+
+def iter_copy_binary(batches, kinds):
+    """
+    Generate a complete binary COPY stream from record batches.
+
+    Parameters
+    ----------
+    batches : iterable of pyarrow.RecordBatch
+        Data to encode, already cast with `cast_to_model`.
+    kinds : list of str
+        Binary field kinds of the columns (see `column_kind`).
+
+    Yields
+    ------
+    chunk : bytes
+        The header, one chunk per batch, and the trailer.
+    """
+    yield PGCOPY_HEADER
+    for batch in batches:
+        chunk = encode_record_batch(batch, kinds)
+        if chunk:
+            yield chunk
+    yield PGCOPY_TRAILER
+
+
+class CopyStream:
+    """
+    File-like object reading from an iterator of bytes chunks.
+
+    `psycopg2.cursor.copy_expert` pulls the data with `read(size)`, so only
+    the chunk being sent (i.e., one encoded batch) is kept in memory.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        Data to be read.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = bytes(self._buffer) + b"".join(self._chunks)
+            self._buffer = memoryview(b"")
+            return data
+        while len(self._buffer) == 0:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return b""
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return bytes(data)
+
+    def readline(self, size=-1):
+        # required by the file protocol check of psycopg2 but unused for COPY
+        return self.read(size)
+
+
+def iter_record_batches(data, model, batch_size=100_000, fill_defaults=True):
+    """
+    Iterate over record batches cast to the types of a model.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame, pyarrow.Table, pyarrow.RecordBatch, pyarrow.RecordBatchReader, or iterable
+        Input data. An iterable may yield DataFrames, tables, or record batches.
+    model : sqlalchemy.orm.DeclarativeMeta
+        One of the targetdb models.
+    batch_size : int, optional
+        Maximum number of rows per batch. Defaults to 100,000.
+    fill_defaults : bool, optional
+        Passed to `cast_to_model`. Defaults to True.
+
+    Yields
+    ------
+    batch : pyarrow.RecordBatch
+        Batches with the schema given by `arrow_schema`.
+
+    Notes
+    -----
+    A DataFrame is converted slice by slice, so that at most one batch is
+    held in the Arrow format at a time.
+    """
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, data.index.size, batch_size):
+            yield from dataframe_to_arrow(
+                data.iloc[start : start + batch_size],
+                model,
+                fill_defaults=fill_defaults,
+            ).to_batches()
+    elif isinstance(data, pa.Table):
+        for batch in data.to_batches(max_chunksize=batch_size):
+            yield cast_to_model(batch, model, fill_defaults=fill_defaults)
+    elif isinstance(data, pa.RecordBatch):
+        for start in range(0, data.num_rows, batch_size):
+            yield cast_to_model(
+                data.slice(start, batch_size), model, fill_defaults=fill_defaults
+            )
+    else:
+        for item in data:
+            yield from iter_record_batches(
+                item, model, batch_size=batch_size, fill_defaults=fill_defaults
+            )
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from loguru import logger
+from sqlalchemy import or_
+
+from . import models
+from .targetdb import rows_to_columnar, select_columns
+
+# metadata file of a snapshot, ignored by the parquet readers for the leading "_"
+SNAPSHOT_METADATA = "_snapshot.json"
+SNAPSHOT_FORMAT_VERSION = 1
+
+# columns compared with the watermark in the incremental sync
+TIMESTAMP_COLUMNS = ["created_at", "updated_at"]
+
+
+def sync_snapshot(
+    db,
+    tablename,
+    snapshot_dir,
+    name=None,
+    filters=None,
+    full=False,
+    reconcile=None,
+    reconcile_interval=timedelta(days=1),
+    overlap=timedelta(hours=1),
+    n_partitions=16,
+    batch_size=100_000,
+):
+    """
+    Materialize a table in a local parquet dataset and keep it up to date.
+
+    Parameters
+    ----------
+    db : TargetDB
+        A connected TargetDB instance.
+    tablename : str
+        Name of the table.
+    snapshot_dir : str or pathlib.Path
+        Directory of the snapshots. The snapshot is written to
+        `snapshot_dir/name`.
+    name : str, optional
+        Name of the snapshot. Defaults to `tablename`.
+    filters : dict, optional
+        Filters of the rows in the snapshot as in `TargetDB.iter_table`
+        (e.g., `{"version": "3.3"}`). Defaults to None (all rows).
+    full : bool, optional
+        If True, the snapshot is rebuilt from scratch. Defaults to False.
+    reconcile : bool, optional
+        If True, the primary keys of the snapshot are compared with those in
+        the database after the incremental sync. If None, they are compared if
+        `reconcile_interval` has passed since the last comparison. Defaults to None.
+    reconcile_interval : datetime.timedelta, optional
+        Interval of the reconciliation with `reconcile=None`. Defaults to 1 day.
+    overlap : datetime.timedelta, optional
+        Rows with `created_at` or `updated_at` later than the watermark minus
+        `overlap` are fetched in the incremental sync. Defaults to 1 hour.
+    n_partitions : int, optional
+        Number of parquet files the rows are split into by the first primary
+        key column. A table with a non-integer primary key is written in a
+        single file. Defaults to 16.
+    batch_size : int, optional
+        Number of rows fetched at a time. Defaults to 100000.
+
+    Returns
+    -------
+    metadata : dict
+        The metadata of the snapshot, also written to `_snapshot.json` in the
+        snapshot directory. The "last_sync" item has the mode ("full" or
+        "incremental") and the numbers of the rows written and deleted.
+
+    Notes
+    -----
+    The first sync (and one with `full`, or with `filters` different from
+    those of the existing snapshot) fetches all of the rows and replaces the
+    snapshot directory at once. The following syncs fetch only the rows of
+    which `created_at` or `updated_at` is later than the watermark, the
+    latest of these timestamps already in the snapshot, and rewrite the
+    parquet files containing their primary keys. Rows deleted from the
+    database, or moved out of `filters` by an update, are detected only by
+    the reconciliation, which also fetches any rows missing in the snapshot
+    (e.g., those committed with a timestamp earlier than the watermark minus
+    `overlap`). `updated_at` is set by updates through SQLAlchemy (e.g.,
+    `TargetDB.update`), so rows updated by raw SQL without setting it are not
+    fetched until the next rebuild. A table without the timestamp columns is
+    always rebuilt.
+
+    A file is replaced only after it is completely written and the watermark
+    is advanced only after all of the files are replaced, so an interrupted
+    sync is redone by the next one. Only one sync of a snapshot may run at a time.
+    """
+    model = getattr(models, tablename)
+    name = tablename if name is None else name
+    table_dir = Path(snapshot_dir) / name
+    # normalized so that the filters can be compared with the saved ones
+    filters = json.loads(
+        json.dumps(
+            filters or {},
+            default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o),
+        )
+    )
+    stmt, columns = select_columns(model, **filters)
+    key = [c.name for c in model.__table__.primary_key.columns]
+    has_timestamps = all(c in columns for c in TIMESTAMP_COLUMNS)
+    if model.__table__.columns[key[0]].type.python_type is not int:
+        n_partitions = 1
+
+    metadata = _read_metadata(table_dir)
+    if metadata is None:
+        full = True
+    elif metadata["filters"] != filters:
+        logger.info(f"Filters of the snapshot {name} are changed. Rebuild the snapshot")
+        full = True
+    elif not has_timestamps:
+        logger.info(f"No timestamp columns in {tablename}. Rebuild the snapshot")
+        full = True
+
+    t_begin = time.time()
+    now = datetime.now(UTC)
+    if full:
+        n_rows, watermark = _build_snapshot(
+            db, stmt, model, columns, table_dir, key, n_partitions, batch_size
+        )
+        metadata = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "table": tablename,
+            "filters": filters,
+            "key": key,
+            "n_partitions": n_partitions,
+            "watermark": watermark,
+            "reconciled_at": now.isoformat(),
+            "last_sync": {"mode": "full", "n_written": n_rows, "n_deleted": 0},
+        }
+    else:
+        n_partitions = metadata["n_partitions"]
+        watermark = metadata["watermark"]
+        if watermark is not None:
+            since = datetime.fromisoformat(watermark) - overlap
+            stmt_delta = stmt.filter(
+                or_(model.created_at >= since, model.updated_at >= since)
+            )
+        else:
+            # no timestamps in the snapshot yet
+            stmt_delta = stmt
+        tb_delta = _fetch_arrow(db, stmt_delta, model, columns, batch_size)
+        _apply_changes(table_dir, key, n_partitions, upserts=tb_delta)
+        watermark = _latest_timestamp(tb_delta, watermark)
+        n_written, n_deleted = tb_delta.num_rows, 0
+        logger.info(
+            f"Fetched {n_written} rows updated since the watermark {metadata['watermark']}"
+        )
+
+        if reconcile is None:
+            reconcile = (
+                now - datetime.fromisoformat(metadata["reconciled_at"])
+                >= reconcile_interval
+            )
+        if reconcile:
+            n_missing, n_deleted = _reconcile_snapshot(
+                db, tablename, stmt, model, columns, table_dir, key, n_partitions
+            )
+            n_written += n_missing
+            metadata["reconciled_at"] = now.isoformat()
+
+        n_rows = _count_rows(table_dir)
+        metadata["watermark"] = watermark
+        metadata["last_sync"] = {
+            "mode": "incremental",
+            "n_written": n_written,
+            "n_deleted": n_deleted,
+        }
+
+    metadata["synced_at"] = now.isoformat()
+    metadata["n_rows"] = n_rows
+    _write_metadata(table_dir, metadata)
+    logger.info(
+        f"Synced the snapshot {name} ({metadata['last_sync']['mode']}) of {n_rows} rows "
+        f"in {time.time() - t_begin:.2f} s: {metadata['last_sync']}"
+    )
+    return metadata
+
+
+def read_snapshot(snapshot_dir, name, columns=None, filters=None):
+    """
+    Read a snapshot written by `sync_snapshot`.
+
+    Parameters
+    ----------
+    snapshot_dir : str or pathlib.Path
+        Directory of the snapshots.
+    name : str
+        Name of the snapshot.
+    columns : list of str, optional
+        Columns to read. All columns are read if None.
+    filters : pyarrow.compute.Expression or list, optional
+        Row filters passed to `pyarrow.parquet.read_table`
+        (e.g., `[("psf_mag_r", "<", 18.0)]`). Defaults to None.
+
+    Returns
+    -------
+    table : pyarrow.Table
+        The rows of the snapshot. The order of the rows is not defined.
+
+    Raises
+    ------
+    ValueError
+        If the snapshot does not exist.
+    """
+    table_dir = Path(snapshot_dir) / name
+    if _read_metadata(table_dir) is None:
+        logger.error(f"Snapshot not found: {table_dir}")
+        raise ValueError(f"Snapshot not found: {table_dir}")
+    return pq.read_table(table_dir, columns=columns, filters=filters, memory_map=True)
+
+
+def _part_path(table_dir, i):
+    return Path(table_dir) / f"part-{i:05d}.parquet"
+
+
+def _partition_ids(tb, key, n_partitions):
+    if n_partitions == 1:
+        return np.zeros(tb.num_rows, dtype=np.int64)
+    return np.asarray(tb.column(key[0])) % n_partitions
+
+
+def _read_metadata(table_dir):
+    path = Path(table_dir) / SNAPSHOT_METADATA
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_metadata(table_dir, metadata):
+    path = Path(table_dir) / SNAPSHOT_METADATA
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _latest_timestamp(tb, watermark=None):
+    """Return the latest created_at/updated_at in tb and watermark as ISO string."""
+    values = [] if watermark is None else [datetime.fromisoformat(watermark)]
+    for c in TIMESTAMP_COLUMNS:
+        if c in tb.column_names and tb.num_rows > 0:
+            value = pc.max(tb.column(c)).as_py()
+            if value is not None:
+                values.append(value)
+    return max(values).isoformat() if values else None
+
+
+def _fetch_arrow(db, stmt, model, columns, batch_size):
+    batches = list(db._iter_select(stmt, model, columns, batch_size, as_arrow=True))
+    if len(batches) == 0:
+        return rows_to_columnar([], model, columns, as_arrow=True)
+    return pa.Table.from_batches(batches)
+
+
+def _count_rows(table_dir):
+    return sum(
+        pq.read_metadata(path).num_rows
+        for path in sorted(Path(table_dir).glob("part-*.parquet"))
+    )
+
+
+def _build_snapshot(db, stmt, model, columns, table_dir, key, n_partitions, batch_size):
+    """Write all rows of stmt to a new directory and swap it with table_dir."""
+    table_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=table_dir.parent, prefix=f".{table_dir.name}-"))
+    schema = rows_to_columnar([], model, columns, as_arrow=True).schema
+    writers = {}
+    n_rows = 0
+    watermark = None
+    try:
+        for batch in db._iter_select(stmt, model, columns, batch_size, as_arrow=True):
+            tb = pa.Table.from_batches([batch])
+            watermark = _latest_timestamp(tb, watermark)
+            parts = _partition_ids(tb, key, n_partitions)
+            for i in np.unique(parts):
+                if i not in writers:
+                    writers[i] = pq.ParquetWriter(_part_path(tmp_dir, i), schema)
+                writers[i].write_table(tb.filter(pa.array(parts == i)))
+            n_rows += tb.num_rows
+        for writer in writers.values():
+            writer.close()
+        if len(writers) == 0:
+            # an empty file keeps the schema of the snapshot
+            pq.write_table(schema.empty_table(), _part_path(tmp_dir, 0))
+
+        old_dir = None
+        if table_dir.exists():
+            old_dir = tmp_dir / f".{table_dir.name}.old"
+            table_dir.rename(old_dir)
+        tmp_dir.rename(table_dir)
+        if old_dir is not None:
+            shutil.rmtree(table_dir / old_dir.name)
+    except Exception:
+        for writer in writers.values():
+            writer.close()
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        raise
+    logger.info(f"Wrote {n_rows} rows in {len(writers)} files to {table_dir}")
+    return n_rows, watermark
+
+
+def _apply_changes(table_dir, key, n_partitions, upserts=None, deletes=None):
+    """
+    Write upserts and remove deletes (key columns) in the files of table_dir.
+
+    Only the files of the partitions of the changed keys are rewritten.
+    """
+    changes = [tb for tb in [upserts, deletes] if tb is not None and tb.num_rows > 0]
+    if len(changes) == 0:
+        return
+    parts = [_partition_ids(tb, key, n_partitions) for tb in changes]
+    for i in np.unique(np.concatenate(parts)):
+        path = _part_path(table_dir, i)
+        key_schema = changes[0].select(key).schema
+        changed_keys = pa.concat_tables(
+            [
+                tb.select(key).filter(pa.array(p == i)).cast(key_schema)
+                for tb, p in zip(changes, parts, strict=True)
+            ]
+        )
+        tb = pq.read_table(path) if path.exists() else None
+        if tb is not None:
+            # rows are looked up with the key columns only
+            tb_keys = tb.select(key).append_column(
+                "_row", pa.array(np.arange(tb.num_rows))
+            )
+            kept = tb_keys.join(changed_keys, keys=key, join_type="left anti")
+            tb = tb.take(np.sort(kept.column("_row").to_numpy()))
+        if upserts is not None and upserts.num_rows > 0:
+            new_rows = upserts.filter(pa.array(parts[0] == i))
+            tb = (
+                new_rows
+                if tb is None
+                else pa.concat_tables([tb, new_rows.cast(tb.schema)])
+            )
+        if tb is None:
+            continue
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        pq.write_table(tb, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def _reconcile_snapshot(
+    db, tablename, stmt, model, columns, table_dir, key, n_partitions
+):
+    """Delete rows not in the database and add missing ones. Return the numbers."""
+    # the filters of stmt are kept with only the key columns selected
+    key_stmt = stmt.with_only_columns(*[getattr(model, c) for c in key])
+    server_keys = _fetch_arrow(db, key_stmt, model, key, 100_000)
+    local_keys = pq.read_table(table_dir, columns=key)
+
+    deletes = local_keys.join(server_keys, keys=key, join_type="left anti")
+    missing = server_keys.join(local_keys, keys=key, join_type="left anti")
+    upserts = None
+    if missing.num_rows > 0:
+        upserts = db.fetch_by_keys(
+            tablename, missing.to_pandas(), columns=columns, as_arrow=True
+        )
+    _apply_changes(table_dir, key, n_partitions, upserts=upserts, deletes=deletes)
+    logger.info(
+        f"Reconciled {local_keys.num_rows} rows in the snapshot with {server_keys.num_rows} "
+        f"rows in the database: {missing.num_rows} added, {deletes.num_rows} deleted"
+    )
+    return missing.num_rows, deletes.num_rows
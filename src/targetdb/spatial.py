@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+
+# Upper limit of the number of grid cells along each axis, so that the cell
+# coordinates can be packed into a single int64 key.
+GRID_MAX_CELLS = 2**20
+
+# Neighbouring cell offsets visited when pairing points. Only one of each
+# (offset, -offset) pair is needed as pairs are unordered; (0, 0, 0) is the cell
+# itself.
+_HALF_OFFSETS = [
+    (dx, dy, dz)
+    for dx in (-1, 0, 1)
+    for dy in (-1, 0, 1)
+    for dz in (-1, 0, 1)
+    if (dx, dy, dz) >= (0, 0, 0)
+]
+
+
+def check_radec(ra, dec):
+    """
+    Check that equatorial coordinates are finite.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degree.
+    dec : array_like
+        Declination in degree.
+
+    Returns
+    -------
+    ra, dec : numpy.ndarray
+        The coordinates as float64 arrays.
+
+    Raises
+    ------
+    ValueError
+        If any of the coordinates is NaN or infinite, which would otherwise
+        end up in an arbitrary HEALPix pixel or grid cell.
+    """
+    ra = np.asarray(ra, dtype=np.float64)
+    dec = np.asarray(dec, dtype=np.float64)
+    n_invalid = np.count_nonzero(~(np.isfinite(ra) & np.isfinite(dec)))
+    if n_invalid > 0:
+        raise ValueError(f"ra and dec must be finite: {n_invalid} positions are not")
+    return ra, dec
+
+
+def radec_to_xyz(ra, dec):
+    """
+    Convert equatorial coordinates to unit vectors.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degree.
+    dec : array_like
+        Declination in degree.
+
+    Returns
+    -------
+    xyz : numpy.ndarray
+        Unit vectors with the shape of (n, 3).
+
+    Raises
+    ------
+    ValueError
+        If any of the coordinates is not finite.
+    """
+    ra, dec = check_radec(ra, dec)
+    ra = np.deg2rad(ra)
+    dec = np.deg2rad(dec)
+    cos_dec = np.cos(dec)
+    return np.column_stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)])
+
+
+def xyz_to_radec(xyz):
+    """
+    Convert (not necessarily unit) vectors to equatorial coordinates.
+
+    Parameters
+    ----------
+    xyz : array_like
+        Vectors with the shape of (n, 3).
+
+    Returns
+    -------
+    ra : numpy.ndarray
+        Right ascension in degree in [0, 360).
+    dec : numpy.ndarray
+        Declination in degree.
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    ra = np.rad2deg(np.arctan2(xyz[:, 1], xyz[:, 0])) % 360.0
+    dec = np.rad2deg(np.arctan2(xyz[:, 2], np.hypot(xyz[:, 0], xyz[:, 1])))
+    return ra, dec
+
+
+def _spread_bits(v):
+    # interleave zeros between the lower 32 bits of v
+    v = v & 0xFFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def check_nside(nside):
+    """
+    Check a HEALPix resolution parameter.
+
+    Parameters
+    ----------
+    nside : int
+        HEALPix resolution parameter.
+
+    Returns
+    -------
+    nside : int
+        The nside as int.
+
+    Raises
+    ------
+    ValueError
+        If nside is not a power of 2 up to 2**29.
+    """
+    nside = int(nside)
+    if nside < 1 or nside > 2**29 or nside & (nside - 1) != 0:
+        raise ValueError(f"nside must be a power of 2 up to 2**29: {nside}")
+    return nside
+
+
+def healpix_index(ra, dec, nside):
+    """
+    Compute HEALPix pixel indices in the NESTED scheme.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degree.
+    dec : array_like
+        Declination in degree.
+    nside : int
+        HEALPix resolution parameter, a power of 2 up to 2**29.
+
+    Returns
+    -------
+    ipix : numpy.ndarray
+        Pixel indices (int64) in [0, 12 * nside**2). The same as
+        `healpy.ang2pix(nside, ra, dec, nest=True, lonlat=True)`.
+
+    Raises
+    ------
+    ValueError
+        If nside is not a power of 2 up to 2**29, or if any of the coordinates
+        is not finite.
+
+    Notes
+    -----
+    A pixel of nside is divided into the four pixels of 2 * nside with the
+    indices 4 * ipix to 4 * ipix + 3, so that pixels of a coarser resolution
+    are obtained by `ipix >> (2 * k)`.
+    """
+    nside = check_nside(nside)
+    ra, dec = check_radec(ra, dec)
+
+    ra = np.deg2rad(ra) % (2.0 * np.pi)
+    dec = np.deg2rad(dec)
+    z = np.sin(dec)
+    za = np.abs(z)
+    tt = np.minimum(ra / (0.5 * np.pi), np.nextafter(4.0, 0.0))
+
+    # equatorial region, |z| <= 2/3
+    temp1 = nside * (0.5 + tt)
+    temp2 = nside * (0.75 * z)
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ifp = jp // nside
+    ifm = jm // nside
+    face_eq = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix_eq = jm & (nside - 1)
+    iy_eq = nside - (jp & (nside - 1)) - 1
+
+    # polar regions; cos(dec) is used near the poles for the precision
+    ntt = np.minimum(tt.astype(np.int64), 3)
+    tp = tt - ntt
+    with np.errstate(invalid="ignore"):
+        tmp = np.where(
+            za < 0.99,
+            nside * np.sqrt(3.0 * (1.0 - za)),
+            nside * np.cos(dec) / np.sqrt((1.0 + za) / 3.0),
+        )
+    jp_pol = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm_pol = np.minimum(((1.0 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z > 0
+    face_pol = np.where(north, ntt, ntt + 8)
+    ix_pol = np.where(north, nside - jm_pol - 1, jp_pol)
+    iy_pol = np.where(north, nside - jp_pol - 1, jm_pol)
+
+    equatorial = za <= 2.0 / 3.0
+    face = np.where(equatorial, face_eq, face_pol)
+    ix = np.where(equatorial, ix_eq, ix_pol)
+    iy = np.where(equatorial, iy_eq, iy_pol)
+    return face * nside * nside + _spread_bits(ix) + (_spread_bits(iy) << 1)
+
+
+def in_hexagon(ra, dec, ra_center, dec_center, pa, radius):
+    """
+    Test whether positions are in a regular hexagon on the sky.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degree.
+    dec : array_like
+        Declination in degree.
+    ra_center, dec_center : float
+        The center of the hexagon in degree.
+    pa : float
+        The position angle (east of north) of a vertex in degree.
+    radius : float
+        The angular distance from the center to the vertices in degree.
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        True for the positions in (or on the edges of) the hexagon.
+
+    Notes
+    -----
+    The hexagon is defined in the gnomonic projection at the center, which
+    maps great circles to straight lines, so that its edges are great circle
+    arcs between the vertices.
+    """
+    ra = np.deg2rad(np.asarray(ra, dtype=np.float64))
+    dec = np.deg2rad(np.asarray(dec, dtype=np.float64))
+    ra0, dec0 = np.deg2rad(ra_center), np.deg2rad(dec_center)
+
+    cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(ra - ra0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xi = np.cos(dec) * np.sin(ra - ra0) / cos_c
+        eta = (
+            np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(ra - ra0)
+        ) / cos_c
+
+    # rotate the vertex at pa onto the u axis; the edges are then normal to the
+    # directions at 30, 90, and 150 degree from it (and the opposite ones)
+    phi = np.deg2rad(pa)
+    u = eta * np.cos(phi) + xi * np.sin(phi)
+    v = xi * np.cos(phi) - eta * np.sin(phi)
+    apothem = np.tan(np.deg2rad(radius)) * np.cos(np.pi / 6)
+    mask = cos_c > 0
+    for angle in np.deg2rad([30.0, 90.0, 150.0]):
+        with np.errstate(invalid="ignore"):
+            mask &= np.abs(u * np.cos(angle) + v * np.sin(angle)) <= apothem
+    return mask
+
+
+def match_pointings(ra, dec, ra_pointing, dec_pointing, radius, pa=None):
+    """
+    Assign positions to the fields of view of pointings they fall in.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension of the positions in degree.
+    dec : array_like
+        Declination of the positions in degree.
+    ra_pointing, dec_pointing : array_like
+        Centers of the pointings in degree.
+    radius : float
+        Radius of the fields of view in degree.
+    pa : array_like, optional
+        Position angles of the pointings in degree. If given, the fields of view
+        are the hexagons of `in_hexagon` rather than circles, except for the
+        pointings with NaN. Defaults to None.
+
+    Returns
+    -------
+    index : numpy.ndarray
+        Indices of the positions.
+    pointing_index : numpy.ndarray
+        Indices of the pointings, in ascending order. A position in the
+        overlap of several pointings appears once for each of them.
+    separation : numpy.ndarray
+        Angular distances from the pointing centers in degree.
+
+    Notes
+    -----
+    The positions are sorted by declination once, so that only those in the
+    declination band of each pointing are compared with its center.
+    """
+    dec = np.asarray(dec, dtype=np.float64)
+    ra_pointing = np.atleast_1d(np.asarray(ra_pointing, dtype=np.float64))
+    dec_pointing = np.atleast_1d(np.asarray(dec_pointing, dtype=np.float64))
+    pa = np.full(ra_pointing.size, np.nan) if pa is None else np.atleast_1d(pa)
+
+    order = np.argsort(dec, kind="stable")
+    dec_sorted = dec[order]
+    xyz = radec_to_xyz(np.asarray(ra, dtype=np.float64)[order], dec_sorted)
+    xyz_pointing = radec_to_xyz(ra_pointing, dec_pointing)
+    cos_radius = np.cos(np.deg2rad(radius))
+
+    indices, pointing_indices, separations = [], [], []
+    for k in range(ra_pointing.size):
+        begin, end = np.searchsorted(
+            dec_sorted, [dec_pointing[k] - radius, dec_pointing[k] + radius]
+        )
+        idx = begin + np.flatnonzero(xyz[begin:end] @ xyz_pointing[k] >= cos_radius)
+        if not np.isnan(pa[k]):
+            idx = idx[
+                in_hexagon(
+                    *xyz_to_radec(xyz[idx]),
+                    ra_pointing[k],
+                    dec_pointing[k],
+                    pa[k],
+                    radius,
+                )
+            ]
+        # the chord length is accurate for small separations unlike the arccos
+        chord = np.linalg.norm(xyz[idx] - xyz_pointing[k], axis=1)
+        indices.append(order[idx])
+        pointing_indices.append(np.full(idx.size, k, dtype=np.int64))
+        separations.append(np.rad2deg(2.0 * np.arcsin(chord / 2.0)))
+
+    if not indices:
+        return (
+            np.array([], dtype=np.int64),
+            np.array([], dtype=np.int64),
+            np.array([], dtype=np.float64),
+        )
+    return (
+        np.concatenate(indices),
+        np.concatenate(pointing_indices),
+        np.concatenate(separations),
+    )
+
+
+def find_pairs(ra, dec, radius, max_candidates=10_000_000):
+    """
+    Find all pairs of positions separated by at most a given angle.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degree.
+    dec : array_like
+        Declination in degree.
+    radius : float
+        The maximum separation in degree.
+    max_candidates : int, optional
+        The maximum number of candidate pairs examined at a time, which bounds
+        the memory usage. Defaults to 10,000,000.
+
+    Returns
+    -------
+    i, j : numpy.ndarray
+        Indices of the pairs with i < j.
+
+    Raises
+    ------
+    ValueError
+        If any of the coordinates is not finite.
+
+    Notes
+    -----
+    The positions are converted to unit vectors and bucketed into a cubic grid
+    with the cell size not smaller than the chord length corresponding to the
+    radius. The pairs are then searched for only within each cell and between
+    neighbouring cells, so that the cost scales with the number of positions
+    rather than its square. Unlike a grid in (RA, Dec), the grid has no
+    singularities at the poles or at RA = 0.
+    """
+    xyz = radec_to_xyz(ra, dec)
+    n = xyz.shape[0]
+    if n < 2:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    chord2 = (2.0 * np.sin(np.deg2rad(radius) / 2.0)) ** 2
+    cell_size = max(np.sqrt(chord2), 2.0 / (GRID_MAX_CELLS - 4))
+    n_cells = int(np.floor(2.0 / cell_size)) + 4
+    cells = np.floor((xyz + 1.0) / cell_size).astype(np.int64) + 1
+    keys = (cells[:, 0] * n_cells + cells[:, 1]) * n_cells + cells[:, 2]
+
+    order = np.argsort(keys, kind="stable")
+    xyz_sorted = xyz[order]
+    cell_keys, starts, counts = np.unique(
+        keys[order], return_index=True, return_counts=True
+    )
+
+    pairs_i, pairs_j = [], []
+    for dx, dy, dz in _HALF_OFFSETS:
+        neighbour_keys = cell_keys + (dx * n_cells + dy) * n_cells + dz
+        idx = np.searchsorted(cell_keys, neighbour_keys)
+        idx[idx == cell_keys.size] = 0
+        cell_a = np.flatnonzero(cell_keys[idx] == neighbour_keys)
+        cell_b = idx[cell_a]
+        n_candidates = counts[cell_a] * counts[cell_b]
+
+        if cell_a.size == 0:
+            continue
+
+        # process the cell pairs in chunks to bound the number of candidates
+        cum_candidates = np.cumsum(n_candidates)
+        bounds = np.searchsorted(
+            cum_candidates,
+            np.arange(max_candidates, cum_candidates[-1], max_candidates),
+        )
+        bounds = np.unique(np.concatenate([[0], bounds, [cell_a.size]]))
+        for begin, end in zip(bounds[:-1], bounds[1:], strict=True):
+            a, b, nc = cell_a[begin:end], cell_b[begin:end], n_candidates[begin:end]
+            # expand each cell pair into all combinations of its members
+            k = np.arange(nc.sum()) - np.repeat(np.cumsum(nc) - nc, nc)
+            nb = np.repeat(counts[b], nc)
+            ia = np.repeat(starts[a], nc) + k // nb
+            ib = np.repeat(starts[b], nc) + k % nb
+            if (dx, dy, dz) == (0, 0, 0):
+                keep = ia < ib
+                ia, ib = ia[keep], ib[keep]
+            d2 = np.sum((xyz_sorted[ia] - xyz_sorted[ib]) ** 2, axis=1)
+            keep = d2 <= chord2
+            pairs_i.append(order[ia[keep]])
+            pairs_j.append(order[ib[keep]])
+
+    i = np.concatenate(pairs_i) if pairs_i else np.array([], dtype=np.int64)
+    j = np.concatenate(pairs_j) if pairs_j else np.array([], dtype=np.int64)
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def connected_components(n, i, j):
+    """
+    Label the connected components of a graph given as a list of edges.
+
+    Parameters
+    ----------
+    n : int
+        The number of nodes.
+    i, j : array_like
+        The end nodes of the edges.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        Component labels from 0 to (number of components - 1), ordered by the
+        smallest node index in each component.
+    """
+    labels = np.arange(n, dtype=np.int64)
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    while True:
+        # hook the root with the larger label onto the smaller one
+        li, lj = labels[i], labels[j]
+        if np.array_equal(li, lj):
+            break
+        lmin = np.minimum(li, lj)
+        np.minimum.at(labels, li, lmin)
+        np.minimum.at(labels, lj, lmin)
+        # compress the paths to the roots
+        while True:
+            parent = labels[labels]
+            if np.array_equal(parent, labels):
+                break
+            labels = parent
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def friends_of_friends(ra, dec, radius):
+    """
+    Group positions by the friends-of-friends (single-linkage) algorithm.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degree.
+    dec : array_like
+        Declination in degree.
+    radius : float
+        The linking length in degree.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        Group labels from 0. Positions without a neighbour within the radius
+        form their own groups.
+    """
+    i, j = find_pairs(ra, dec, radius)
+    return connected_components(np.size(ra), i, j)
+
+
+def make_cluster_table(
+    ra,
+    dec,
+    labels,
+    target_id,
+    input_catalog_id=None,
+    min_size=2,
+    cluster_id_start=1,
+):
+    """
+    Make rows of the cluster table from group labels.
+
+    Parameters
+    ----------
+    ra : array_like
+        Right ascension in degree.
+    dec : array_like
+        Declination in degree.
+    labels : array_like
+        Group labels (e.g., from `friends_of_friends`).
+    target_id : array_like
+        Identifiers of the positions written in the target_id column.
+    input_catalog_id : array_like, optional
+        Input catalog IDs of the positions. Defaults to None.
+    min_size : int, optional
+        The minimum number of members of a group to be output. Defaults to 2.
+    cluster_id_start : int, optional
+        The first cluster_id. Defaults to 1.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        One row per member with the columns of the cluster table. Clusters are
+        numbered consecutively in the order of their first member.
+
+    Notes
+    -----
+    The cluster centre is the normalized mean of the unit vectors of the members,
+    so that it is well defined across RA = 0. `d_ra` is wrapped into [-180, 180).
+    """
+    ra = np.asarray(ra, dtype=np.float64)
+    dec = np.asarray(dec, dtype=np.float64)
+    _, labels, n_members = np.unique(labels, return_inverse=True, return_counts=True)
+
+    # renumber the clusters with enough members in the order of appearance
+    is_member = n_members[labels] >= min_size
+    _, first = np.unique(labels[is_member], return_index=True)
+    cluster_labels = labels[is_member][np.sort(first)]
+    cluster_ids = np.full(n_members.size, -1, dtype=np.int64)
+    cluster_ids[cluster_labels] = cluster_id_start + np.arange(cluster_labels.size)
+
+    xyz = radec_to_xyz(ra, dec)
+    xyz_sum = np.zeros((n_members.size, 3))
+    np.add.at(xyz_sum, labels, xyz)
+    ra_cluster, dec_cluster = xyz_to_radec(xyz_sum)
+
+    idx = np.flatnonzero(is_member)
+    idx = idx[np.argsort(cluster_ids[labels[idx]], kind="stable")]
+    lab = labels[idx]
+    df = pd.DataFrame(
+        {
+            "cluster_id": cluster_ids[lab],
+            "target_id": np.asarray(target_id)[idx],
+            "n_targets": n_members[lab].astype(np.int32),
+            "ra_cluster": ra_cluster[lab],
+            "dec_cluster": dec_cluster[lab],
+            "d_ra": (ra[idx] - ra_cluster[lab] + 180.0) % 360.0 - 180.0,
+            "d_dec": dec[idx] - dec_cluster[lab],
+        }
+    )
+    if input_catalog_id is not None:
+        df["input_catalog_id"] = np.asarray(input_catalog_id)[idx]
+    return df
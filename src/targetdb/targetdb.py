@@ -1,14 +1,397 @@
 #!/usr/bin/env python
 
 import io
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 from loguru import logger
-from sqlalchemy import create_engine, select
+from sqlalchemy import (
+    UniqueConstraint,
+    column,
+    create_engine,
+    func,
+    or_,
+    select,
+    table,
+)
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import text
 
 from . import models
+from .pgcopy import (
+    CopyStream,
+    arrow_schema,
+    column_kind,
+    iter_copy_binary,
+    iter_record_batches,
+)
+from .spatial import check_nside, healpix_index, in_hexagon, match_pointings
+
+# Radius of the PFS field of view (the circumradius of the hexagon) in degree
+PFS_FIELD_RADIUS = 0.69
+
+# Extra column of the angular separation in degree returned by spatial queries
+SEPARATION_FIELD = pa.field("separation", pa.float64())
+
+# Extra column of the NESTED HEALPix pixel of (ra, dec) added by export_dataset
+HEALPIX_FIELD = pa.field("healpix", pa.int64())
+
+# Unique constraints on the natural keys used by TargetDB.upsert
+UPSERT_CONSTRAINTS = {
+    "target": "target_propid_obcode_key",
+    "sky": "sky_obj_id_input_catalog_id_version_key",
+    "fluxstd": "uq_obj_id_input_catalog_id_version",
+}
+
+
+# Engines shared within the process, keyed by the URL and the pool options,
+# see get_engine()
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_engine(
+    url,
+    pool_size=5,
+    max_overflow=10,
+    pool_pre_ping=False,
+    statement_timeout=None,
+):
+    """
+    Return the engine of a database shared within the process.
+
+    Parameters
+    ----------
+    url : str or sqlalchemy.engine.URL
+        The URL of the database.
+    pool_size : int, optional
+        The number of connections kept in the pool. Defaults to 5.
+    max_overflow : int, optional
+        The number of connections allowed in addition to `pool_size`.
+        Defaults to 10.
+    pool_pre_ping : bool, optional
+        If True, connections are tested when checked out of the pool, so that
+        those closed by the server are replaced. Defaults to False.
+    statement_timeout : int or str, optional
+        The `statement_timeout` of the sessions (in milliseconds if int, or with
+        a unit, e.g., "10min"). Defaults to None (the server default).
+
+    Returns
+    -------
+    engine : sqlalchemy.engine.Engine
+        The engine created at the first call with the same arguments.
+
+    Notes
+    -----
+    Reusing the engine across TargetDB instances and pipeline stages lets them
+    share pooled connections, so that each stage does not pay for TCP, SSL,
+    and authentication again. The engines are disposed by `dispose_engines`.
+    """
+    if not isinstance(url, str):
+        # str() of a URL object masks the password
+        url = url.render_as_string(hide_password=False)
+    key = (url, pool_size, max_overflow, pool_pre_ping, statement_timeout)
+    with _ENGINES_LOCK:
+        if key not in _ENGINES:
+            _ENGINES[key] = create_engine(
+                url,
+                **_engine_options(
+                    pool_size, max_overflow, pool_pre_ping, statement_timeout
+                ),
+            )
+        return _ENGINES[key]
+
+
+def dispose_engines():
+    """Dispose all engines returned by `get_engine` and clear the registry."""
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+
+
+def _engine_options(pool_size, max_overflow, pool_pre_ping, statement_timeout):
+    # keyword arguments of create_engine for the postgresql dialect
+    options = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_pre_ping": pool_pre_ping,
+    }
+    if statement_timeout is not None:
+        options["connect_args"] = {
+            "options": f"-c statement_timeout={statement_timeout}"
+        }
+    return options
+
+
+def upsert_keys(model):
+    """
+    Return the natural key columns of a model used to detect conflicts in upserts.
+
+    Parameters
+    ----------
+    model : sqlalchemy.orm.DeclarativeMeta
+        One of the targetdb models.
+
+    Returns
+    -------
+    keys : list of str
+        Columns of the constraint in `UPSERT_CONSTRAINTS`, or of the only
+        unique constraint of the table.
+
+    Raises
+    ------
+    ValueError
+        If the natural key of the table cannot be determined.
+    """
+    constraints = [
+        c for c in model.__table__.constraints if isinstance(c, UniqueConstraint)
+    ]
+    name = UPSERT_CONSTRAINTS.get(model.__tablename__)
+    if name is not None:
+        constraints = [c for c in constraints if c.name == name]
+    if len(constraints) != 1:
+        logger.error(f"No unique key for upsert in the {model.__tablename__} table")
+        raise ValueError(f"No unique key for upsert in the {model.__tablename__} table")
+    return [c.name for c in constraints[0].columns]
+
+
+def select_columns(model, columns=None, **kwargs):
+    """
+    Build a core SELECT of the mapped columns of a model.
+
+    Parameters
+    ----------
+    model : sqlalchemy.orm.DeclarativeMeta
+        One of the targetdb models.
+    columns : list of str, optional
+        Column names to select. All mapped columns are selected if None.
+    **kwargs
+        Equality filters (column name and value). A list, tuple, or array of
+        values matches any of them, and a dict with the "min" and/or "max" keys
+        is an inclusive range (e.g., `psf_mag_r={"max": 18.0}`).
+
+    Returns
+    -------
+    stmt : sqlalchemy.Select
+        The SELECT statement.
+    columns : list of str
+        The selected column names.
+
+    Raises
+    ------
+    ValueError
+        If a column is not defined in the model.
+    """
+    mapped_columns = [c.key for c in model.__mapper__.columns]
+    if columns is None:
+        columns = mapped_columns
+    else:
+        columns = list(columns)
+        unknown = [c for c in columns + list(kwargs) if c not in mapped_columns]
+        if unknown:
+            logger.error(f"Columns not found in {model.__tablename__}: {unknown}")
+            raise ValueError(f"Columns not found in {model.__tablename__}: {unknown}")
+
+    stmt = select(*[getattr(model, c) for c in columns])
+    for k, v in kwargs.items():
+        if isinstance(v, dict):
+            if "min" in v:
+                stmt = stmt.filter(getattr(model, k) >= v["min"])
+            if "max" in v:
+                stmt = stmt.filter(getattr(model, k) <= v["max"])
+        elif isinstance(v, (list, tuple, np.ndarray)):
+            stmt = stmt.filter(getattr(model, k).in_(list(v)))
+        else:
+            stmt = stmt.filter(getattr(model, k) == v)
+    return stmt, columns
+
+
+def radial_select(model, ra, dec, radius, columns=None, **kwargs):
+    """
+    Build a core SELECT of the rows of a model within a radius of a position.
+
+    Parameters
+    ----------
+    model : sqlalchemy.orm.DeclarativeMeta
+        One of the targetdb models with the `ra` and `dec` columns.
+    ra, dec : float
+        The center in degree.
+    radius : float
+        The radius in degree.
+    columns : list of str, optional
+        Column names to select. All mapped columns are selected if None.
+    **kwargs
+        Filters passed to `select_columns`.
+
+    Returns
+    -------
+    stmt : sqlalchemy.Select
+        The SELECT statement with the separation from the center in degree as
+        the last column.
+    columns : list of str
+        The selected column names except for the separation.
+
+    Notes
+    -----
+    The rows are selected with `q3c_radial_query`, so the Q3C extension is required.
+    """
+    # numpy scalars are not adapted by psycopg2 with numpy>=2
+    ra, dec, radius = float(ra), float(dec), float(radius)
+    stmt, columns = select_columns(model, columns=columns, **kwargs)
+    stmt = stmt.add_columns(
+        func.q3c_dist(model.ra, model.dec, ra, dec).label("separation")
+    ).where(func.q3c_radial_query(model.ra, model.dec, ra, dec, radius))
+    return stmt, columns
+
+
+def _check_field_options(tables, columns, filters):
+    # per-table columns and filters of fetch_field(s)
+    columns = columns or {}
+    filters = filters or {}
+    unknown = [t for t in list(columns) + list(filters) if t not in tables]
+    if unknown:
+        logger.error(f"columns or filters are given for tables not queried: {unknown}")
+        raise ValueError(
+            f"columns or filters are given for tables not queried: {unknown}"
+        )
+    return columns, filters
+
+
+def _with_positions(columns):
+    # add ra and dec to the selected columns for the tests on the client
+    if columns is None:
+        return None
+    return list(columns) + [c for c in ["ra", "dec"] if c not in columns]
+
+
+def _where_active(stmt, model):
+    # limit to the rows of active input catalogs
+    return stmt.where(
+        model.input_catalog_id.in_(
+            select(models.input_catalog.input_catalog_id).where(
+                models.input_catalog.active.is_(True)
+            )
+        )
+    )
+
+
+def compile_select(stmt, dialect):
+    """
+    Compile a core SELECT into SQL and parameters for a DBAPI cursor.
+
+    Parameters
+    ----------
+    stmt : sqlalchemy.sql.Select
+        The statement to compile.
+    dialect : sqlalchemy.engine.Dialect
+        The dialect of the engine.
+
+    Returns
+    -------
+    sql : str
+        The SQL with the IN lists of list filters rendered into plain placeholders.
+    params : dict
+        The parameters converted by the bind processors of the column types
+        (e.g., Enum members to labels), as SQLAlchemy does when it executes
+        the statement.
+    """
+    compiled = stmt.compile(dialect=dialect)
+    expanded = compiled._process_parameters_for_postcompile(compiled.construct_params())
+    processors = {**compiled._bind_processors, **expanded.processors}
+    params = {
+        name: processors[name](value) if name in processors else value
+        for name, value in expanded.parameters.items()
+    }
+    return expanded.statement, params
+
+
+def result_processors(model, columns, description, dialect):
+    """
+    Collect the SQLAlchemy result processors needed for raw DBAPI rows.
+
+    Parameters
+    ----------
+    model : sqlalchemy.orm.DeclarativeMeta
+        The model the columns belong to.
+    columns : list of str
+        Selected column names in the order of `description`.
+    description : sequence
+        `cursor.description` of the executed query.
+    dialect : sqlalchemy.engine.Dialect
+        The dialect of the engine.
+
+    Returns
+    -------
+    processors : dict
+        Column name and processor for the columns which need one (e.g., Enum).
+    """
+    processors = {}
+    for name, desc in zip(columns, description, strict=True):
+        sqltype = model.__table__.columns[name].type.dialect_impl(dialect)
+        processor = sqltype.result_processor(dialect, desc[1])
+        if processor is not None:
+            processors[name] = processor
+    return processors
+
+
+def rows_to_columnar(
+    rows, model, columns, processors=None, as_arrow=False, extra_fields=None
+):
+    """
+    Build a DataFrame or an Arrow table from raw DBAPI rows.
+
+    Parameters
+    ----------
+    rows : list of tuple
+        Rows of a SELECT of `columns`.
+    model : sqlalchemy.orm.DeclarativeMeta
+        The model the columns belong to.
+    columns : list of str
+        Column names in the order of the row fields.
+    processors : dict, optional
+        Result processors from `result_processors`, applied to the DataFrame columns.
+    as_arrow : bool, optional
+        If True, return a `pyarrow.Table` typed after the model. Defaults to False.
+    extra_fields : list of pyarrow.Field, optional
+        Fields following `columns` in the rows which are not columns of the model
+        (e.g., a computed distance).
+
+    Returns
+    -------
+    pandas.DataFrame or pyarrow.Table
+
+    Notes
+    -----
+    The DataFrame has the same values and dtypes as one built from ORM
+    instances (e.g., Enum members for Enum columns), while the Arrow table
+    keeps the raw values (e.g., Enum labels) with the types of `arrow_schema`.
+    """
+    extra_fields = extra_fields or []
+    if not as_arrow:
+        df = pd.DataFrame(rows, columns=columns + [f.name for f in extra_fields])
+        if df.index.size == 0:
+            return df
+        for name, processor in (processors or {}).items():
+            df[name] = [processor(v) for v in df[name]]
+        return df
+
+    schema = arrow_schema(model, columns)
+    for field in extra_fields:
+        schema = schema.append(field)
+    arrays = list(zip(*rows, strict=True)) if len(rows) > 0 else [()] * len(schema)
+    return pa.table(
+        [
+            pa.array(a, type=field.type, from_pandas=True)
+            for field, a in zip(schema, arrays, strict=True)
+        ],
+        schema=schema,
+    )
 
 
 class TargetDB:
@@ -22,16 +405,65 @@ class TargetDB:
         user=None,
         password=None,
         dialect="postgresql",
+        engine=None,
+        shared_engine=False,
+        pool_size=5,
+        max_overflow=10,
+        pool_pre_ping=False,
+        statement_timeout=None,
     ):
-        for param in [dbname, user, password]:
-            if param is None:
-                logger.error(f"{param} is not provided")
-                raise ValueError(f"{param} is not provided")
+        """
+        Description
+        -----------
+            Set up a connection to the PFS Target Database (made by `connect`)
+        Parameters
+        ----------
+            host, port, dbname, user, password, dialect : database parameters
+            engine            : `sqlalchemy.engine.Engine` (optional; an existing engine to use)
+            shared_engine     : `bool` (use the engine shared within the process, see `get_engine`)
+            pool_size         : `int` (number of connections kept in the pool)
+            max_overflow      : `int` (number of connections allowed in addition to `pool_size`)
+            pool_pre_ping     : `bool` (test connections when checked out of the pool)
+            statement_timeout : `int` or `string` (optional; `statement_timeout` of the sessions)
+        Note
+        ----
+            The database parameters are not needed with `engine`. An existing or
+            shared engine is not disposed by `close`, so that its pooled
+            connections can be reused by other instances.
+        """
+        self._engine = engine
+        self._engine_options = {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_pre_ping": pool_pre_ping,
+            "statement_timeout": statement_timeout,
+        }
+        self._shared_engine = shared_engine
 
-        self.dbinfo = f"{dialect}://{user}:{password}@{host}:{port}/{dbname}"
+        if engine is not None:
+            self.dbinfo = engine.url.render_as_string(hide_password=False)
+        else:
+            for param in [dbname, user, password]:
+                if param is None:
+                    logger.error(f"{param} is not provided")
+                    raise ValueError(f"{param} is not provided")
+
+            self.dbinfo = f"{dialect}://{user}:{password}@{host}:{port}/{dbname}"
+
+        # (tablename, key, id_column) -> DataFrame, see fetch_dimension()
+        self._dimension_cache = {}
+        # tables written in the current transaction (None for any table)
+        self._written_tables = set()
 
     def connect(self):
-        self.engine = create_engine(self.dbinfo)
+        if self._engine is not None:
+            self.engine = self._engine
+        elif self._shared_engine:
+            self.engine = get_engine(self.dbinfo, **self._engine_options)
+        else:
+            self.engine = create_engine(
+                self.dbinfo, **_engine_options(**self._engine_options)
+            )
         SessionClass = sessionmaker(self.engine)
         self.session = SessionClass()
         # print('connection to {0} started'.format(self.dbinfo))
@@ -43,8 +475,10 @@ class TargetDB:
             # Dispose the engine to release all pooled connections back to the database
             # server. Without this, SQLAlchemy's connection pool keeps the underlying
             # TCP sockets open until the engine is garbage-collected, which may never
-            # happen on abnormal process termination.
-            self.engine.dispose()
+            # happen on abnormal process termination. Engines given or shared are
+            # left to their owners.
+            if self._engine is None and not self._shared_engine:
+                self.engine.dispose()
         # print('connection to {0} closed'.format(self.dbinfo))
 
     def __enter__(self):
@@ -90,11 +524,43 @@ class TargetDB:
 
     def rollback(self):
         self.session.rollback()
+        # the caches of the other tables are still valid
+        if None in self._written_tables:
+            self.invalidate_dimension_cache()
+        else:
+            for tablename in self._written_tables:
+                self.invalidate_dimension_cache(tablename)
+        self._written_tables.clear()
+
+    def commit(self):
+        self.session.commit()
+        self._written_tables.clear()
+
+    def _mark_written(self, tablename=None):
+        # rows written in the session are visible in fetch_dimension until the
+        # transaction ends, and must be dropped from the cache on rollback
+        self.invalidate_dimension_cache(tablename)
+        self._written_tables.add(tablename)
+
+    def _end_transaction(self, dry_run=False, autocommit=True):
+        # With autocommit=False, the transaction is left open so that the caller
+        # can commit or roll back several operations at once.
+        if not autocommit:
+            return
+        if dry_run:
+            self.rollback()
+        else:
+            self.commit()
 
     # functionality to insert/update information into the database
 
     def insert_mappings(
-        self, tablename, mappings, return_defaults=False, dry_run=False
+        self,
+        tablename,
+        mappings,
+        return_defaults=False,
+        dry_run=False,
+        autocommit=True,
     ):
         """
         Description
@@ -104,21 +570,22 @@ class TargetDB:
         ----------
             tablename : `string`
             mappings : `dictionnary list`
+            autocommit : `bool`
+                If False, neither commit nor rollback is made (dry_run is ignored)
         Returns
         -------
             None
         """
         model = getattr(models, tablename)
+        self._mark_written(tablename)
         try:
             # print(mappings)
             self.session.bulk_insert_mappings(
                 model, mappings, return_defaults=return_defaults
             )
-            if dry_run:
-                self.session.rollback()
+            self._end_transaction(dry_run=dry_run, autocommit=autocommit)
+            if dry_run and autocommit:
                 return None
-            else:
-                self.session.commit()
 
             if return_defaults:
                 df_ret = pd.DataFrame.from_records(mappings)
@@ -127,10 +594,20 @@ class TargetDB:
                 return None
             # print(mappings)
         except Exception as e:
-            self.session.rollback()
+            self.rollback()
             raise e
 
-    def insert(self, tablename, dataframe, return_defaults=False, dry_run=False):
+    def insert(
+        self,
+        tablename,
+        dataframe,
+        return_defaults=False,
+        dry_run=False,
+        method="mappings",
+        batch_size=100_000,
+        autocommit=True,
+        on_conflict="update",
+    ):
         """
         Description
         -----------
@@ -139,6 +616,16 @@ class TargetDB:
         ----------
             tablename : `string`
             dataframe : `pandas.DataFrame`
+            method : `string` ("mappings", "copy", or "upsert")
+                "mappings" uses `bulk_insert_mappings`, "copy" streams the
+                data through the binary COPY protocol (see `insert_by_binary_copy`),
+                and "upsert" inserts or updates rows by the natural key (see `upsert`)
+            batch_size : `int`
+                Number of rows encoded at a time for the "copy" and "upsert" methods
+            on_conflict : `string` ("update" or "nothing")
+                Action on existing rows for the "upsert" method
+            autocommit : `bool`
+                If False, neither commit nor rollback is made (dry_run is ignored)
         Returns
         -------
             None
@@ -146,15 +633,292 @@ class TargetDB:
         ----
             Column labels of `dataframe` should be exactly the same as those of the table
         """
+        if method == "upsert":
+            if return_defaults:
+                logger.error("return_defaults is not supported by the upsert method")
+                raise ValueError(
+                    "return_defaults is not supported by the upsert method"
+                )
+            self.upsert(
+                tablename,
+                dataframe,
+                on_conflict=on_conflict,
+                batch_size=batch_size,
+                dry_run=dry_run,
+                autocommit=autocommit,
+            )
+            return None
+        elif method == "copy":
+            if return_defaults:
+                logger.error("return_defaults is not supported by the copy method")
+                raise ValueError("return_defaults is not supported by the copy method")
+            self.insert_by_binary_copy(
+                tablename,
+                dataframe,
+                batch_size=batch_size,
+                dry_run=dry_run,
+                autocommit=autocommit,
+            )
+            return None
+        elif method != "mappings":
+            logger.error(f"Unsupported insert method: {method}")
+            raise ValueError(f"Unsupported insert method: {method}")
+
         mappings_dict = dataframe.to_dict(orient="records")
         df_ret = self.insert_mappings(
-            tablename, mappings_dict, return_defaults=return_defaults, dry_run=dry_run
+            tablename,
+            mappings_dict,
+            return_defaults=return_defaults,
+            dry_run=dry_run,
+            autocommit=autocommit,
         )
         if return_defaults:
             return df_ret
         else:
             return None
 
+    def insert_by_binary_copy(
+        self, tablename, data, batch_size=100_000, dry_run=False, autocommit=True
+    ):
+        """
+        Description
+        -----------
+            Insert information into a table using COPY FROM in the binary format
+        Parameters
+        ----------
+            tablename  : `string`
+            data       : `pandas.DataFrame`, `pyarrow.Table`, `pyarrow.RecordBatchReader`,
+                         or an iterable of them
+            batch_size : `int`
+                Number of rows encoded at a time
+            autocommit : `bool`
+                If False, neither commit nor rollback is made (dry_run is ignored),
+                even on errors, so that the caller can roll back to a savepoint
+        Returns
+        -------
+            n_rows : `int`
+                Number of inserted rows
+        Note
+        ----
+            Only columns of the table are sent, and missing columns with
+            a scalar default in the model are filled with the default.
+            The data are streamed batch by batch in a single COPY statement,
+            so that the memory usage is about the size of one batch.
+            NULL, NaN, and NaT values are inserted as NULL.
+        """
+        model = getattr(models, tablename)
+        self._mark_written(tablename)
+        batches = iter_record_batches(data, model, batch_size=batch_size)
+        try:
+            n_rows = self._copy_record_batches(tablename, model, batches)
+            if n_rows is None:
+                logger.warning(f"No data to insert into the {tablename} table")
+                return 0
+            self._end_transaction(dry_run=dry_run, autocommit=autocommit)
+        except Exception as e:
+            if autocommit:
+                self.rollback()
+            raise e
+
+        return n_rows
+
+    def _copy_record_batches(self, tablename, model, batches, kinds=None):
+        """COPY record batches cast to `model` into a table in the binary format.
+
+        The field kinds are taken from `model` unless `kinds` is given.
+        Return the number of copied rows, or None if `batches` is empty.
+        The transaction is left open.
+        """
+        first = next(batches, None)
+        if first is None:
+            return None
+        if kinds is None:
+            table_columns = model.__table__.columns
+            kinds = [column_kind(table_columns[name]) for name in first.schema.names]
+
+        def _batches():
+            yield first
+            yield from batches
+
+        preparer = self.engine.dialect.identifier_preparer
+        colnames = ", ".join(preparer.quote(name) for name in first.schema.names)
+        sql = (
+            f"COPY {preparer.quote(tablename)} ({colnames}) "
+            "FROM STDIN WITH (FORMAT binary)"
+        )
+
+        cur = self.session.connection().connection.cursor()
+        try:
+            cur.copy_expert(
+                sql, CopyStream(iter_copy_binary(_batches(), kinds)), size=1 << 20
+            )
+            return cur.rowcount
+        finally:
+            cur.close()
+
+    def upsert(
+        self,
+        tablename,
+        data,
+        on_conflict="update",
+        batch_size=100_000,
+        dry_run=False,
+        autocommit=True,
+    ):
+        """
+        Description
+        -----------
+            Insert rows or update existing ones matched by the natural key of a table
+        Parameters
+        ----------
+            tablename   : `string`
+            data        : `pandas.DataFrame` or `pyarrow.Table`
+            on_conflict : `string`
+                "update" to overwrite existing rows with the input columns or
+                "nothing" to keep them
+            batch_size  : `int`
+                Number of rows processed at a time
+            autocommit  : `bool`
+                If False, neither commit nor rollback is made (dry_run is ignored),
+                also on errors
+        Returns
+        -------
+            counts : `pandas.DataFrame`
+                Numbers of input, inserted, and updated (or skipped) rows per batch
+        Note
+        ----
+            Each batch is copied in the binary format into a temporary table and
+            applied with `INSERT ... SELECT ... ON CONFLICT`. The conflict target
+            is the unique constraint in `UPSERT_CONSTRAINTS` (e.g., (proposal_id,
+            ob_code) for the target table). Only the columns given in `data` are
+            updated, and missing columns of new rows get the model defaults as
+            with `insert`. All batches are in the same transaction.
+            With on_conflict="update", an error is raised before any change if
+            the natural keys are duplicated in `data`, as PostgreSQL cannot
+            update a row twice in a statement. With on_conflict="nothing", only
+            the first of the duplicated rows is inserted.
+        """
+        if on_conflict not in ["update", "nothing"]:
+            logger.error(f"on_conflict must be 'update' or 'nothing'. {on_conflict=}")
+            raise ValueError(
+                f"on_conflict must be 'update' or 'nothing'. {on_conflict=}"
+            )
+
+        if not isinstance(data, (pd.DataFrame, pa.Table)):
+            logger.error(f"data must be a DataFrame or an Arrow table: {type(data)}")
+            raise ValueError(
+                f"data must be a DataFrame or an Arrow table: {type(data)}"
+            )
+
+        model = getattr(models, tablename)
+        table_columns = model.__table__.columns
+        keys = upsert_keys(model)
+        input_columns = (
+            data.columns if isinstance(data, pd.DataFrame) else data.schema.names
+        )
+        if on_conflict == "update" and all(k in input_columns for k in keys):
+            df_keys = (
+                data[keys]
+                if isinstance(data, pd.DataFrame)
+                else data.select(keys).to_pandas()
+            )
+            df_duplicated = df_keys[df_keys.duplicated()].drop_duplicates()
+            if not df_duplicated.empty:
+                examples = list(
+                    df_duplicated.head(5).itertuples(index=False, name=None)
+                )
+                logger.error(
+                    f"{df_duplicated.index.size} duplicated keys {keys} in the input: "
+                    f"{examples}"
+                )
+                raise ValueError(
+                    f"{df_duplicated.index.size} duplicated keys {keys} in the input: "
+                    f"{examples}"
+                )
+        # neither the key nor the surrogate primary key is overwritten
+        excluded = set(keys) | {c.name for c in model.__table__.primary_key.columns}
+        set_columns = [
+            c for c in input_columns if c in table_columns and c not in excluded
+        ]
+
+        dialect = self.engine.dialect
+        preparer = dialect.identifier_preparer
+        qtable = preparer.quote(model.__tablename__)
+        staging = f"staging_{model.__tablename__}_{uuid.uuid4().hex[:8]}"
+        if on_conflict == "update" and set_columns:
+            assignments = [
+                f"{preparer.quote(c)} = EXCLUDED.{preparer.quote(c)}"
+                for c in set_columns
+            ]
+            assignments += [
+                f"{preparer.quote(c.name)} = {c.onupdate.arg.compile(dialect=dialect)}"
+                for c in table_columns
+                if c.name not in set_columns
+                and c.onupdate is not None
+                and c.onupdate.is_clause_element
+            ]
+            action = f"DO UPDATE SET {', '.join(assignments)}"
+        else:
+            action = "DO NOTHING"
+        conflict = (
+            f"ON CONFLICT ({', '.join(preparer.quote(k) for k in keys)}) {action}"
+        )
+
+        self._mark_written(tablename)
+        counts = []
+        batches = iter_record_batches(data, model, batch_size=batch_size)
+        try:
+            cur = self.session.connection().connection.cursor()
+            for i_batch, batch in enumerate(batches):
+                colnames = ", ".join(preparer.quote(c) for c in batch.schema.names)
+                if i_batch == 0:
+                    # all columns of the table, so that the batch columns are
+                    # copied and selected by name
+                    cur.execute(
+                        f"CREATE TEMPORARY TABLE {staging} AS "
+                        f"SELECT * FROM {qtable} WITH NO DATA"
+                    )
+                else:
+                    cur.execute(f"TRUNCATE {staging}")
+                n_rows = self._copy_record_batches(staging, model, iter([batch]))
+
+                # xmax is 0 for newly inserted rows and set for updated ones
+                cur.execute(
+                    f"WITH upserted AS (INSERT INTO {qtable} ({colnames}) "
+                    f"SELECT {colnames} FROM {staging} {conflict} "
+                    "RETURNING (xmax = 0) AS inserted) "
+                    "SELECT count(*) FILTER (WHERE inserted), "
+                    "count(*) FILTER (WHERE NOT inserted) FROM upserted"
+                )
+                n_inserted, n_updated = cur.fetchone()
+                n_skipped = n_rows - n_inserted - n_updated
+                counts.append(
+                    {
+                        "batch": i_batch,
+                        "n_rows": n_rows,
+                        "inserted": n_inserted,
+                        "updated": n_updated,
+                        "skipped": n_skipped,
+                    }
+                )
+                logger.info(
+                    f"Batch {i_batch}: {n_inserted} inserted, {n_updated} updated, "
+                    f"and {n_skipped} skipped out of {n_rows} rows in the {tablename} table"
+                )
+            if counts:
+                cur.execute(f"DROP TABLE {staging}")
+            cur.close()
+
+            self._end_transaction(dry_run=dry_run, autocommit=autocommit)
+        except Exception as e:
+            if autocommit:
+                self.rollback()
+            raise e
+
+        return pd.DataFrame(
+            counts, columns=["batch", "n_rows", "inserted", "updated", "skipped"]
+        )
+
     def insert_by_copy(self, tablename, data, colnames, dry_run=False):
         """
         Description
@@ -171,6 +935,7 @@ class TargetDB:
         Note
         ----
         """
+        self.invalidate_dimension_cache(tablename)
         conn = self.engine.raw_connection()
         cur = conn.cursor()
         cur.copy_from(data, tablename, ",", columns=colnames)
@@ -181,7 +946,15 @@ class TargetDB:
         cur.close()
         conn.close()
 
-    def update(self, tablename, dataframe, dry_run=False):
+    def update(
+        self,
+        tablename,
+        dataframe,
+        dry_run=False,
+        autocommit=True,
+        method="mappings",
+        batch_size=100_000,
+    ):
         """
         Description
         -----------
@@ -190,6 +963,13 @@ class TargetDB:
         ----------
             tablename : `string`
             dataframe : `pandas.DataFrame`
+            autocommit : `bool`
+                If False, neither commit nor rollback is made (dry_run is ignored)
+            method : `string` ("mappings" or "staging")
+                "mappings" uses `bulk_update_mappings`, "staging" applies all rows
+                with a single UPDATE ... FROM a staging table (see `update_by_staging`)
+            batch_size : `int`
+                Number of rows encoded at a time for the "staging" method
         Returns
         -------
             None
@@ -197,26 +977,168 @@ class TargetDB:
         ----
             Column labels of `dataframe` should be exactly the same as those of the table
         """
+        if method == "staging":
+            self.update_by_staging(
+                tablename,
+                dataframe,
+                batch_size=batch_size,
+                dry_run=dry_run,
+                autocommit=autocommit,
+            )
+            return None
+        elif method != "mappings":
+            logger.error(f"Unsupported update method: {method}")
+            raise ValueError(f"Unsupported update method: {method}")
+
         model = getattr(models, tablename)
+        self._mark_written(tablename)
         try:
             self.session.bulk_update_mappings(
                 model, dataframe.to_dict(orient="records")
             )
-            if dry_run:
-                self.session.rollback()
-            else:
-                self.session.commit()
+            self._end_transaction(dry_run=dry_run, autocommit=autocommit)
         except:
-            self.session.rollback()
+            self.rollback()
             raise
 
+    def update_by_staging(
+        self,
+        tablename,
+        dataframe,
+        keys=None,
+        batch_size=100_000,
+        dry_run=False,
+        autocommit=True,
+    ):
+        """
+        Description
+        -----------
+            Update information of a table through a temporary staging table
+        Parameters
+        ----------
+            tablename  : `string`
+            dataframe  : `pandas.DataFrame`
+            keys       : `list` of `string` (optional; the primary key if None)
+            batch_size : `int`
+                Number of rows encoded at a time
+            autocommit : `bool`
+                If False, neither commit nor rollback is made (dry_run is ignored),
+                also on errors
+        Returns
+        -------
+            n_rows : `int`
+                Number of updated rows
+        Note
+        ----
+            The key columns and the columns to update are copied in the binary
+            format into a temporary table, which is applied with a single
+            `UPDATE ... FROM` statement. Columns not in `dataframe` are left
+            unchanged except for those with an `onupdate` value (e.g., updated_at).
+            An error is raised and nothing is changed if the keys are NULL or
+            duplicated or the number of updated rows differs from the number of
+            input rows (with autocommit=False, the caller has to roll back).
+        """
+        model = getattr(models, tablename)
+        table_columns = model.__table__.columns
+        if keys is None:
+            keys = [c.name for c in model.__table__.primary_key.columns]
+        columns = [c for c in dataframe.columns if c in table_columns]
+        missing_keys = [k for k in keys if k not in columns]
+        if missing_keys:
+            logger.error(f"Key columns are not found in the DataFrame: {missing_keys}")
+            raise ValueError(
+                f"Key columns are not found in the DataFrame: {missing_keys}"
+            )
+        set_columns = [c for c in columns if c not in keys]
+        if not set_columns:
+            logger.error(f"No column to update in the {tablename} table")
+            raise ValueError(f"No column to update in the {tablename} table")
+        # rows with a NULL key never match in UPDATE ... FROM
+        n_null_keys = dataframe[keys].isna().any(axis=1).sum()
+        if n_null_keys > 0:
+            logger.error(f"{n_null_keys} rows have NULL in the keys {keys}")
+            raise ValueError(f"{n_null_keys} rows have NULL in the keys {keys}")
+
+        dialect = self.engine.dialect
+        preparer = dialect.identifier_preparer
+        qtable = preparer.quote(model.__tablename__)
+        staging = f"staging_{model.__tablename__}_{uuid.uuid4().hex[:8]}"
+        assignments = [
+            f"{preparer.quote(c)} = s.{preparer.quote(c)}" for c in set_columns
+        ]
+        assignments += [
+            f"{preparer.quote(c.name)} = {c.onupdate.arg.compile(dialect=dialect)}"
+            for c in table_columns
+            if c.name not in set_columns
+            and c.onupdate is not None
+            and c.onupdate.is_clause_element
+        ]
+        key_match = " AND ".join(
+            f"t.{preparer.quote(k)} = s.{preparer.quote(k)}" for k in keys
+        )
+        key_list = ", ".join(f"s.{preparer.quote(k)}" for k in keys)
+
+        self._mark_written(tablename)
+        try:
+            cur = self.session.connection().connection.cursor()
+            cur.execute(
+                f"CREATE TEMPORARY TABLE {staging} AS "
+                f"SELECT {', '.join(preparer.quote(c) for c in columns)} "
+                f"FROM {qtable} WITH NO DATA"
+            )
+            n_staged = self._copy_record_batches(
+                staging,
+                model,
+                iter_record_batches(
+                    dataframe.loc[:, columns],
+                    model,
+                    batch_size=batch_size,
+                    fill_defaults=False,
+                ),
+            )
+            n_staged = 0 if n_staged is None else n_staged
+
+            cur.execute(
+                f"SELECT count(*) - count(DISTINCT ({key_list})) FROM {staging} AS s"
+            )
+            n_duplicated = cur.fetchone()[0]
+            if n_duplicated > 0:
+                logger.error(f"{n_duplicated} duplicated keys {keys} in the input")
+                raise ValueError(f"{n_duplicated} duplicated keys {keys} in the input")
+
+            cur.execute(
+                f"UPDATE {qtable} AS t SET {', '.join(assignments)} "
+                f"FROM {staging} AS s WHERE {key_match}"
+            )
+            n_rows = cur.rowcount
+            cur.execute(f"DROP TABLE {staging}")
+            cur.close()
+
+            if n_rows != n_staged:
+                logger.error(
+                    f"{n_rows} rows are updated for {n_staged} input rows in the {tablename} table. "
+                    "Please check if any keys are not found."
+                )
+                raise ValueError(
+                    f"{n_rows} rows are updated for {n_staged} input rows in the {tablename} table."
+                )
+            logger.info(f"{n_rows} rows are updated in the {tablename} table")
+
+            self._end_transaction(dry_run=dry_run, autocommit=autocommit)
+        except Exception as e:
+            if autocommit:
+                self.rollback()
+            raise e
+
+        return n_rows
+
     """
         ##################################################
         functionality to get information from the database
         ##################################################
     """
 
-    def fetch_all(self, tablename):
+    def fetch_all(self, tablename, columns=None, as_arrow=False):
         """
         Description
         -----------
@@ -224,71 +1146,756 @@ class TargetDB:
         Parameters
         ----------
             tablename : `string`
+            columns   : `list` of `string` (optional; all columns if None)
+            as_arrow  : `bool` (return a `pyarrow.Table` instead of a DataFrame)
         Returns
         -------
-            df : `pandas.DataFrame`
+            df : `pandas.DataFrame` or `pyarrow.Table`
+        Note
+        ----
+            The mapped columns are selected directly, so no ORM instances are built.
+        """
+        return self.fetch_columns(tablename, columns=columns, as_arrow=as_arrow)
+
+    def fetch_by_id(self, tablename, columns=None, as_arrow=False, **kwargs):
+        """
+        Description
+        -----------
+            Get records from a table where the keyword identifier is matched
+        Parameters
+        ----------
+            tablename : `string`
+            columns   : `list` of `string` (optional; all columns if None)
+            as_arrow  : `bool` (return a `pyarrow.Table` instead of a DataFrame)
+            **kwargs  :          (e.g., pfs_visit_id=12345)
+        Returns
+        -------
+            df : `pandas.DataFrame` or `pyarrow.Table`
+        Note
+        ----
+        """
+        return self.fetch_columns(
+            tablename, columns=columns, as_arrow=as_arrow, **kwargs
+        )
+
+    def fetch_columns(self, tablename, columns=None, as_arrow=False, **kwargs):
+        """
+        Description
+        -----------
+            Get records from a table as column arrays without materializing ORM objects
+        Parameters
+        ----------
+            tablename : `string`
+            columns   : `list` of `string` (optional; all columns if None)
+            as_arrow  : `bool` (return a `pyarrow.Table` instead of a DataFrame)
+            **kwargs  : equality filters (e.g., proposal_id="S24B-QT001")
+        Returns
+        -------
+            df : `pandas.DataFrame` or `pyarrow.Table`
         Note
         ----
+            Enum columns are returned as enum members in a DataFrame and as
+            their labels in an Arrow table.
         """
         model = getattr(models, tablename)
+        stmt, columns = select_columns(model, columns=columns, **kwargs)
+        return self._fetch_select(stmt, model, columns, as_arrow=as_arrow)
+
+    def _fetch_select(
+        self,
+        stmt,
+        model,
+        columns,
+        as_arrow=False,
+        extra_fields=None,
+        connection=None,
+    ):
+        """Run a core SELECT of `columns` (and `extra_fields`) and return it in columns.
+
+        The query runs on `connection` (a DBAPI connection) if given, and on the
+        connection of the session otherwise.
+        """
+        sql, params = compile_select(stmt, self.engine.dialect)
         try:
-            # Use session.execute() with select() to avoid immutabledict issues with pd.read_sql()
-            stmt = select(model)
-            result = self.session.execute(stmt)
-            # Get column names from the model's mapper
-            columns = [c.key for c in model.__mapper__.columns]
-            data = result.fetchall()
-            # Extract values from Row objects (each row is a tuple with one element - the model instance)
-            rows = [[getattr(row[0], col) for col in columns] for row in data]
-            df = pd.DataFrame(rows, columns=columns)
+            # Run on the DBAPI cursor so that neither ORM instances nor Row
+            # objects are built
+            if connection is None:
+                cur = self.session.connection().connection.cursor()
+            else:
+                cur = connection.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            processors = result_processors(
+                model,
+                columns,
+                cur.description[: len(columns)],
+                self.engine.dialect,
+            )
+            cur.close()
         except:
-            self.session.rollback()
+            if connection is None:
+                self.rollback()
+            else:
+                connection.rollback()
             raise
 
-        return df
+        return rows_to_columnar(
+            rows,
+            model,
+            columns,
+            processors=processors,
+            as_arrow=as_arrow,
+            extra_fields=extra_fields,
+        )
 
-    def fetch_by_id(self, tablename, **kwargs):
+    def fetch_by_keys(self, tablename, keys, columns=None, as_arrow=False):
         """
         Description
         -----------
-            Get records from a table where the keyword identifier is matched
+            Get records from a table matching many key tuples in a single query
         Parameters
         ----------
             tablename : `string`
-            **kwargs  :          (e.g., pfs_visit_id=12345)
+            keys      : `pandas.DataFrame` (one column per key, e.g., ob_code and proposal_id)
+            columns   : `list` of `string` (optional; all columns if None)
+            as_arrow  : `bool` (return a `pyarrow.Table` instead of a DataFrame)
         Returns
         -------
-            df : `pandas.DataFrame`
+            df : `pandas.DataFrame` or `pyarrow.Table`
         Note
         ----
+            The key columns are sent as arrays and joined with the table through
+            `unnest`, so the number of round trips does not depend on the number
+            of keys. A record is returned once for each matching row of `keys`.
         """
         model = getattr(models, tablename)
+        key_columns = list(keys.columns)
+        _, columns = select_columns(model, columns=columns)
+        select_columns(model, columns=key_columns)  # validate the key columns
+
+        if keys.index.size == 0:
+            return rows_to_columnar([], model, columns, as_arrow=as_arrow)
+
+        dialect = self.engine.dialect
+        preparer = dialect.identifier_preparer
+        table_columns = model.__table__.columns
+        arrays = ", ".join(
+            f"%({c})s::{table_columns[c].type.compile(dialect=dialect)}[]"
+            for c in key_columns
+        )
+        query = (
+            f"SELECT {', '.join(f't.{preparer.quote(c)}' for c in columns)} "
+            f"FROM {preparer.quote(tablename)} AS t "
+            f"JOIN unnest({arrays}) "
+            f"AS k({', '.join(preparer.quote(c) for c in key_columns)}) "
+            f"USING ({', '.join(preparer.quote(c) for c in key_columns)})"
+        )
+        params = {c: keys[c].tolist() for c in key_columns}
         try:
-            # Use session.execute() with select() to avoid immutabledict issues with pd.read_sql()
-            stmt = select(model)
-            for k, v in kwargs.items():
-                stmt = stmt.filter(getattr(model, k) == v)
-            result = self.session.execute(stmt)
-            # Get column names from the model's mapper
-            columns = [c.key for c in model.__mapper__.columns]
-            data = result.fetchall()
-            # Extract values from Row objects (each row is a tuple with one element - the model instance)
-            rows = [[getattr(row[0], col) for col in columns] for row in data]
-            df = pd.DataFrame(rows, columns=columns)
+            cur = self.session.connection().connection.cursor()
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            processors = result_processors(model, columns, cur.description, dialect)
+            cur.close()
         except:
-            self.session.rollback()
+            self.rollback()
             raise
 
-        return df
+        return rows_to_columnar(
+            rows, model, columns, processors=processors, as_arrow=as_arrow
+        )
+
+    def cone_search(
+        self, tablename, ra, dec, radius, columns=None, as_arrow=False, **kwargs
+    ):
+        """
+        Description
+        -----------
+            Get records of a table within a radius from a position
+        Parameters
+        ----------
+            tablename : `string` (e.g., "target", "fluxstd", or "sky")
+            ra        : `float` (degree)
+            dec       : `float` (degree)
+            radius    : `float` (degree)
+            columns   : `list` of `string` (optional; all columns if None)
+            as_arrow  : `bool` (return a `pyarrow.Table` instead of a DataFrame)
+            **kwargs  : equality filters (e.g., version="3.3")
+        Returns
+        -------
+            df : `pandas.DataFrame` or `pyarrow.Table`
+                The selected columns and the angular distance from the
+                position (`separation` in degree)
+        Note
+        ----
+            The search uses `q3c_radial_query`, which is served by the
+            `q3c_ang2ipix(ra, dec)` index of the table.
+        """
+        model = getattr(models, tablename)
+        stmt, columns = radial_select(model, ra, dec, radius, columns=columns, **kwargs)
+        return self._fetch_select(
+            stmt,
+            model,
+            columns,
+            as_arrow=as_arrow,
+            extra_fields=[SEPARATION_FIELD],
+        )
+
+    def fetch_field(
+        self,
+        ra,
+        dec,
+        position_angle=None,
+        radius=PFS_FIELD_RADIUS,
+        tables=("target", "fluxstd", "sky"),
+        columns=None,
+        filters=None,
+        active=True,
+    ):
+        """
+        Description
+        -----------
+            Get targets, flux standards, and sky positions in a PFS field of view
+        Parameters
+        ----------
+            ra      : `float` (field center in degree)
+            dec     : `float` (field center in degree)
+            position_angle : `float` (optional; position angle of a hexagon vertex in degree)
+            radius  : `float` (circumradius of the field in degree)
+            tables  : `list` of `string` (tables to query; an empty dict is returned if empty)
+            columns : `dict` (optional; table name and list of columns to select)
+            filters : `dict` (optional; table name and dict of filters, see `select_columns`)
+            active  : `bool` (only rows of active input catalogs if True)
+        Returns
+        -------
+            tables : `dict` of `pyarrow.Table`
+                Table name and the selected columns and `separation` (degree)
+        Note
+        ----
+            The tables are queried concurrently, each with one
+            `q3c_radial_query` on its own connection from the pool of the engine,
+            with the column projection and the filters in the SQL. If
+            `position_angle` is given, the rows are further limited to the
+            hexagon with the vertices at `radius` from the center, the first one
+            at `position_angle` (east of north), by a vectorized test on the
+            client.
+        """
+        columns, filters = _check_field_options(tables, columns, filters)
+
+        def _fetch(tablename):
+            model = getattr(models, tablename)
+            cols = columns.get(tablename)
+            if position_angle is not None:
+                # the positions are needed for the hexagon test
+                cols = _with_positions(cols)
+            stmt, cols = radial_select(
+                model,
+                ra,
+                dec,
+                radius,
+                columns=cols,
+                **filters.get(tablename, {}),
+            )
+            if active:
+                stmt = _where_active(stmt, model)
+            tb = self._fetch_pooled(stmt, model, cols, extra_fields=[SEPARATION_FIELD])
+            if position_angle is not None and tb.num_rows > 0:
+                tb = tb.filter(
+                    in_hexagon(
+                        tb.column("ra").to_numpy(),
+                        tb.column("dec").to_numpy(),
+                        ra,
+                        dec,
+                        position_angle,
+                        radius,
+                    )
+                )
+            return tb
+
+        return self._map_tables(_fetch, tables)
+
+    def fetch_fields(
+        self,
+        pointings,
+        radius=PFS_FIELD_RADIUS,
+        tables=("target", "fluxstd", "sky"),
+        columns=None,
+        filters=None,
+        active=True,
+        ra_column="ra",
+        dec_column="dec",
+        pa_column=None,
+    ):
+        """
+        Description
+        -----------
+            Get targets, flux standards, and sky positions in the fields of view of many pointings
+        Parameters
+        ----------
+            pointings  : `pandas.DataFrame` (or anything with the ra/dec columns in degree)
+            radius     : `float` (circumradius of the fields in degree)
+            tables     : `list` of `string` (tables to query)
+            columns    : `dict` (optional; table name and list of columns to select)
+            filters    : `dict` (optional; table name and dict of filters, see `select_columns`)
+            active     : `bool` (only rows of active input catalogs if True)
+            ra_column  : `string` (name of the RA column of `pointings`)
+            dec_column : `string` (name of the Dec column of `pointings`)
+            pa_column  : `string` (optional; name of the position angle column of `pointings`)
+        Returns
+        -------
+            tables : `dict` of `pyarrow.Table`
+                Table name and the row number of the pointing in `pointings`
+                (`pointing_index`), the selected columns, and the angular
+                distance from the pointing center (`separation` in degree),
+                one row per pair of a pointing and a row in its field
+        Note
+        ----
+            The rows in the union of the fields are fetched once by a single
+            query per table (an OR of `q3c_radial_query`, which is planned as a
+            union of index scans), so overlapping pointings do not read the same
+            rows again. The rows are then assigned to the pointings on the
+            client by `spatial.match_pointings`. The tables are queried
+            concurrently as in `fetch_field`.
+        """
+        columns, filters = _check_field_options(tables, columns, filters)
+        if len(pointings) == 0:
+            logger.error("No pointings are given")
+            raise ValueError("No pointings are given")
+        ra_pointing = np.asarray(pointings[ra_column], dtype=np.float64)
+        dec_pointing = np.asarray(pointings[dec_column], dtype=np.float64)
+        pa_pointing = (
+            None
+            if pa_column is None
+            else np.asarray(pointings[pa_column], dtype=np.float64)
+        )
+        radius = float(radius)
+
+        def _fetch(tablename):
+            model = getattr(models, tablename)
+            stmt, cols = select_columns(
+                model,
+                columns=_with_positions(columns.get(tablename)),
+                **filters.get(tablename, {}),
+            )
+            stmt = stmt.where(
+                or_(
+                    *[
+                        func.q3c_radial_query(
+                            model.ra, model.dec, float(r), float(d), radius
+                        )
+                        for r, d in zip(ra_pointing, dec_pointing, strict=True)
+                    ]
+                )
+            )
+            if active:
+                stmt = _where_active(stmt, model)
+            tb = self._fetch_pooled(stmt, model, cols)
+            index, pointing_index, separation = match_pointings(
+                tb.column("ra").to_numpy(),
+                tb.column("dec").to_numpy(),
+                ra_pointing,
+                dec_pointing,
+                radius,
+                pa=pa_pointing,
+            )
+            tb = tb.take(index)
+            tb = tb.add_column(0, "pointing_index", pa.array(pointing_index))
+            return tb.append_column(SEPARATION_FIELD, pa.array(separation))
+
+        return self._map_tables(_fetch, tables)
+
+    def _fetch_pooled(self, stmt, model, columns, extra_fields=None):
+        """Run `_fetch_select` to Arrow on a connection from the pool of the engine."""
+        connection = self.engine.raw_connection()
+        try:
+            return self._fetch_select(
+                stmt,
+                model,
+                columns,
+                as_arrow=True,
+                extra_fields=extra_fields,
+                connection=connection,
+            )
+        finally:
+            # return the connection to the pool
+            connection.close()
+
+    def _map_tables(self, fetch, tables):
+        """Call `fetch(tablename)` for each table in threads and return the results in a dict."""
+        if len(tables) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+            results = dict(zip(tables, executor.map(fetch, tables), strict=True))
+        for tablename, tb in results.items():
+            logger.info(f"{tb.num_rows} rows are fetched from the {tablename} table")
+        return results
 
-    def fetch_query(self, query):
+    def crossmatch(
+        self,
+        tablename,
+        positions,
+        radius,
+        columns=None,
+        as_arrow=False,
+        ra_column="ra",
+        dec_column="dec",
+        **kwargs,
+    ):
+        """
+        Description
+        -----------
+            Get records of a table within a radius from each of many positions in a single query
+        Parameters
+        ----------
+            tablename  : `string` (e.g., "target", "fluxstd", or "sky")
+            positions  : `pandas.DataFrame` (or anything with the ra/dec columns in degree)
+            radius     : `float` (degree)
+            columns    : `list` of `string` (optional; all columns if None)
+            as_arrow   : `bool` (return a `pyarrow.Table` instead of a DataFrame)
+            ra_column  : `string` (name of the RA column of `positions`)
+            dec_column : `string` (name of the Dec column of `positions`)
+            **kwargs   : equality filters (e.g., version="3.3")
+        Returns
+        -------
+            df : `pandas.DataFrame` or `pyarrow.Table`
+                The selected columns, the row number of the matched position
+                in `positions` (`position_index`), and the angular distance
+                (`separation` in degree), one row per matched pair
+        Note
+        ----
+            The positions are copied in the binary format into a temporary
+            table, which is joined with the table by a single `q3c_join`, so the
+            number of round trips does not depend on the number of positions.
+        """
+        model = getattr(models, tablename)
+        radius = float(radius)
+        _, columns = select_columns(model, columns=columns, **kwargs)
+        probes = pa.record_batch(
+            [
+                pa.array(np.arange(len(positions), dtype=np.int64)),
+                pa.array(np.asarray(positions[ra_column], dtype=np.float64)),
+                pa.array(np.asarray(positions[dec_column], dtype=np.float64)),
+            ],
+            names=["position_index", "ra", "dec"],
+        )
+
+        name = f"xmatch_{model.__tablename__}_{uuid.uuid4().hex[:8]}"
+        probe = table(name, column("position_index"), column("ra"), column("dec"))
+        target = model.__table__
+        stmt, _ = select_columns(model, columns=columns, **kwargs)
+        stmt = (
+            stmt.add_columns(
+                probe.c.position_index,
+                func.q3c_dist(probe.c.ra, probe.c.dec, target.c.ra, target.c.dec).label(
+                    "separation"
+                ),
+            )
+            .select_from(probe)
+            .join(
+                target,
+                func.q3c_join(
+                    probe.c.ra, probe.c.dec, target.c.ra, target.c.dec, radius
+                ),
+            )
+            .order_by(probe.c.position_index)
+        )
+        try:
+            cur = self.session.connection().connection.cursor()
+            cur.execute(
+                f"CREATE TEMPORARY TABLE {name} "
+                "(position_index bigint, ra double precision, dec double precision)"
+            )
+            self._copy_record_batches(
+                name, None, iter([probes]), kinds=["int8", "float8", "float8"]
+            )
+            # let the planner know the size of the temporary table
+            cur.execute(f"ANALYZE {name}")
+            cur.close()
+            res = self._fetch_select(
+                stmt,
+                model,
+                columns,
+                as_arrow=as_arrow,
+                extra_fields=[
+                    pa.field("position_index", pa.int64()),
+                    SEPARATION_FIELD,
+                ],
+            )
+            cur = self.session.connection().connection.cursor()
+            cur.execute(f"DROP TABLE {name}")
+            cur.close()
+        except:
+            self.rollback()
+            raise
+
+        return res
+
+    def iter_table(
+        self, tablename, columns=None, batch_size=100_000, as_arrow=False, **kwargs
+    ):
+        """
+        Description
+        -----------
+            Iterate over records of a table in batches with a server-side cursor
+        Parameters
+        ----------
+            tablename  : `string`
+            columns    : `list` of `string` (optional; all columns if None)
+            batch_size : `int` (number of rows in each batch)
+            as_arrow   : `bool` (yield `pyarrow.RecordBatch` instead of DataFrames)
+            **kwargs   : equality filters (e.g., version="3.3")
+        Yields
+        ------
+            df : `pandas.DataFrame` or `pyarrow.RecordBatch`
+        Note
+        ----
+            Only one batch is held in the client memory at a time. The batches
+            have the same values and types as `fetch_columns`.
+        """
+        model = getattr(models, tablename)
+        stmt, columns = select_columns(model, columns=columns, **kwargs)
+        yield from self._iter_select(stmt, model, columns, batch_size, as_arrow)
+
+    def _iter_select(self, stmt, model, columns, batch_size, as_arrow=False):
+        """Iterate over records of a core SELECT of `columns` of `model` in batches."""
+        sql, params = compile_select(stmt, self.engine.dialect)
+        processors = None
+        for rows, description in self._iter_cursor_batches(sql, params, batch_size):
+            if processors is None:
+                processors = result_processors(
+                    model, columns, description, self.engine.dialect
+                )
+            res = rows_to_columnar(
+                rows, model, columns, processors=processors, as_arrow=as_arrow
+            )
+            yield res.to_batches()[0] if as_arrow else res
+
+    def iter_query(self, query, params=None, batch_size=100_000, as_arrow=False):
+        """
+        Description
+        -----------
+            Iterate over records from SQL query in batches with a server-side cursor
+        Parameters
+        ----------
+            query      : `string`
+            params     : `dict` (optional; bound with the `%(name)s` placeholders)
+            batch_size : `int` (number of rows in each batch)
+            as_arrow   : `bool` (yield `pyarrow.RecordBatch` instead of DataFrames)
+        Yields
+        ------
+            df : `pandas.DataFrame` or `pyarrow.RecordBatch`
+        Note
+        ----
+            Arrow types are inferred for each batch, so a column with only NULL
+            values in a batch has the null type in that batch.
+        """
+        for rows, description in self._iter_cursor_batches(query, params, batch_size):
+            columns = [desc[0] for desc in description]
+            if as_arrow:
+                arrays = zip(*rows, strict=True)
+                yield pa.RecordBatch.from_arrays(
+                    [pa.array(a, from_pandas=True) for a in arrays], names=columns
+                )
+            else:
+                yield pd.DataFrame(rows, columns=columns)
+
+    def export_dataset(
+        self,
+        tablename,
+        outdir,
+        columns=None,
+        partition_by=None,
+        healpix_nside=None,
+        batch_size=100_000,
+        row_group_size=250_000,
+        compression="zstd",
+        compression_level=None,
+        overwrite=False,
+        **kwargs,
+    ):
+        """
+        Description
+        -----------
+            Export records of a table to a Hive-partitioned parquet dataset
+        Parameters
+        ----------
+            tablename         : `string`
+            outdir            : `string` or `pathlib.Path` (base directory of the dataset)
+            columns           : `list` of `string` (optional; all columns if None)
+            partition_by      : `list` of `string` (optional; e.g., ["version", "input_catalog_id"])
+            healpix_nside     : `int` (optional; also partition by the HEALPix pixel of ra and dec, which must not be NULL)
+            batch_size        : `int` (number of rows fetched at a time)
+            row_group_size    : `int` (number of rows in a row group of the parquet files)
+            compression       : `string` (parquet codec, e.g., "zstd", "snappy", or "none")
+            compression_level : `int` (optional; level of the codec)
+            overwrite         : `bool` (replace the files of the partitions written)
+            **kwargs          : filters as in `iter_table` (e.g., psf_mag_r={"max": 18.0})
+        Returns
+        -------
+            n_rows : `int` (number of rows exported)
+        Note
+        ----
+            Records are streamed through a server-side cursor, so only a few
+            batches and the rows buffered for the row groups of the open files
+            are held in memory. The partition columns are not written in the
+            files but in the directory names (e.g., `version=3.3/part-0.parquet`),
+            and are restored by `pyarrow.dataset.dataset(outdir, partitioning="hive")`.
+            With `healpix_nside`, the NESTED HEALPix pixel is saved in the
+            `healpix` partition column. Without `overwrite`, an error is raised
+            if `outdir` is not empty.
+        """
+        model = getattr(models, tablename)
+        _, columns = select_columns(model, columns=columns)
+        partition_by = list(partition_by or [])
+        select_columns(model, columns=partition_by)  # validate the partition columns
+        out_columns = columns + [c for c in partition_by if c not in columns]
+        fetch_columns = out_columns.copy()
+        if healpix_nside is not None:
+            check_nside(healpix_nside)
+            fetch_columns += [c for c in ["ra", "dec"] if c not in fetch_columns]
+
+        stmt, _ = select_columns(model, columns=fetch_columns, **kwargs)
+        schema = arrow_schema(model, out_columns)
+        partition_fields = [schema.field(c) for c in partition_by]
+        if healpix_nside is not None:
+            schema = schema.append(HEALPIX_FIELD)
+            partition_fields.append(HEALPIX_FIELD)
+
+        n_rows = 0
+        n_files = 0
+
+        def _batches():
+            nonlocal n_rows
+            for batch in self._iter_select(
+                stmt, model, fetch_columns, batch_size, as_arrow=True
+            ):
+                arrays = [batch.column(c) for c in out_columns]
+                if healpix_nside is not None:
+                    arrays.append(
+                        pa.array(
+                            healpix_index(
+                                batch.column("ra").to_numpy(zero_copy_only=False),
+                                batch.column("dec").to_numpy(zero_copy_only=False),
+                                healpix_nside,
+                            )
+                        )
+                    )
+                n_rows += batch.num_rows
+                yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+        def _count_file(written_file):
+            nonlocal n_files
+            n_files += 1
+
+        ds.write_dataset(
+            _batches(),
+            outdir,
+            schema=schema,
+            format="parquet",
+            partitioning=(
+                ds.partitioning(pa.schema(partition_fields), flavor="hive")
+                if len(partition_fields) > 0
+                else None
+            ),
+            basename_template="part-{i}.parquet",
+            file_options=ds.ParquetFileFormat().make_write_options(
+                compression=compression, compression_level=compression_level
+            ),
+            min_rows_per_group=row_group_size,
+            max_rows_per_group=row_group_size,
+            existing_data_behavior="delete_matching" if overwrite else "error",
+            file_visitor=_count_file,
+        )
+        logger.info(
+            f"Exported {n_rows} rows of {tablename} in {n_files} files to {outdir}"
+        )
+        return n_rows
+
+    def _iter_cursor_batches(self, query, params, batch_size):
+        """Yield (rows, cursor.description) in batches from a named server-side cursor."""
+        if batch_size < 1:
+            logger.error(f"batch_size must be a positive integer: {batch_size=}")
+            raise ValueError(f"batch_size must be a positive integer: {batch_size=}")
+
+        # a named cursor lives in the transaction of the session
+        cur = self.session.connection().connection.cursor(
+            name=f"targetdb_iter_{uuid.uuid4().hex}"
+        )
+        cur.itersize = batch_size
+        try:
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                yield rows, cur.description
+        except Exception:
+            cur.close()
+            self.rollback()
+            raise
+        finally:
+            # also reached when the caller stops iterating early
+            if not cur.closed:
+                cur.close()
+
+    def fetch_dimension(self, tablename, key, id_column):
+        """
+        Description
+        -----------
+            Get the key and id columns of a small dimension table (e.g., proposal,
+            target_type, input_catalog) for back-reference lookups
+        Parameters
+        ----------
+            tablename : `string`
+            key       : `string` (e.g., upload_id)
+            id_column : `string` (e.g., input_catalog_id)
+        Returns
+        -------
+            df : `pandas.DataFrame` with the `key` and `id_column` columns
+        Note
+        ----
+            The result is cached for the lifetime of the instance and reused by
+            later calls. The cache of a table is invalidated when rows are
+            written to the table through this instance and when the transaction
+            writing the table is rolled back, and all caches are invalidated by
+            `execute_query`. Call `invalidate_dimension_cache` after modifying
+            the tables otherwise.
+        """
+        cache_key = (tablename, key, id_column)
+        if cache_key not in self._dimension_cache:
+            columns = list(dict.fromkeys([key, id_column]))
+            self._dimension_cache[cache_key] = self.fetch_all(
+                tablename, columns=columns
+            )
+        return self._dimension_cache[cache_key]
+
+    def invalidate_dimension_cache(self, tablename=None):
+        """
+        Description
+        -----------
+            Drop cached dimension tables of `fetch_dimension`
+        Parameters
+        ----------
+            tablename : `string` (optional; all tables if None)
+        Returns
+        -------
+            None
+        """
+        if tablename is None:
+            self._dimension_cache.clear()
+        else:
+            for cache_key in [k for k in self._dimension_cache if k[0] == tablename]:
+                del self._dimension_cache[cache_key]
+
+    def fetch_query(self, query, params=None):
         """
         Description
         -----------
             Get all records from SQL query
         Parameters
         ----------
-            query : `string`
+            query  : `string`
+            params : `dict` (optional; bound with the `:name` placeholders)
         Returns
         -------
             df : `pandas.DataFrame`
@@ -297,12 +1904,12 @@ class TargetDB:
         """
         try:
             # Use session.execute() with text() to avoid immutabledict issues with pd.read_sql()
-            result = self.session.execute(text(query))
+            result = self.session.execute(text(query), params)
             columns = result.keys()
             data = result.fetchall()
             df = pd.DataFrame(data, columns=columns)
         except:
-            self.session.rollback()
+            self.rollback()
             raise
 
         return df
@@ -345,12 +1952,14 @@ class TargetDB:
         Note
         ----
         """
+        # the query can modify any table
+        self._mark_written()
         try:
             self.session.execute(text(query))
             if dry_run:
-                self.session.rollback()
+                self.rollback()
             else:
-                self.session.commit()
+                self.commit()
         except Exception as e:
-            self.session.rollback()
+            self.rollback()
             raise e
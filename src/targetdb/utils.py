@@ -3,28 +3,38 @@
 import glob
 import os
 import re
-import shutil
+import shlex
 import subprocess
 import tempfile
 import time
 import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import requests
 from astropy.table import Table
+from astropy.table.meta import get_header_from_yaml
 from loguru import logger
-from sqlalchemy import URL
+from pyarrow import feather
+from sqlalchemy import URL, Engine
 
-from . import TargetDB
+from . import TargetDB, models, spatial
 from .models import (
     Base,
     input_catalog_id_absolute_max,
     input_catalog_id_max,
     input_catalog_id_start,
 )
+from .pgcopy import arrow_schema, dataframe_to_arrow
 
 try:
     import tomllib
@@ -88,7 +98,56 @@ def read_conf(config_file):
     return load_config(config_file)
 
 
-def load_input_data(input_file, metadata=False, logger=logger):
+# ECSV datatypes and the corresponding Arrow types
+ECSV_ARROW_TYPES = {
+    "bool": pa.bool_(),
+    "int8": pa.int8(),
+    "int16": pa.int16(),
+    "int32": pa.int32(),
+    "int64": pa.int64(),
+    "uint8": pa.uint8(),
+    "uint16": pa.uint16(),
+    "uint32": pa.uint32(),
+    "uint64": pa.uint64(),
+    "float16": pa.float16(),
+    "float32": pa.float32(),
+    "float64": pa.float64(),
+    "string": pa.string(),
+}
+
+
+def model_dtypes(table, columns=None):
+    """
+    Return the Arrow types of the columns of a targetdb table.
+
+    Parameters
+    ----------
+    table : str
+        The name of the table (e.g., "fluxstd").
+    columns : list of str, optional
+        Column names to include. All columns of the table are used if None.
+        Names not in the table are ignored.
+
+    Returns
+    -------
+    dtypes : dict
+        Column name and `pyarrow.DataType` to be passed to `load_input_data`.
+    """
+    model = getattr(models, table)
+    if columns is not None:
+        columns = [c for c in columns if c in model.__table__.columns]
+    return {field.name: field.type for field in arrow_schema(model, columns)}
+
+
+def load_input_data(
+    input_file,
+    metadata=False,
+    logger=logger,
+    columns=None,
+    dtypes=None,
+    engine="pandas",
+    as_arrow=False,
+):
     """
     Load input data from a file into a pandas DataFrame.
 
@@ -96,18 +155,31 @@ def load_input_data(input_file, metadata=False, logger=logger):
     ----------
     input_file : str
         The path to the input file (CSV, Feather, Parquet, or ECSV).
+    metadata : bool, optional
+        If True, the metadata of an ECSV file is also returned. Defaults to False.
     logger : loguru.logger, optional
         The logger to use for logging messages. Defaults to the root logger.
+    columns : list of str, optional
+        Columns to read. All columns are read if None.
+    dtypes : dict, optional
+        Column name and Arrow type (e.g., from `model_dtypes`) to pin the types
+        of the columns instead of inferring them. Only with `engine="arrow"`.
+        Names not in the file are ignored.
+    engine : str, optional
+        "pandas" (pandas and astropy readers) or "arrow" (pyarrow readers).
+        Defaults to "pandas".
+    as_arrow : bool, optional
+        If True, return a `pyarrow.Table`. Only with `engine="arrow"`. Defaults to False.
 
     Returns
     -------
-    df : pandas.DataFrame
+    df : pandas.DataFrame or pyarrow.Table
         The loaded data.
 
     Raises
     ------
     ValueError
-        If the file extension is not supported.
+        If the file extension or the engine is not supported.
     FileNotFoundError
         If the input file does not exist.
 
@@ -115,26 +187,53 @@ def load_input_data(input_file, metadata=False, logger=logger):
     -----
     This function uses pandas or astropy to load the data depending on the file format.
     It supports CSV, Feather, Parquet, and ECSV file formats.
+
+    With `engine="arrow"`, Feather files are memory-mapped, and ECSV files are
+    read by parsing the YAML header once and passing the body to the pyarrow
+    CSV reader with the types in the header. ECSV files with structured
+    columns (e.g., JSON-encoded lists) are read by astropy. Empty fields are
+    missing values, except in string columns of CSV files where they are kept
+    as empty strings as with the "pandas" engine.
     """
 
+    if engine not in ["pandas", "arrow"]:
+        logger.error(f"engine must be 'pandas' or 'arrow'. {engine=}")
+        raise ValueError(f"engine must be 'pandas' or 'arrow'. {engine=}")
+    if engine == "pandas" and (dtypes is not None or as_arrow):
+        logger.error("dtypes and as_arrow are only supported by engine='arrow'")
+        raise ValueError("dtypes and as_arrow are only supported by engine='arrow'")
+
     _, ext = os.path.splitext(input_file)
-    if ext == ".csv":
+    if ext not in [".csv", ".feather", ".parquet", ".ecsv"]:
+        logger.error(f"Unsupported file extension: {ext}")
+        raise ValueError(f"Unsupported file extension: {ext}")
+
+    meta = None
+    if engine == "arrow":
+        if ext == ".csv":
+            tb = _read_csv_arrow(input_file, columns=columns, dtypes=dtypes)
+        elif ext == ".feather":
+            tb = feather.read_table(input_file, columns=columns, memory_map=True)
+        elif ext == ".parquet":
+            tb = pq.read_table(input_file, columns=columns, memory_map=True)
+        else:
+            tb, meta = _read_ecsv_arrow(input_file, columns=columns, dtypes=dtypes)
+        if dtypes is not None:
+            tb = _cast_arrow_columns(tb, dtypes)
+        df = tb if as_arrow else tb.to_pandas()
+    elif ext == ".csv":
         # set keep_default_na=False to keep empty strings as empty strings
-        df = pd.read_csv(input_file, keep_default_na=False)
-        meta = None
+        df = pd.read_csv(input_file, keep_default_na=False, usecols=columns)
     elif ext == ".feather":
-        df = pd.read_feather(input_file)
-        meta = None
+        df = pd.read_feather(input_file, columns=columns)
     elif ext == ".parquet":
-        df = pd.read_parquet(input_file)
-        meta = None
-    elif ext == ".ecsv":
+        df = pd.read_parquet(input_file, columns=columns)
+    else:
         tb = Table.read(input_file)
+        if columns is not None:
+            tb = tb[columns]
         df = tb.to_pandas()
         meta = tb.meta
-    else:
-        logger.error(f"Unsupported file extension: {ext}")
-        raise ValueError(f"Unsupported file extension: {ext}")
 
     if metadata:
         return df, meta
@@ -142,6 +241,171 @@ def load_input_data(input_file, metadata=False, logger=logger):
     return df
 
 
+def _cast_arrow_columns(tb, dtypes):
+    for name, dtype in dtypes.items():
+        i = tb.schema.get_field_index(name)
+        if i >= 0 and tb.schema.field(i).type != dtype:
+            tb = tb.set_column(i, name, tb.column(i).cast(dtype))
+    return tb
+
+
+def _read_csv_arrow(
+    input_file,
+    columns=None,
+    dtypes=None,
+    skip_rows=0,
+    delimiter=",",
+    strings_can_be_null=False,
+):
+    return pa_csv.read_csv(
+        input_file,
+        read_options=pa_csv.ReadOptions(skip_rows=skip_rows),
+        parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+        convert_options=_csv_convert_options(columns, dtypes, strings_can_be_null),
+    )
+
+
+def _csv_convert_options(columns=None, dtypes=None, strings_can_be_null=False):
+    return pa_csv.ConvertOptions(
+        column_types=dtypes,
+        include_columns=columns,
+        # empty fields are missing values (except for strings by default)
+        null_values=[""],
+        strings_can_be_null=strings_can_be_null,
+        quoted_strings_can_be_null=True,
+    )
+
+
+def read_ecsv_header(input_file):
+    """
+    Read the YAML header of an ECSV file.
+
+    Parameters
+    ----------
+    input_file : str
+        The path to the ECSV file.
+
+    Returns
+    -------
+    header : dict
+        The parsed header with the "datatype", "meta", and "delimiter" keys.
+    n_lines : int
+        The number of header (comment) lines.
+    """
+    lines = []
+    with open(input_file) as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            lines.append(line.rstrip("\n"))
+    # the first line is the "%ECSV <version>" line and the YAML body follows "---"
+    yaml_lines = [line[2:] if line.startswith("# ") else line[1:] for line in lines]
+    i_start = yaml_lines.index("---") + 1
+    header = get_header_from_yaml(yaml_lines[i_start:])
+    return header, len(lines)
+
+
+def _read_ecsv_arrow(input_file, columns=None, dtypes=None):
+    header, n_lines = read_ecsv_header(input_file)
+    datatype = header["datatype"]
+    if any("subtype" in c or c["datatype"] not in ECSV_ARROW_TYPES for c in datatype):
+        # structured columns are decoded by astropy
+        tb = Table.read(input_file)
+        if columns is not None:
+            tb = tb[columns]
+        return pa.Table.from_pandas(tb.to_pandas(), preserve_index=False), tb.meta
+
+    column_types = {c["name"]: ECSV_ARROW_TYPES[c["datatype"]] for c in datatype}
+    column_types.update(dtypes or {})
+    tb = _read_csv_arrow(
+        input_file,
+        columns=columns,
+        dtypes=column_types,
+        skip_rows=n_lines,
+        delimiter=header.get("delimiter", " "),
+        # astropy reads empty fields as masked values for any type
+        strings_can_be_null=True,
+    )
+    return tb, header.get("meta")
+
+
+def iter_input_data(input_file, chunk_size, logger=logger, dtypes=None):
+    """
+    Iterate over an input file in chunks of pandas DataFrames.
+
+    Parameters
+    ----------
+    input_file : str
+        The path to the input file (CSV, Feather, Parquet, or ECSV).
+    chunk_size : int
+        The number of rows in each chunk (the last chunk can be smaller).
+    logger : loguru.logger, optional
+        The logger to use for logging messages. Defaults to the root logger.
+    dtypes : dict, optional
+        Column name and Arrow type (e.g., from `model_dtypes`) to pin the types
+        of the columns of a CSV file in all chunks. Names not in the file are
+        ignored. The other formats have the types in the file.
+
+    Yields
+    ------
+    df : pandas.DataFrame
+        A chunk of the input data.
+
+    Raises
+    ------
+    ValueError
+        If the file extension is not supported.
+
+    Notes
+    -----
+    CSV, Feather, and Parquet files are read incrementally, so that only about
+    one chunk is held in memory at a time. ECSV files are read at once by astropy
+    and then split into chunks. The dtypes are the same as those of `load_input_data`.
+
+    Without `dtypes`, the types of the columns of a CSV file are inferred for
+    each chunk, so that they can differ between chunks (e.g., a numeric column
+    with empty fields only in some chunks). With `dtypes`, CSV files are read
+    by the pyarrow streaming reader as with `load_input_data(engine="arrow")`.
+    """
+
+    _, ext = os.path.splitext(input_file)
+    if ext == ".csv" and dtypes is None:
+        with pd.read_csv(
+            input_file, keep_default_na=False, chunksize=chunk_size
+        ) as reader:
+            yield from reader
+    elif ext in [".csv", ".feather", ".parquet"]:
+        if ext == ".csv":
+            batches = pa_csv.open_csv(
+                input_file, convert_options=_csv_convert_options(dtypes=dtypes)
+            )
+        elif ext == ".parquet":
+            batches = pq.ParquetFile(input_file).iter_batches(batch_size=chunk_size)
+        else:
+            source = pa.memory_map(str(input_file))
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+
+        buffer, n_buffer = [], 0
+        for batch in batches:
+            buffer.append(batch)
+            n_buffer += batch.num_rows
+            while n_buffer >= chunk_size:
+                tb = pa.Table.from_batches(buffer)
+                yield tb.slice(0, chunk_size).to_pandas()
+                tb = tb.slice(chunk_size)
+                buffer, n_buffer = tb.to_batches(), tb.num_rows
+        if n_buffer > 0:
+            yield pa.Table.from_batches(buffer).to_pandas()
+    elif ext == ".ecsv":
+        df = load_input_data(input_file, logger=logger)
+        for i in range(0, df.index.size, chunk_size):
+            yield df.iloc[i : i + chunk_size]
+    else:
+        logger.error(f"Unsupported file extension: {ext}")
+        raise ValueError(f"Unsupported file extension: {ext}")
+
+
 def read_excel(input_file, sheetnames=None):
     """
     Load data from an Excel file and return it as a dictionary of pandas DataFrames.
@@ -216,21 +480,79 @@ def get_url_object(config):
     return url_object
 
 
-def install_q3c_extension(config, dry_run=False):
+def connect_targetdb(config=None, db=None):
+    """
+    Return a connected TargetDB, reusing an existing one or engine if given.
 
-    # connect to the targetDB
-    db = TargetDB(**config["targetdb"]["db"])
+    Parameters
+    ----------
+    config : dict, optional
+        The configuration dictionary used if `db` is None. Defaults to None.
+    db : TargetDB or sqlalchemy.engine.Engine, optional
+        A connected TargetDB instance to return as is, or an engine to make a
+        new instance with. Defaults to None.
+
+    Returns
+    -------
+    db : TargetDB
+        A connected TargetDB instance.
+    owned : bool
+        True if the instance is made by this function and to be closed by the
+        caller. Closing it does not dispose a given engine.
+
+    Notes
+    -----
+    An instance made from `config` uses the engine shared within the process
+    (see `targetdb.get_engine`), unless `shared_engine = false` is set in the
+    `[targetdb.db]` section, so that the pooled connections are reused by the
+    later calls. They are released by `targetdb.dispose_engines`.
+    """
+    if isinstance(db, TargetDB):
+        return db, False
+    if isinstance(db, Engine):
+        db = TargetDB(engine=db)
+    else:
+        logger.info("Connecting to targetDB")
+        db = TargetDB(**{"shared_engine": True, **config["targetdb"]["db"]})
     db.connect()
+    return db, True
+
+
+@contextmanager
+def targetdb_session(config=None, db=None):
+    """
+    Context manager of `connect_targetdb` closing only the instances it makes.
+
+    Parameters
+    ----------
+    config : dict, optional
+        The configuration dictionary used if `db` is None. Defaults to None.
+    db : TargetDB or sqlalchemy.engine.Engine, optional
+        A connected TargetDB instance or an engine. Defaults to None.
 
-    logger.info("Installing q3c extension.")
+    Yields
+    ------
+    db : TargetDB
+        A connected TargetDB instance.
+    """
+    db, owned = connect_targetdb(config, db)
     try:
-        db.execute_query("CREATE EXTENSION IF NOT EXISTS q3c", dry_run=dry_run)
-    except Exception as e:
-        logger.error(f"Error installing q3c extension: {e}")
-        raise e
+        yield db
+    finally:
+        if owned:
+            db.close()
+
 
-    # close the connection
-    db.close()
+def install_q3c_extension(config, dry_run=False, db=None):
+
+    # connect to the targetDB
+    with targetdb_session(config, db) as db:
+        logger.info("Installing q3c extension.")
+        try:
+            db.execute_query("CREATE EXTENSION IF NOT EXISTS q3c", dry_run=dry_run)
+        except Exception as e:
+            logger.error(f"Error installing q3c extension: {e}")
+            raise e
 
 
 def generate_schema_markdown(output_file=None):
@@ -494,7 +816,8 @@ def join_backref_values(df, db=None, table=None, key=None, check_key=None):
         If there is at least one non-existing value in the check_key column after the join.
     """
 
-    res = db.fetch_all(table)
+    # only the key and id columns, cached by the TargetDB instance
+    res = db.fetch_dimension(table, key, check_key)
     df_joined = df.merge(
         res,
         how="left",
@@ -771,21 +1094,13 @@ def make_target_df_from_uploader(
     n_target = df.index.size
     logger.info(f"{n_target=}")
 
-    # FIXME: loop is slow for a large target list. Want to look for a fast and better way.
     if update:
         logger.info("Look up the target table by (ob_code, proposal_id)")
-        df_target = pd.DataFrame()
-        for i in range(df.index.size):
-            df_target_tmp = db.fetch_by_id(
-                table,
-                ob_code=df["ob_code"][i],
-                proposal_id=df["proposal_id"][i],
-            )
-            if not df_target_tmp.empty:
-                df_target = pd.concat(
-                    [df_target, df_target_tmp],
-                    ignore_index=True,
-                )
+        df_target = db.fetch_by_keys(
+            table,
+            df.loc[:, ["ob_code", "proposal_id"]],
+            columns=["target_id", "ob_code", "proposal_id"],
+        )
         logger.info(f"Merged DataFrame\n{df_target}")
         df = df.merge(
             df_target.loc[:, ["target_id", "ob_code", "proposal_id"]],
@@ -817,43 +1132,86 @@ def check_input_catalog(
     input_catalog_id_start=input_catalog_id_start,
     input_catalog_id_max=input_catalog_id_max,
 ):
-    df_in_db = db.fetch_all("input_catalog")
+    """
+    Validate rows to be inserted into the input_catalog table.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The input_catalog rows to be inserted.
+    db : TargetDB, optional
+        The database object where the input_catalog table is located. Defaults to None.
+    input_catalog_id_start : int, optional
+        The first input_catalog_id reserved for the uploader.
+    input_catalog_id_max : int, optional
+        The last input_catalog_id reserved for the uploader.
+
+    Raises
+    ------
+    ValueError
+        If any upload_id is already in the input_catalog table, or any
+        input_catalog_id is in the range reserved for the uploader or larger
+        than `input_catalog_id_absolute_max`.
+
+    Notes
+    -----
+    All rows are checked at once and every offending row is reported before
+    the error is raised. Only the upload_id column is read from the database.
+    """
+
+    # TODO: upgrade PostgreSQL to 12 or later
+    # NOTE: Since partial indexing is not supported on targetdb
+    # by thePostgreSQL version 10.6, we need to check if the upload_id
+    # is already in the input_catalog table manually.
+    upload_ids_in_db = set(
+        db.fetch_all("input_catalog", columns=["upload_id"])["upload_id"].dropna()
+    )
+    upload_ids_in_db.discard("")
+
+    errors = []
+
+    upload_id = df["upload_id"]
+    is_registered = (
+        upload_id.notna() & (upload_id != "") & upload_id.isin(upload_ids_in_db)
+    )
+    if is_registered.any():
+        for i, v in upload_id[is_registered].items():
+            logger.error(
+                f"upload_id {v} is already in the input_catalog table (row {i})."
+            )
+        errors.append(
+            f"{is_registered.sum()} upload_id(s) are already in the input_catalog table: "
+            f"{upload_id[is_registered].unique().tolist()}"
+        )
 
-    is_input_catalog_id = "input_catalog_id" in df.columns
-    if is_input_catalog_id:
+    if "input_catalog_id" in df.columns:
         logger.info("input_catalog_id is found in the DataFrame. Check values.")
-    else:
-        logger.info("input_catalog_id is not found in the DataFrame. Proceed.")
+        catalog_id = df["input_catalog_id"].to_numpy()
 
-    for i in range(df.index.size):
-        # TODO: upgrade PostgreSQL to 12 or later
-        # NOTE: Since partial indexing is not supported on targetdb
-        # by thePostgreSQL version 10.6, we need to check if the upload_id
-        # is already in the input_catalog table manually.
-        if (df["upload_id"][i] != "") and (
-            df["upload_id"][i] in df_in_db["upload_id"].values
-        ):
+        is_reserved = (catalog_id >= input_catalog_id_start) & (
+            catalog_id <= input_catalog_id_max
+        )
+        if is_reserved.any():
             logger.error(
-                f"upload_id {df['upload_id'][i]} is already in the input_catalog table."
+                f"input_catalog_id for manual insert must be outside of {input_catalog_id_start} to {input_catalog_id_max}: "
+                f"{catalog_id[is_reserved].tolist()} (rows {df.index[is_reserved].tolist()})"
             )
-            raise ValueError(
-                f"upload_id {df['upload_id'][i]} is already in the input_catalog table."
+            errors.append(
+                f"input_catalog_id for manual insert must be outside of {input_catalog_id_start} to {input_catalog_id_max}."
             )
-        if is_input_catalog_id:
-            if (df["input_catalog_id"][i] >= input_catalog_id_start) and (
-                df["input_catalog_id"][i] <= input_catalog_id_max
-            ):
-                logger.error(
-                    f"input_catalog_id for manual insert must be outside of {input_catalog_id_start} to {input_catalog_id_max}."
-                )
-                raise ValueError(
-                    f"input_catalog_id for manual insert must be outside of {input_catalog_id_start} to {input_catalog_id_max}."
-                )
-            elif df["input_catalog_id"][i] > input_catalog_id_absolute_max:
-                logger.error(
-                    "input_catalog_id must be less than 100000 due to datamodel constraint."
-                )
-                raise ValueError("input_catalog_id is too large")
+
+        is_too_large = catalog_id > input_catalog_id_absolute_max
+        if is_too_large.any():
+            logger.error(
+                "input_catalog_id must be less than 100000 due to datamodel constraint: "
+                f"{catalog_id[is_too_large].tolist()} (rows {df.index[is_too_large].tolist()})"
+            )
+            errors.append("input_catalog_id is too large")
+    else:
+        logger.info("input_catalog_id is not found in the DataFrame. Proceed.")
+
+    if errors:
+        raise ValueError(" ".join(errors))
 
 
 def add_database_rows(
@@ -871,6 +1229,13 @@ def add_database_rows(
     upload_id=None,
     insert=False,
     update=False,
+    insert_method="mappings",
+    batch_size=100_000,
+    chunk_size=None,
+    commit_policy="single",
+    db=None,
+    update_method="mappings",
+    on_conflict="update",
 ):
     """
     Add rows to a database from an input file or DataFrame.
@@ -905,6 +1270,32 @@ def add_database_rows(
         If True, insert the DataFrame into the database. Defaults to False.
     update : bool, optional
         If True, update the DataFrame in the database. Defaults to False.
+    insert_method : str, optional
+        The method to insert rows, "mappings" (SQLAlchemy bulk insert),
+        "copy" (binary COPY streamed by batches), or "upsert" (insert or update
+        by the natural key of the table). Defaults to "mappings".
+    batch_size : int, optional
+        The number of rows encoded at a time with the "copy" and "upsert" insert
+        methods and the "staging" update method. Defaults to 100,000.
+    chunk_size : int, optional
+        If given, rows are processed in chunks of this size. Each chunk is read,
+        normalized, validated, resolved for back references, and written before
+        the next one. If `df` is None, the chunks are read from `input_file`
+        one by one. Defaults to None (all rows at once).
+    commit_policy : str, optional
+        Transaction handling in the chunked mode, "single" (one transaction for
+        all chunks) or "chunk" (commit after each chunk). Defaults to "single".
+    db : TargetDB or sqlalchemy.engine.Engine, optional
+        A connected TargetDB instance to reuse (e.g., for several files in a row),
+        which keeps its cached dimension tables between calls, or an engine whose
+        pooled connections are reused. Neither is closed by this function. If
+        None, a new connection is made from `config`.
+    update_method : str, optional
+        Method to update rows, "mappings" (`bulk_update_mappings`) or "staging"
+        (a single UPDATE ... FROM a staging table). Defaults to "mappings".
+    on_conflict : str, optional
+        Action on existing rows with the "upsert" insert method, "update" or
+        "nothing". Defaults to "update".
 
     Returns
     -------
@@ -920,6 +1311,10 @@ def add_database_rows(
     This function connects to the targetDB and adds rows to the specified table.
     If the table is 'proposal', 'fluxstd', or 'sky', it adds back reference values to the DataFrame.
     If the table is 'target' and the DataFrame is from an uploader, it makes a target DataFrame from the uploader.
+
+    With `chunk_size` and a file input, the memory usage is bounded by the chunk
+    size rather than the size of the input file. With the "chunk" commit policy,
+    chunks committed before a failure are kept in the database.
     """
 
     if not insert and not update:
@@ -930,9 +1325,120 @@ def add_database_rows(
         logger.error(f"flux_type must be 'total' or 'psf'. {flux_type=}")
         raise ValueError(f"flux_type must be 'total' or 'psf'. {flux_type=}")
 
-    logger.info("Connecting to targetDB")
-    db = TargetDB(**config["targetdb"]["db"])
-    db.connect()
+    if commit_policy not in ["single", "chunk"]:
+        logger.error(f"commit_policy must be 'single' or 'chunk'. {commit_policy=}")
+        raise ValueError(f"commit_policy must be 'single' or 'chunk'. {commit_policy=}")
+
+    if df is None and chunk_size is None:
+        df = load_input_data(input_file)
+
+    db, close_db = connect_targetdb(config, db)
+    try:
+        if commit:
+            dry_run = False
+            logger.info("Committing the changes to targetDB")
+        else:
+            dry_run = True
+            logger.info("No changes will be committed to targetDB (i.e., dry run)")
+
+        if chunk_size is None:
+            chunks = [df]
+            autocommit = True
+        else:
+            logger.info(
+                f"Processing rows in chunks of {chunk_size} rows (commit policy: {commit_policy})"
+            )
+            if df is None:
+                # the types are pinned to the table for all chunks
+                chunks = iter_input_data(
+                    input_file, chunk_size, dtypes=model_dtypes(table)
+                )
+            else:
+                chunks = (
+                    df.iloc[i : i + chunk_size]
+                    for i in range(0, df.index.size, chunk_size)
+                )
+            autocommit = commit_policy == "chunk"
+
+        n_rows_total, n_chunks = 0, 0
+        t_start = time.time()
+        try:
+            for df_chunk in chunks:
+                if chunk_size is not None:
+                    # positional lookups in the helpers assume a 0-based index
+                    df_chunk = df_chunk.reset_index(drop=True)
+                    logger.info(f"Chunk {n_chunks + 1}: {df_chunk.index.size} rows")
+
+                n_rows_total += _write_database_rows(
+                    df_chunk,
+                    db,
+                    table,
+                    input_file=input_file,
+                    verbose=verbose,
+                    from_uploader=from_uploader,
+                    flux_type=flux_type,
+                    proposal_id=proposal_id,
+                    upload_id=upload_id,
+                    insert=insert,
+                    update=update,
+                    insert_method=insert_method,
+                    update_method=update_method,
+                    on_conflict=on_conflict,
+                    batch_size=batch_size,
+                    dry_run=dry_run,
+                    autocommit=autocommit,
+                )
+                n_chunks += 1
+
+            if not autocommit:
+                if dry_run:
+                    db.rollback()
+                else:
+                    db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Operation failed: {e}: {input_file}")
+            if chunk_size is not None and autocommit and not dry_run:
+                logger.error(
+                    f"{n_rows_total} rows in {n_chunks} chunks had been committed before the failure."
+                )
+            raise
+
+        if chunk_size is not None:
+            logger.info(
+                f"Processed {n_rows_total} rows in {n_chunks} chunks in {input_file} ({time.time() - t_start:.2f} s)"
+            )
+
+        if fetch:
+            logger.info("Fetching the first 100 table entries")
+            res = db.fetch_all(table)
+            logger.info(f"Fetched the first 100 entries in the {table} table: \n{res}")
+    finally:
+        if close_db:
+            logger.info("Closing targetDB")
+            db.close()
+
+
+def _write_database_rows(
+    df,
+    db,
+    table,
+    input_file=None,
+    verbose=False,
+    from_uploader=False,
+    flux_type="total",
+    proposal_id=None,
+    upload_id=None,
+    insert=False,
+    update=False,
+    insert_method="mappings",
+    update_method="mappings",
+    on_conflict="update",
+    batch_size=100_000,
+    dry_run=True,
+    autocommit=True,
+):
+    """Resolve back references of a DataFrame and insert or update it. Return the number of rows."""
 
     t_begin = time.time()
     if table in ["proposal", "fluxstd", "sky", "user_pointing"]:
@@ -967,40 +1473,38 @@ def add_database_rows(
     if verbose:
         logger.debug(f"Working on the following DataFrame: \n{df}")
 
-    try:
-        t_begin = time.time()
-        if commit:
-            dry_run = False
-            logger.info("Committing the changes to targetDB")
-        else:
-            dry_run = True
-            logger.info("No changes will be committed to targetDB (i.e., dry run)")
-
-        # logger.info(f"{df['total_flux_r'][:100]}")
-        # db.close()
-        # exit()
-
-        if insert:
-            db.insert(table, df, dry_run=dry_run)
-        elif update:
-            db.update(table, df, dry_run=dry_run)
-        t_end = time.time()
-        logger.info(
-            f"Insert data to the {table} table successful for {df.index.size} rows in {input_file} ({t_end - t_begin:.2f} s)"
-            if insert
-            else f"Update data in the {table} table successful for {df.index.size} rows in {input_file} ({t_end - t_begin:.2f} s)"
+    t_begin = time.time()
+    if insert:
+        db.insert(
+            table,
+            df,
+            dry_run=dry_run,
+            method=insert_method,
+            batch_size=batch_size,
+            autocommit=autocommit,
+            on_conflict=on_conflict,
         )
-    except Exception as e:
-        logger.error(f"Operation failed: {e}: {input_file}")
-        raise
+    elif update:
+        db.update(
+            table,
+            df,
+            dry_run=dry_run,
+            autocommit=autocommit,
+            method=update_method,
+            batch_size=batch_size,
+        )
+    t_end = time.time()
+    logger.info(
+        f"Insert data to the {table} table successful for {df.index.size} rows in {input_file} ({t_end - t_begin:.2f} s)"
+        if insert
+        else f"Update data in the {table} table successful for {df.index.size} rows in {input_file} ({t_end - t_begin:.2f} s)"
+    )
+
+    return df.index.size
 
-    if fetch:
-        logger.info("Fetching the first 100 table entries")
-        res = db.fetch_all(table)
-        logger.info(f"Fetched the first 100 entries in the {table} table: \n{res}")
 
-    logger.info("Closing targetDB")
-    db.close()
+# columns by which duplicates are removed from the merged file of check_duplicates
+MERGED_UNIQUE_COLUMNS = ["obj_id", "input_catalog_id", "version"]
 
 
 def check_duplicates(
@@ -1010,6 +1514,11 @@ def check_duplicates(
     skip_save_merged=False,
     additional_columns=None,
     check_columns=None,
+    out_of_core=False,
+    n_buckets=64,
+    batch_size=1_000_000,
+    n_jobs=1,
+    tmpdir=None,
 ):
     """
     Checks for duplicates in files in a given directory.
@@ -1025,10 +1534,38 @@ def check_duplicates(
         Defaults to "parquet".
     skip_save_merged : bool, optional
         If True, the merged dataframe will not be saved. Defaults to False.
+    additional_columns : list of str, optional
+        Additional columns to be saved in the output files. Defaults to None.
+    check_columns : list of str, optional
+        Columns used to check for duplicates.
+        Defaults to ["obj_id", "input_catalog_id", "version"].
+    out_of_core : bool, optional
+        If True, the input files are streamed and the rows are hash-partitioned
+        into on-disk buckets by the key columns, so that only one bucket at a time
+        (per job) is held in memory. The output files are the same as those of the
+        in-memory mode. Defaults to False.
+    n_buckets : int, optional
+        The number of buckets in the out-of-core mode. Defaults to 64.
+    batch_size : int, optional
+        The number of rows read at a time in the out-of-core mode.
+        Defaults to 1,000,000.
+    n_jobs : int, optional
+        The number of processes to read the input files (in-memory mode) or
+        to check the buckets (out-of-core mode). Defaults to 1.
+    tmpdir : str, optional
+        The directory where the buckets are spilled. The system default
+        temporary directory is used if None.
 
     Returns
     -------
     None
+
+    Notes
+    -----
+    The input files are those in `indir` and in its Hive partition
+    directories (e.g., `indir/healpix=123/part-0.parquet` written by
+    `prep_fluxstd_data` with healpix_nside). The input_file column of the
+    output files has the partition directories of the files in the latter.
     """
 
     if additional_columns is None:
@@ -1041,7 +1578,7 @@ def check_duplicates(
         os.makedirs(outdir)
 
     # Get a list of all feather files in the directory
-    input_files = glob.glob(os.path.join(indir, f"*.{file_format}"))
+    input_files = _list_input_files(indir, file_format)
 
     if len(input_files) == 0:
         logger.error(f"No files found in the directory: {indir}")
@@ -1049,37 +1586,46 @@ def check_duplicates(
 
     logger.info(f"Total number of files: {len(input_files)}")
 
-    dataframes = []
-
-    # Loop through the list of input files
-    for i, f in enumerate(input_files):
-        logger.info(f"Reading file {i+1}/{len(input_files)}: {f}")
-        # Read the input file into a DataFrame
-        file_df = load_input_data(f, logger=logger)
-        file_df["input_file"] = f.rsplit("/")[-1].replace(f".{file_format}", "")
-
-        # only selected columns are included because of the memory limit
-        dataframes.append(
-            file_df.loc[
-                :,
-                [
-                    "obj_id",
-                    "ra",
-                    "dec",
-                    "input_catalog_id",
-                    "version",
-                    "input_file",
-                    "is_fstar_gaia",
-                    "prob_f_star",
-                ]
-                + additional_columns,
-            ]
+    # only selected columns are read because of the memory limit
+    columns = [
+        "obj_id",
+        "ra",
+        "dec",
+        "input_catalog_id",
+        "version",
+        "is_fstar_gaia",
+        "prob_f_star",
+    ] + additional_columns
+
+    if out_of_core:
+        _check_duplicates_out_of_core(
+            input_files,
+            outdir,
+            file_format,
+            columns,
+            check_columns,
+            skip_save_merged=skip_save_merged,
+            n_buckets=n_buckets,
+            batch_size=batch_size,
+            n_jobs=n_jobs,
+            tmpdir=tmpdir,
         )
+        return
+
+    t_begin = time.time()
+    results = _map_files(
+        partial(_read_dups_file, columns=columns, file_format=file_format),
+        input_files,
+        n_jobs=n_jobs,
+    )
+    dataframes = [file_df for file_df, _ in results]
+    stage_times = [times for _, times in results]
 
     logger.info("Finished reading all input files.")
 
     # Concatenate all DataFrames into a single DataFrame
     df = pd.concat(dataframes, ignore_index=True)
+    t_stage = time.time()
 
     # Check for duplicates
     logger.info(f"Checking for duplicates using the following columns: {check_columns}")
@@ -1100,11 +1646,13 @@ def check_duplicates(
         )
     else:
         logger.info("No duplicates found.")
+    t_check = time.time() - t_stage
+    t_stage = time.time()
 
     # save duplicate-removed dataframe as a feather or parquet file
     if not skip_save_merged:
         df_cleaned = df.drop_duplicates(
-            subset=["obj_id", "input_catalog_id", "version"],
+            subset=MERGED_UNIQUE_COLUMNS,
             ignore_index=True,
         )
         output_file = os.path.join(
@@ -1118,44 +1666,450 @@ def check_duplicates(
         else:
             logger.error(f"Unsupported file format: {file_format}")
 
+    stage_times.append({"check": t_check, "write": time.time() - t_stage})
+    _log_stage_times(stage_times, time.time() - t_begin)
 
-def prep_fluxstd_data(
-    input_dir,
-    output_dir,
-    version,
-    input_catalog_id,
-    input_catalog_name,
-    rename_cols=None,
+
+def check_positional_duplicates(
+    indir=None,
+    outdir=None,
+    radius=1.0,
     file_format="parquet",
+    id_column="target_id",
+    n_jobs=1,
+    cluster_id_start=1,
 ):
     """
-    Prepare flux standard data ready to be inserted to the target database.
+    Finds groups of sources within a given angular distance in files in a directory.
 
     Parameters
     ----------
-    input_dir : str
-        The directory containing the input files.
-    output_dir : str
-        The directory where the output files will be saved.
-    version : str
-        The version string to be added to the dataframe.
-    input_catalog_id : int
-        The input catalog ID to be added to the dataframe.
-    input_catalog_name : str
-        The input catalog ID name to be added to the dataframe.
-    rename_cols : dict, optional
-        A dictionary mapping old column names to new ones. Defaults to None.
+    indir : str
+        The directory containing the input files. Defaults to None.
+    outdir : str
+        The directory where the output file (clusters.csv) will be saved.
+        Defaults to None.
+    radius : float, optional
+        The linking length in arcsec. Defaults to 1.0.
     file_format : str, optional
-        The format of the output files, "feather" or "parquet". Defaults to "parquet".
+        The format of the input files. The Feather or Parquet formats are supported.
+        Defaults to "parquet".
+    id_column : str, optional
+        The column written as target_id in the output file. Defaults to "target_id".
+        Use "obj_id" for input files without target IDs (e.g., prepared flux
+        standards or uploaded targets).
+    n_jobs : int, optional
+        The number of processes to read the input files. Defaults to 1.
+    cluster_id_start : int, optional
+        The first cluster_id in the output file. Defaults to 1.
 
     Returns
     -------
-    None
+    df : pandas.DataFrame or None
+        The rows of the output file, or None if no input files are found.
+
+    Raises
+    ------
+    ValueError
+        If any of the input files does not have `id_column`, ra, or dec.
+
+    Notes
+    -----
+    The input files are found as in `check_duplicates`, including those in
+    the Hive partition directories of `indir`.
+    Sources are grouped across all input files by the friends-of-friends
+    algorithm, i.e., two sources within the radius are in the same group, using
+    a grid of unit vectors as the spatial index (see `targetdb.spatial.find_pairs`).
+    Groups with two or more sources are written with the columns of the cluster
+    table (`input_catalog_id` is included when any of the input files has it,
+    and is empty for the rows of the other files), so that the output file can
+    be inserted into the cluster table when `id_column` holds target IDs.
+    The clusters are numbered from `cluster_id_start`, which should be larger
+    than the cluster_id values already in the cluster table to avoid collisions.
+    """
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    input_files = _list_input_files(indir, file_format)
+
+    if len(input_files) == 0:
+        logger.error(f"No files found in the directory: {indir}")
+        return None
+
+    logger.info(f"Total number of files: {len(input_files)}")
+
+    columns = [id_column, "ra", "dec"]
+    file_columns = [set(_file_column_names(f)) for f in input_files]
+    for input_file, names in zip(input_files, file_columns, strict=True):
+        missing = [c for c in columns if c not in names]
+        if missing:
+            logger.error(
+                f"Columns {missing} are not found in {input_file}. "
+                "Use the obj_id column as id_column for files without target IDs."
+            )
+            raise ValueError(
+                f"Columns {missing} are not found in {input_file}. "
+                "Use the obj_id column as id_column for files without target IDs."
+            )
+    has_input_catalog_id = ["input_catalog_id" in names for names in file_columns]
+    if any(has_input_catalog_id):
+        columns.append("input_catalog_id")
+        if not all(has_input_catalog_id):
+            logger.warning(
+                "input_catalog_id is not found in some of the input files "
+                "and is left empty for their rows"
+            )
+
+    t_begin = time.time()
+    results = _map_files(
+        partial(_read_positions_file, columns=columns), input_files, n_jobs=n_jobs
+    )
+    df = pd.concat([file_df for file_df, _ in results], ignore_index=True)
+    stage_times = [times for _, times in results]
+    logger.info(f"Finished reading {df.index.size} rows from all input files.")
+
+    t_stage = time.time()
+    logger.info(f"Finding groups of sources within {radius} arcsec")
+    labels = spatial.friends_of_friends(
+        df["ra"].to_numpy(), df["dec"].to_numpy(), radius / 3600.0
+    )
+    df_clusters = spatial.make_cluster_table(
+        df["ra"].to_numpy(),
+        df["dec"].to_numpy(),
+        labels,
+        df[id_column].to_numpy(),
+        input_catalog_id=(
+            df["input_catalog_id"].astype("Int64").to_numpy()
+            if "input_catalog_id" in columns
+            else None
+        ),
+        cluster_id_start=cluster_id_start,
+    )
+    n_clusters = df_clusters["cluster_id"].nunique()
+    t_check = time.time() - t_stage
+
+    t_stage = time.time()
+    if n_clusters > 0:
+        logger.info(
+            f"Number of clusters: {n_clusters} ({df_clusters.index.size} sources)"
+        )
+    else:
+        logger.info("No positional duplicates found.")
+    df_clusters.to_csv(os.path.join(f"{outdir}", "clusters.csv"), index=False)
+
+    stage_times.append({"check": t_check, "write": time.time() - t_stage})
+    _log_stage_times(stage_times, time.time() - t_begin)
+
+    return df_clusters
+
+
+def _file_column_names(input_file):
+    if input_file.endswith(".parquet"):
+        return pq.read_schema(input_file).names
+    return pa.ipc.open_file(pa.memory_map(input_file)).schema.names
+
+
+def _read_positions_file(input_file, i, columns):
+    logger.info(f"Reading file {i+1}: {input_file}")
+    t_begin = time.time()
+    # input_catalog_id is read where available
+    columns = [c for c in columns if c in _file_column_names(input_file)]
+    file_df = load_input_data(input_file, logger=logger, columns=columns)
+    return file_df, {"read": time.time() - t_begin}
+
+
+def _read_dups_file(input_file, i, columns, file_format):
+    logger.info(f"Reading file {i+1}: {input_file}")
+    t_begin = time.time()
+    file_df = load_input_data(input_file, logger=logger, columns=columns).loc[
+        :, columns
+    ]
+    file_df.insert(5, "input_file", _input_file_label(input_file, file_format))
+    return file_df, {"read": time.time() - t_begin}
+
+
+def _iter_file_batches(input_file, columns, batch_size):
+    # stream record batches of the selected columns in the given order
+    if input_file.endswith(".parquet"):
+        for batch in pq.ParquetFile(input_file).iter_batches(
+            batch_size=batch_size, columns=columns
+        ):
+            yield pa.Table.from_batches([batch]).select(columns)
+    else:
+        # record batches are decompressed one at a time
+        reader = pa.ipc.open_file(pa.memory_map(input_file))
+        for i in range(reader.num_record_batches):
+            tb = pa.Table.from_batches([reader.get_batch(i)]).select(columns)
+            for batch in tb.to_batches(max_chunksize=batch_size):
+                yield pa.Table.from_batches([batch])
+
+
+def _list_input_files(indir, file_format):
+    # files in indir and in its Hive partition directories (e.g., healpix=123
+    # written by prep_fluxstd_data), but not in other subdirectories
+    input_files = glob.glob(
+        os.path.join(indir, "**", f"*.{file_format}"), recursive=True
+    )
+    return sorted(
+        f
+        for f in input_files
+        if all("=" in d for d in Path(os.path.relpath(f, indir)).parent.parts)
+    )
+
+
+def _input_file_label(input_file, file_format):
+    # the Hive partition directories are kept as the file names in them are
+    # the same (e.g., healpix=123/part-0)
+    parts = Path(input_file).parts
+    n_dirs = 0
+    while n_dirs < len(parts) - 1 and "=" in parts[-2 - n_dirs]:
+        n_dirs += 1
+    return "/".join(parts[len(parts) - 1 - n_dirs :]).replace(f".{file_format}", "")
+
+
+def _bucket_duplicates(bucket_file, check_columns, unique_columns):
+    # returns the row numbers of all duplicated rows (by check_columns) and
+    # those of the rows to be removed from the merged file (by unique_columns)
+    with pa.memory_map(bucket_file) as source:
+        df = pa.ipc.open_stream(source).read_all().to_pandas()
+    if df.empty:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    # rows are spilled in the order of the row number, so keep="first"
+    # keeps the same row as the in-memory mode
+    is_dup = df.duplicated(subset=check_columns, keep=False).to_numpy()
+    is_drop = df.duplicated(subset=unique_columns, keep="first").to_numpy()
+    rows = df["_row"].to_numpy()
+    return rows[is_dup], rows[is_drop]
+
+
+def _check_duplicates_out_of_core(
+    input_files,
+    outdir,
+    file_format,
+    columns,
+    check_columns,
+    skip_save_merged=False,
+    n_buckets=64,
+    batch_size=1_000_000,
+    n_jobs=1,
+    tmpdir=None,
+):
+    # rows duplicated by either set of columns share the values of the common
+    # columns, so that they fall in the same bucket
+    partition_columns = [c for c in check_columns if c in MERGED_UNIQUE_COLUMNS]
+    if len(partition_columns) == 0:
+        logger.error(
+            f"check_columns must include one of {MERGED_UNIQUE_COLUMNS} "
+            f"in the out-of-core mode: {check_columns=}"
+        )
+        raise ValueError(
+            f"check_columns must include one of {MERGED_UNIQUE_COLUMNS} "
+            f"in the out-of-core mode: {check_columns=}"
+        )
+    key_columns = list(dict.fromkeys(check_columns + MERGED_UNIQUE_COLUMNS))
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as spill_dir:
+        # pass 1: spill the key columns and the global row number into buckets
+        t_begin = time.time()
+        bucket_files = [
+            os.path.join(spill_dir, f"bucket_{i:04d}.arrow") for i in range(n_buckets)
+        ]
+        writers = [None] * n_buckets
+        key_schema = None
+        n_rows = 0
+        try:
+            for i, f in enumerate(input_files):
+                logger.info(f"Partitioning file {i+1}/{len(input_files)}: {f}")
+                for tb in _iter_file_batches(f, key_columns, batch_size):
+                    if key_schema is None:
+                        key_schema = tb.schema.append(pa.field("_row", pa.int64()))
+                    tb = tb.append_column(
+                        "_row", pa.array(np.arange(n_rows, n_rows + tb.num_rows))
+                    ).cast(key_schema)
+                    n_rows += tb.num_rows
+                    bucket = (
+                        pd.util.hash_pandas_object(
+                            tb.select(partition_columns).to_pandas(), index=False
+                        ).to_numpy()
+                        % n_buckets
+                    )
+                    order = np.argsort(bucket, kind="stable")
+                    tb = tb.take(order)
+                    offsets = np.concatenate(
+                        [[0], np.cumsum(np.bincount(bucket, minlength=n_buckets))]
+                    )
+                    for j in np.flatnonzero(np.diff(offsets)):
+                        if writers[j] is None:
+                            writers[j] = pa.ipc.new_stream(bucket_files[j], key_schema)
+                        writers[j].write_table(
+                            tb.slice(offsets[j], offsets[j + 1] - offsets[j])
+                        )
+        finally:
+            for writer in writers:
+                if writer is not None:
+                    writer.close()
+        logger.info(
+            f"Partitioned {n_rows} rows into {n_buckets} buckets "
+            f"in {time.time() - t_begin:.2f} s"
+        )
+
+        # check each bucket
+        t_begin = time.time()
+        bucket_files = [
+            bf for bf, writer in zip(bucket_files, writers, strict=True) if writer
+        ]
+        logger.info(
+            f"Checking for duplicates using the following columns: {check_columns}"
+        )
+        if n_jobs > 1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(
+                    executor.map(
+                        _bucket_duplicates,
+                        bucket_files,
+                        [check_columns] * len(bucket_files),
+                        [MERGED_UNIQUE_COLUMNS] * len(bucket_files),
+                    )
+                )
+        else:
+            results = [
+                _bucket_duplicates(bf, check_columns, MERGED_UNIQUE_COLUMNS)
+                for bf in bucket_files
+            ]
+        logger.info(f"Checked the buckets in {time.time() - t_begin:.2f} s")
+
+    dup_rows = np.sort(np.concatenate([r[0] for r in results] + [[]])).astype(np.int64)
+    drop_rows = np.sort(np.concatenate([r[1] for r in results] + [[]])).astype(np.int64)
+
+    logger.info(f"Duplicates exist: {dup_rows.size > 0}")
+    if dup_rows.size == 0:
+        logger.info("No duplicates found.")
+        if skip_save_merged:
+            return
+
+    # pass 2: stream the output columns again in the same order to collect the
+    # duplicated rows and write the merged file without the removed rows
+    t_begin = time.time()
+    output_file = os.path.join(f"{outdir}", f"all_merged_nodups.{file_format}")
+    if not skip_save_merged and file_format not in ["feather", "parquet"]:
+        logger.error(f"Unsupported file format: {file_format}")
+        skip_save_merged = True
+    dup_chunks = []
+    writer, schema = None, None
+    n_rows = 0
+    try:
+        for f in input_files:
+            label = _input_file_label(f, file_format)
+            for tb in _iter_file_batches(f, columns, batch_size):
+                rows = np.arange(n_rows, n_rows + tb.num_rows)
+                n_rows += tb.num_rows
+                tb = tb.add_column(
+                    5, "input_file", pa.array(np.full(tb.num_rows, label))
+                )
+                if schema is None:
+                    schema = tb.schema
+                tb = tb.cast(schema)
+                is_dup = np.isin(rows, dup_rows, assume_unique=True)
+                if is_dup.any():
+                    dup_chunks.append(tb.filter(is_dup))
+                if skip_save_merged:
+                    continue
+                tb = tb.filter(~np.isin(rows, drop_rows, assume_unique=True))
+                if writer is None:
+                    if file_format == "parquet":
+                        writer = pq.ParquetWriter(output_file, schema)
+                    else:
+                        writer = pa.ipc.new_file(
+                            output_file,
+                            schema,
+                            options=pa.ipc.IpcWriteOptions(compression="lz4"),
+                        )
+                writer.write_table(tb)
+    finally:
+        if writer is not None:
+            writer.close()
+    logger.info(f"Wrote the output files in {time.time() - t_begin:.2f} s")
+
+    if dup_rows.size > 0:
+        df_dups = pa.concat_tables(dup_chunks).to_pandas()
+        logger.info(f"Number of duplicates: {dup_rows.size}")
+        logger.info(f"Duplicate rows: \n{df_dups}")
+        df_dups.sort_values(by=["obj_id"]).to_csv(
+            os.path.join(f"{outdir}", "duplicates.csv"),
+            index=False,
+        )
+
+
+def prep_fluxstd_data(
+    input_dir,
+    output_dir,
+    version,
+    input_catalog_id,
+    input_catalog_name,
+    rename_cols=None,
+    file_format="parquet",
+    n_jobs=1,
+    healpix_nside=None,
+):
+    """
+    Prepare flux standard data ready to be inserted to the target database.
+
+    Parameters
+    ----------
+    input_dir : str
+        The directory containing the input files.
+    output_dir : str
+        The directory where the output files will be saved.
+    version : str
+        The version string to be added to the dataframe.
+    input_catalog_id : int
+        The input catalog ID to be added to the dataframe.
+    input_catalog_name : str
+        The input catalog ID name to be added to the dataframe.
+    rename_cols : dict, optional
+        A dictionary mapping old column names to new ones. Defaults to None.
+    file_format : str, optional
+        The format of the output files, "feather" or "parquet". Defaults to "parquet".
+    n_jobs : int, optional
+        The number of processes to convert the files in parallel. Defaults to 1.
+    healpix_nside : int, optional
+        If given, the rows are repartitioned by the HEALPix pixel (NESTED) of
+        ra and dec with the nside instead of written to one output file per
+        input file. A ValueError is raised for rows with NaN or infinite ra or
+        dec. Defaults to None.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If neither input_catalog_id nor input_catalog_name is provided, or
+        with healpix_nside, if output_dir already has partitions or the nside
+        is larger than 32.
 
     Notes
     -----
     Either of input_catalog_id or input_catalog_name must be provided.
     If both are provided, input_catalog_name will be used.
+
+    The input files are processed in the order of their names. A summary of
+    the time spent in reading, transforming, and writing is logged at the end.
+
+    With healpix_nside, each output file is
+    `output_dir/healpix={pixel}/part-0.{file_format}`, which has the rows in
+    the pixel sorted by a finer HEALPix pixel (of nside 8192 or healpix_nside
+    if larger) and then obj_id, so that the rows close on the sky are stored
+    together and the min/max statistics of the parquet row groups are tight.
+    The pixel is given by the directory name as a Hive partition and is not
+    a column in the files. The number of rows and the ranges of ra, dec, and
+    obj_id of the files are listed in `output_dir/_partitions.csv`. The rows
+    are first written to fragments per input file and pixel in a temporary
+    directory in output_dir, so only an input file or a partition is held in
+    memory at a time. As the number of fragments grows with the number of
+    pixels, healpix_nside is limited to 32 (12,288 pixels).
     """
 
     if (input_catalog_name is None) and (input_catalog_id is None):
@@ -1170,61 +2124,255 @@ def prep_fluxstd_data(
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Iterate over all files in the input directory
-    input_files = os.listdir(input_dir)
-    for i, filename in enumerate(input_files):
-        # Check if the file is a CSV file
-        logger.info(f"Processing... {i+1}/{len(input_files)}: {filename}")
-        if filename.endswith((".csv", ".feather", ".parquet")):
-            t1 = time.time()
-            logger.info(f"\tConverting {filename} to the {file_format} format")
-
-            # Read the CSV file
-            df = load_input_data(os.path.join(input_dir, filename), logger=logger)
-
-            # rename fstar_gaia to is_fstar_gaia
-            if rename_cols is not None:
-                logger.info(f"\tRenaming columns: {rename_cols}")
-                df.rename(columns=rename_cols, inplace=True)
-
-            # add input_catalog_id if input_catalog_name is not provided
-            if input_catalog_id is not None:
-                if input_catalog_name is None:
-                    logger.info(f"\tAdding input_catalog_id: {input_catalog_id}")
-                    df["input_catalog_id"] = input_catalog_id
-                else:
-                    logger.warning(
-                        "\tBoth input_catalog_id and input_catalog_name are provided. "
-                        "Using input_catalog_name."
-                    )
+    if healpix_nside is not None:
+        healpix_nside = spatial.check_nside(healpix_nside)
+        if healpix_nside > FLUXSTD_MAX_HEALPIX_NSIDE:
+            logger.error(
+                f"healpix_nside must be up to {FLUXSTD_MAX_HEALPIX_NSIDE}: {healpix_nside}"
+            )
+            raise ValueError(
+                f"healpix_nside must be up to {FLUXSTD_MAX_HEALPIX_NSIDE}: {healpix_nside}"
+            )
+        existing = sorted(Path(output_dir).glob("healpix=*"))
+        if len(existing) > 0:
+            logger.error(f"HEALPix partitions already exist in {output_dir}")
+            raise ValueError(f"HEALPix partitions already exist in {output_dir}")
 
-            if input_catalog_name is not None:
-                logger.info(f"\tAdding input_catalog_name: {input_catalog_name}")
-                df["input_catalog_name"] = input_catalog_name
-
-            # add version column to df as strings
-            logger.info(f"\tAdding version string: {version}")
-            df["version"] = version
-
-            # Convert the filename from .csv to pyarrow formats
-            filename_body = f"{os.path.splitext(filename)[0]}"
-            if file_format == "parquet":
-                parquet_filename = f"{filename_body}.parquet"
-                # Write the DataFrame to a Parquet file
-                df.to_parquet(os.path.join(output_dir, parquet_filename), index=False)
-            elif file_format == "feather":
-                feather_filename = f"{filename_body}.feather"
-                # Write the DataFrame to a Feather file
-                df.to_feather(os.path.join(output_dir, feather_filename))
-            t2 = time.time()
-            logger.info(
-                f"Done. Conversion took {t2-t1:.2f} seconds for {df.index.size} rows\n"
+    # Iterate over all files in the input directory
+    t_begin = time.time()
+    input_files = sorted(os.listdir(input_dir))
+    with (
+        tempfile.TemporaryDirectory(dir=output_dir, prefix=".prep-fluxstd-")
+        if healpix_nside is not None
+        else nullcontext()
+    ) as fragment_dir:
+        results = _map_files(
+            partial(
+                _prep_fluxstd_file,
+                input_dir=input_dir,
+                output_dir=output_dir,
+                version=version,
+                input_catalog_id=input_catalog_id,
+                input_catalog_name=input_catalog_name,
+                rename_cols=rename_cols,
+                file_format=file_format,
+                healpix_nside=healpix_nside,
+                fragment_dir=fragment_dir,
+                n_files=len(input_files),
+            ),
+            input_files,
+            n_jobs=n_jobs,
+        )
+        if healpix_nside is not None:
+            _merge_healpix_fragments(
+                fragment_dir, output_dir, healpix_nside, file_format, n_jobs
             )
+    _log_stage_times([r for r in results if r is not None], time.time() - t_begin)
+
+
+def _map_files(func, input_files, n_jobs=1):
+    # apply func to each file, in a process pool if n_jobs > 1;
+    # the results are returned in the order of input_files
+    if n_jobs > 1 and len(input_files) > 1:
+        logger.info(f"Processing {len(input_files)} files with {n_jobs} processes")
+        results = [None] * len(input_files)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = {
+                executor.submit(_call_with_logs, func, f, i): i
+                for i, f in enumerate(input_files)
+            }
+            # the messages of a file are logged together when it is done
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]], messages = future.result()
+                except Exception as e:
+                    # the messages of the failed file lead up to the error
+                    _log_worker_messages(getattr(e, "log_messages", []))
+                    raise e
+                _log_worker_messages(messages)
+        return results
+    return [func(f, i) for i, f in enumerate(input_files)]
+
+
+def _call_with_logs(func, *args):
+    # run func in a worker process and return the log messages with the result
+    # to be logged in the parent process, as the sinks of the parent process
+    # are not inherited by workers started with spawn (and are duplicated
+    # with fork)
+    messages = []
+    logger.remove()
+    logger.add(
+        lambda m: messages.append((m.record["level"].name, m.record["message"])),
+        level=0,
+        format="{message}",
+    )
+    try:
+        return func(*args), messages
+    except Exception as e:
+        # the messages travel with the exception pickled back to the parent
+        e.log_messages = messages
+        raise e
+
+
+def _log_worker_messages(messages):
+    for level, message in messages:
+        logger.log(level, message)
+
+
+def _log_stage_times(stage_times, t_wall):
+    # stage_times is a list of dicts with the seconds spent in each stage per file
+    totals = {}
+    for times in stage_times:
+        for stage, t in times.items():
+            totals[stage] = totals.get(stage, 0.0) + t
+    summary = ", ".join(f"{stage}: {t:.2f} s" for stage, t in totals.items())
+    logger.info(f"Time spent in each stage (summed over files): {summary}")
+    logger.info(f"Total elapsed time: {t_wall:.2f} s")
+
+
+def _prep_fluxstd_file(
+    filename,
+    i,
+    input_dir,
+    output_dir,
+    version,
+    input_catalog_id,
+    input_catalog_name,
+    rename_cols,
+    file_format,
+    healpix_nside=None,
+    fragment_dir=None,
+    n_files=None,
+):
+    # messages are prefixed with the file name as they can be interleaved
+    # when the files are processed in parallel
+    logger.info(f"Processing... {i+1}/{n_files}: {filename}")
+    if not filename.endswith((".csv", ".feather", ".parquet")):
+        logger.warning(
+            f"Skipping... {filename} does not end with one of .csv, .feather, and .parquet"
+        )
+        return None
+
+    t1 = time.time()
+    logger.info(f"\t[{filename}] Converting to the {file_format} format")
+
+    # Read the CSV file
+    df = load_input_data(os.path.join(input_dir, filename), logger=logger)
+    t_read = time.time()
+
+    # rename fstar_gaia to is_fstar_gaia
+    if rename_cols is not None:
+        logger.info(f"\t[{filename}] Renaming columns: {rename_cols}")
+        df.rename(columns=rename_cols, inplace=True)
+
+    # add input_catalog_id if input_catalog_name is not provided
+    if input_catalog_id is not None:
+        if input_catalog_name is None:
+            logger.info(f"\t[{filename}] Adding input_catalog_id: {input_catalog_id}")
+            df["input_catalog_id"] = input_catalog_id
         else:
             logger.warning(
-                f"Skipping... {filename} does not end with one of .csv, .feather, and .parquet"
+                f"\t[{filename}] Both input_catalog_id and input_catalog_name are provided. "
+                "Using input_catalog_name."
             )
 
+    if input_catalog_name is not None:
+        logger.info(f"\t[{filename}] Adding input_catalog_name: {input_catalog_name}")
+        df["input_catalog_name"] = input_catalog_name
+
+    # add version column to df as strings
+    logger.info(f"\t[{filename}] Adding version string: {version}")
+    df["version"] = version
+    t_transform = time.time()
+
+    # Convert the filename from .csv to pyarrow formats
+    filename_body = f"{os.path.splitext(filename)[0]}"
+    if healpix_nside is not None:
+        # fragments are merged into the partitions after all files are read
+        pixels = spatial.healpix_index(df["ra"], df["dec"], healpix_nside)
+        for pixel, df_pixel in df.groupby(pixels, sort=False):
+            pixel_dir = Path(fragment_dir) / f"{pixel}"
+            pixel_dir.mkdir(exist_ok=True)
+            df_pixel.reset_index(drop=True).to_feather(pixel_dir / f"{i:06d}.feather")
+    elif file_format == "parquet":
+        parquet_filename = f"{filename_body}.parquet"
+        # Write the DataFrame to a Parquet file
+        df.to_parquet(os.path.join(output_dir, parquet_filename), index=False)
+    elif file_format == "feather":
+        feather_filename = f"{filename_body}.feather"
+        # Write the DataFrame to a Feather file
+        df.to_feather(os.path.join(output_dir, feather_filename))
+    t2 = time.time()
+    logger.info(
+        f"[{filename}] Done. Conversion took {t2-t1:.2f} seconds for {df.index.size} rows\n"
+    )
+    return {
+        "read": t_read - t1,
+        "transform": t_transform - t_read,
+        "write": t2 - t_transform,
+    }
+
+
+# HEALPix nside of the order of the rows in the partitions of prep_fluxstd_data
+FLUXSTD_SORT_NSIDE = 8192
+# the largest nside of the partitions of prep_fluxstd_data, which bounds the
+# number of fragments per input file
+FLUXSTD_MAX_HEALPIX_NSIDE = 32
+
+
+def _merge_healpix_fragments(
+    fragment_dir, output_dir, healpix_nside, file_format, n_jobs
+):
+    # merge the fragments of each pixel into a partition and list the partitions
+    t_begin = time.time()
+    pixel_dirs = sorted(Path(fragment_dir).iterdir(), key=lambda p: int(p.name))
+    results = _map_files(
+        partial(
+            _write_healpix_partition,
+            output_dir=output_dir,
+            healpix_nside=healpix_nside,
+            file_format=file_format,
+        ),
+        pixel_dirs,
+        n_jobs=n_jobs,
+    )
+    df_partitions = pd.DataFrame(results)
+    df_partitions.to_csv(Path(output_dir) / "_partitions.csv", index=False)
+    logger.info(
+        f"Wrote {df_partitions['n_rows'].sum()} rows in {len(results)} HEALPix partitions "
+        f"of nside={healpix_nside} in {time.time() - t_begin:.2f} s"
+    )
+
+
+def _write_healpix_partition(pixel_dir, i, output_dir, healpix_nside, file_format):
+    df = pd.concat(
+        [pd.read_feather(f) for f in sorted(pixel_dir.glob("*.feather"))],
+        ignore_index=True,
+    )
+    # sort by a finer pixel for the locality within the partition
+    sort_nside = max(healpix_nside, FLUXSTD_SORT_NSIDE)
+    fine_pixels = spatial.healpix_index(df["ra"], df["dec"], sort_nside)
+    df = df.iloc[np.lexsort((df["obj_id"].to_numpy(), fine_pixels))]
+    df.reset_index(drop=True, inplace=True)
+
+    outfile = Path(f"healpix={pixel_dir.name}") / f"part-0.{file_format}"
+    (Path(output_dir) / outfile.parent).mkdir()
+    if file_format == "parquet":
+        df.to_parquet(Path(output_dir) / outfile, index=False)
+    elif file_format == "feather":
+        df.to_feather(Path(output_dir) / outfile)
+    return {
+        "healpix": int(pixel_dir.name),
+        "file": outfile.as_posix(),
+        "n_rows": df.index.size,
+        "ra_min": df["ra"].min(),
+        "ra_max": df["ra"].max(),
+        "dec_min": df["dec"].min(),
+        "dec_max": df["dec"].max(),
+        "obj_id_min": df["obj_id"].min(),
+        "obj_id_max": df["obj_id"].max(),
+    }
+
 
 def make_proposal_data(
     dfs, sheetname_proposal="proposals", sheetname_allocation="allocation"
@@ -1331,17 +2479,92 @@ def transfer_data_from_uploader(
     config,
     local_dir=Path("."),
     force=False,
+    batch=False,
+    n_workers=4,
 ):
+    """
+    Transfer data from the uploader server to local machine with rsync.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        DataFrame containing at least an 'upload_id' column with upload IDs to transfer.
+    config : dict
+        Configuration dictionary with the host, user, and data_dir of the
+        uploader in config["uploader"].
+    local_dir : Path, optional
+        Local directory where data should be transferred. Defaults to Path(".").
+    force : bool, optional
+        If True, transfer even if directory already exists locally.
+        If False, skip transfer if directory exists. Defaults to False.
+    batch : bool, optional
+        If True, the upload directories are resolved by a single listing on
+        the uploader and transferred concurrently over a shared SSH connection.
+        Otherwise, an rsync with a new SSH connection is run for each upload_id
+        in turn. Defaults to False.
+    n_workers : int, optional
+        Number of rsync processes run concurrently in the batch mode. Defaults to 4.
+
+    Returns
+    -------
+    df_status : pandas.DataFrame
+        The status and the number of transferred directories for each
+        upload_id, which is also logged.
+
+    Notes
+    -----
+    In the batch mode, the upload directories are listed with a single `find`
+    under config["uploader"]["data_dir"], and an upload_id not found there is
+    reported as "FAILED" without running rsync. For a remote host, the listing
+    opens an SSH ControlMaster connection which the rsync processes share, so
+    that authentication is made only once. A duplicated upload_id is
+    transferred once. With host = "localhost", `find` and rsync run locally
+    without SSH.
+    """
     # Create local directory if it doesn't exist
     if not local_dir.exists():
         logger.info(f"Creating local directory: {local_dir}")
         local_dir.mkdir(parents=True, exist_ok=True)
 
+    if batch:
+        status, n_transfer = _transfer_uploads_batch(
+            df["upload_id"].tolist(), config, local_dir, force, n_workers
+        )
+    else:
+        status, n_transfer = _transfer_uploads_sequential(
+            df["upload_id"], config, local_dir, force
+        )
+
+    custom_status_dict = {"success": 0, "WARNING": 1, "skipped": 2, "FAILED": 3}
+    df_status = pd.DataFrame(
+        {
+            "upload_id": df["upload_id"],
+            "status": status,
+            "n_transfer": n_transfer,
+            # "is_user_ppc": is_user_ppc,
+        }
+    )
+    df_status_out = df_status.sort_values(
+        by=["status"], key=lambda x: x.map(custom_status_dict)
+    )
+    logger.info(f"Transfer status: \n{df_status_out.to_string(index=False)}")
+
+    if np.all(df_status["status"] == "success"):
+        logger.info("All data transfer is successful.")
+    else:
+        logger.error(
+            "There are some issues with data transfer. Please check the status."
+        )
+
+    return df_status
+
+
+def _transfer_uploads_sequential(upload_ids, config, local_dir, force):
     status = []
     n_transfer = []
     # is_user_ppc = []
 
-    for upload_id in df["upload_id"]:
+    for upload_id in upload_ids:
         # Skip empty or invalid upload_id
         if pd.isna(upload_id) or str(upload_id).strip() == "":
             logger.warning("Skipping empty or invalid upload_id")
@@ -1461,27 +2684,186 @@ def transfer_data_from_uploader(
             n_transfer.append(0)
             # is_user_ppc.append(False)
 
-    custom_status_dict = {"success": 0, "WARNING": 1, "skipped": 2, "FAILED": 3}
-    df_status = pd.DataFrame(
-        {
-            "upload_id": df["upload_id"],
-            "status": status,
-            "n_transfer": n_transfer,
-            # "is_user_ppc": is_user_ppc,
-        }
+    return status, n_transfer
+
+
+def _transfer_uploads_batch(upload_ids, config, local_dir, force, n_workers):
+    results = {}
+    to_transfer = []
+    for upload_id in dict.fromkeys(upload_ids):
+        # Skip empty or invalid upload_id
+        if pd.isna(upload_id) or str(upload_id).strip() == "":
+            logger.warning("Skipping empty or invalid upload_id")
+            results[upload_id] = ("skipped", 0)
+        elif _check_existing_directory(local_dir, upload_id, force):
+            results[upload_id] = ("skipped", 0)
+        else:
+            to_transfer.append(upload_id)
+
+    if len(to_transfer) > 0:
+        with _uploader_ssh_options(config) as ssh_options:
+            source_dirs = _list_uploader_directories(config, to_transfer, ssh_options)
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                results.update(
+                    zip(
+                        to_transfer,
+                        executor.map(
+                            lambda upload_id: _rsync_upload(
+                                upload_id,
+                                source_dirs[upload_id],
+                                config,
+                                local_dir,
+                                ssh_options,
+                            ),
+                            to_transfer,
+                        ),
+                        strict=True,
+                    )
+                )
+
+    status = [results[upload_id][0] for upload_id in upload_ids]
+    n_transfer = [results[upload_id][1] for upload_id in upload_ids]
+    return status, n_transfer
+
+
+def _uploader_remote(config):
+    """Return the [user@]host of the uploader for SSH."""
+    if "user" in config["uploader"].keys() and config["uploader"]["user"] != "":
+        return f"{config['uploader']['user']}@{config['uploader']['host']}"
+    return config["uploader"]["host"]
+
+
+@contextmanager
+def _uploader_ssh_options(config):
+    """
+    Yield SSH options sharing a ControlMaster connection to the uploader.
+
+    The first SSH connection made with the options becomes the master, and the
+    following ones are multiplexed over it. The master is closed on exit. None
+    is yielded for localhost, where no SSH connection is made.
+    """
+    if config["uploader"]["host"] == "localhost":
+        yield None
+        return
+
+    # the socket path is kept short as it is limited to about 100 characters
+    with tempfile.TemporaryDirectory(prefix="targetdb-ssh-") as tmpdir:
+        control_path = ["-o", f"ControlPath={tmpdir}/%C"]
+        try:
+            yield control_path + [
+                "-o",
+                "ControlMaster=auto",
+                "-o",
+                "ControlPersist=60",
+            ]
+        finally:
+            subprocess.run(
+                ["ssh", *control_path, "-O", "exit", _uploader_remote(config)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=False,
+            )
+
+
+def _list_uploader_directories(config, upload_ids, ssh_options=None):
+    """
+    List the data directories of upload_ids on the uploader in a single pass.
+
+    Returns a dict from each upload_id to a list of the matching directories.
+    """
+    pattern = "*/????/??/????????-??????-*"
+    if ssh_options is None:
+        command = [
+            "find",
+            os.path.expanduser(config["uploader"]["data_dir"]),
+            *("-mindepth", "3", "-maxdepth", "3", "-type", "d"),
+            *("-path", pattern),
+        ]
+    else:
+        # data_dir is left unquoted to be expanded by the remote shell as in rsync
+        command = [
+            "ssh",
+            *ssh_options,
+            _uploader_remote(config),
+            f"find {config['uploader']['data_dir']} -mindepth 3 -maxdepth 3 "
+            f"-type d -path {shlex.quote(pattern)}",
+        ]
+    logger.info(f"Listing the data directories on the uploader: {command}")
+    t_begin = time.time()
+    proc = subprocess.run(
+        command,
+        check=False,
+        capture_output=True,
+        encoding="utf-8",
     )
-    df_status.sort_values(by=["status"], key=lambda x: x.map(custom_status_dict))
-    df_status_out = df_status.sort_values(
-        by=["status"], key=lambda x: x.map(custom_status_dict)
+    if proc.returncode != 0:
+        # find exits with non-zero for unreadable directories while listing the rest
+        logger.warning(f"Listing finished with errors: {proc.stderr.strip()}")
+
+    source_dirs = {upload_id: [] for upload_id in upload_ids}
+    lines = sorted(proc.stdout.splitlines())
+    for line in lines:
+        upload_id = line.rstrip("/").rsplit("-", 1)[-1]
+        if upload_id in source_dirs:
+            source_dirs[upload_id].append(line)
+    logger.info(
+        f"Listed {len(lines)} data directories on the uploader "
+        f"in {time.time() - t_begin:.2f} s"
     )
-    logger.info(f"Transfer status: \n{df_status_out.to_string(index=False)}")
+    return source_dirs
 
-    if np.all(df_status["status"] == "success"):
-        logger.info("All data transfer is successful.")
-    else:
+
+def _rsync_upload(upload_id, source_dirs, config, local_dir, ssh_options=None):
+    """Transfer the data directories of an upload_id and return (status, n_transfer)."""
+    if len(source_dirs) == 0:
         logger.error(
-            "There are some issues with data transfer. Please check the status."
+            f"Data directory for upload_id: {upload_id} is not found on the uploader"
+        )
+        return "FAILED", 0
+
+    logger.info(f"Transferring data for upload_id: {upload_id}: {source_dirs}")
+    if ssh_options is None:
+        rsync_command = ["rsync", "-av", "--ignore-times", *source_dirs]
+    else:
+        remote = _uploader_remote(config)
+        rsync_command = [
+            "rsync",
+            "-avz",
+            "--ignore-times",
+            "-e",
+            shlex.join(["ssh", *ssh_options]),
+            *[f"{remote}:{d}" for d in source_dirs],
+        ]
+    rsync_command.append(local_dir.as_posix())
+
+    try:
+        proc = subprocess.run(
+            rsync_command,
+            check=True,
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
         )
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Failed to transfer data for upload_id: {upload_id}")
+        logger.error(e)
+        return "FAILED", 0
+
+    str_uploaded_dirs = [
+        line
+        for line in proc.stdout.splitlines()
+        if upload_id in line
+        if line.endswith("/")
+    ]
+    logger.info(f"Transferred directories for {upload_id}: {str_uploaded_dirs}")
+    n_dirs = len(str_uploaded_dirs)
+    return ("success" if n_dirs == 1 else "WARNING"), n_dirs
+
+
+# Chunk sizes of the Web API downloads; the chunk size is about 1/100 of the
+# file size between these limits, so that small files finish in a few reads and
+# large files do not hold more than a few MB in memory
+WEBAPI_MIN_CHUNK_SIZE = 64 * 1024
+WEBAPI_MAX_CHUNK_SIZE = 8 * 1024 * 1024
 
 
 def _setup_webapi_config(config):
@@ -1538,71 +2920,180 @@ def _check_existing_directory(local_dir, upload_id, force):
         return False
 
 
-def _download_zip_from_api(url, headers, verify_ssl, local_dir):
-    """Download ZIP file from Web API."""
-    response = requests.get(
-        url, headers=headers, stream=True, timeout=300, verify=verify_ssl
+def _make_webapi_session(headers, verify_ssl, n_workers):
+    """Make an HTTP session with a connection pool shared by the download threads."""
+    session = requests.Session()
+    session.headers.update(headers)
+    session.verify = verify_ssl
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=n_workers, pool_maxsize=n_workers
     )
-    response.raise_for_status()
-
-    with tempfile.NamedTemporaryFile(
-        mode="wb", suffix=".zip", delete=False, dir=local_dir
-    ) as tmp_zip:
-        tmp_zip_path = Path(tmp_zip.name)
-        for chunk in response.iter_content(chunk_size=8192):
-            tmp_zip.write(chunk)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-    logger.info(f"Downloaded ZIP file to {tmp_zip_path}")
-    return tmp_zip_path
 
+def _download_zip_from_api(session, url, zip_path, max_retries=3, log_interval=10.0):
+    """Download a ZIP file from Web API, resuming a partial download with HTTP Range."""
+    for attempt in range(max_retries + 1):
+        offset = zip_path.stat().st_size if zip_path.exists() else 0
+        request_headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+        try:
+            with session.get(
+                url, headers=request_headers, stream=True, timeout=300
+            ) as response:
+                if offset > 0 and response.status_code == 416:
+                    # the partial file is already complete
+                    logger.info(f"{zip_path} is already downloaded")
+                    return zip_path
+                response.raise_for_status()
+                if offset > 0 and response.status_code == 206:
+                    logger.info(f"Resuming the download of {url} from {offset} bytes")
+                    mode = "ab"
+                else:
+                    # the server ignored the Range header
+                    offset, mode = 0, "wb"
+                content_length = response.headers.get("Content-Length")
+                total = offset + int(content_length) if content_length else None
+                chunk_size = int(
+                    np.clip(
+                        (total or 0) // 100,
+                        WEBAPI_MIN_CHUNK_SIZE,
+                        WEBAPI_MAX_CHUNK_SIZE,
+                    )
+                )
 
-def _extract_and_validate_zip(zip_path, upload_id, local_dir, force):
-    """Extract ZIP and validate directory structure."""
-    with tempfile.TemporaryDirectory(dir=local_dir) as tmp_extract_dir:
-        tmp_extract_path = Path(tmp_extract_dir)
-
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(tmp_extract_path)
+                t_begin = t_log = time.time()
+                n_bytes = 0
+                with open(zip_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        n_bytes += len(chunk)
+                        if time.time() - t_log > log_interval:
+                            t_log = time.time()
+                            progress = (
+                                f"{offset + n_bytes}/{total}"
+                                if total
+                                else f"{offset + n_bytes}"
+                            )
+                            logger.info(
+                                f"Downloading {url}: {progress} bytes "
+                                f"({n_bytes / (t_log - t_begin) / 1e6:.1f} MB/s)"
+                            )
+                t_elapsed = max(time.time() - t_begin, 1e-6)
+                if total is not None and offset + n_bytes < total:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Connection closed at {offset + n_bytes}/{total} bytes"
+                    )
+                logger.info(
+                    f"Downloaded {n_bytes} bytes to {zip_path} in {t_elapsed:.2f} s "
+                    f"({n_bytes / t_elapsed / 1e6:.1f} MB/s)"
+                )
+                return zip_path
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout,
+        ) as e:
+            if attempt == max_retries:
+                raise
+            logger.warning(
+                f"Download of {url} is interrupted ({e}); retrying "
+                f"({attempt + 1}/{max_retries})"
+            )
 
-        logger.info("Extracted ZIP to temporary directory")
 
-        # Validate directory structure
-        pattern = re.compile(r"^pfs_target-\d{8}-\d{6}-" + re.escape(upload_id) + r"$")
-        extracted_dirs = [
-            d
-            for d in tmp_extract_path.iterdir()
-            if d.is_dir() and pattern.match(d.name)
-        ]
+def _extract_and_validate_zip(zip_path, upload_id, local_dir, force, verify=False):
+    """
+    Extract the upload directory from a ZIP archive after validating its structure.
+
+    The directory name is validated from the central directory of the archive
+    before anything is written. Only the members under the matching directory
+    are extracted into a temporary directory in local_dir, and the directory is
+    then renamed to the final location, so that an interrupted extraction does
+    not leave a partial directory there. With verify, the CRC-32 of each
+    extracted file is checked against the archive once written to disk.
+    """
+    pattern = re.compile(r"^pfs_target-\d{8}-\d{6}-" + re.escape(upload_id) + r"$")
+
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        members = zip_ref.infolist()
+        dir_names = sorted(
+            {
+                m.filename.split("/", 1)[0]
+                for m in members
+                if "/" in m.filename and pattern.match(m.filename.split("/", 1)[0])
+            }
+        )
 
-        if len(extracted_dirs) == 0:
+        if len(dir_names) == 0:
             logger.error(
                 f"No directory matching pattern 'pfs_target-????????-??????-{upload_id}' found in ZIP"
             )
             return 0, "WARNING"
-        elif len(extracted_dirs) > 1:
+        elif len(dir_names) > 1:
             logger.error(
-                f"Multiple directories matching pattern found in ZIP: {extracted_dirs}"
+                f"Multiple directories matching pattern found in ZIP: {dir_names}"
             )
-            return len(extracted_dirs), "WARNING"
-        else:
-            # Move extracted directory to destination
-            extracted_dir = extracted_dirs[0]
+            return len(dir_names), "WARNING"
+
+        dir_name = dir_names[0]
+        dir_members = [m for m in members if m.filename.startswith(f"{dir_name}/")]
+        if len(dir_members) < len(members):
+            logger.warning(
+                f"Ignoring {len(members) - len(dir_members)} members outside {dir_name} in ZIP"
+            )
+
+        with tempfile.TemporaryDirectory(dir=local_dir) as tmp_extract_dir:
+            tmp_extract_path = Path(tmp_extract_dir)
+            # CRC-32 is checked by zipfile while each member is read
+            for member in dir_members:
+                zip_ref.extract(member, tmp_extract_path)
+            logger.info(f"Extracted {len(dir_members)} members of {dir_name} from ZIP")
+
+            extracted_dir = tmp_extract_path / dir_name
+            if verify:
+                n_mismatch = _verify_extracted_crc(dir_members, tmp_extract_path)
+                if n_mismatch > 0:
+                    logger.error(
+                        f"CRC-32 mismatch in {n_mismatch} extracted files for upload_id: {upload_id}"
+                    )
+                    return 0, "FAILED"
+                logger.info(f"Verified CRC-32 of the extracted files in {dir_name}")
+
             # Remove 'pfs_target-' prefix to match rsync version format
-            dir_name_without_prefix = extracted_dir.name.replace("pfs_target-", "", 1)
+            dir_name_without_prefix = dir_name.replace("pfs_target-", "", 1)
             final_dest = local_dir / dir_name_without_prefix
 
             if final_dest.exists():
+                # moved aside to be removed with the temporary directory
                 logger.info(f"Removing existing directory: {final_dest}")
-                shutil.rmtree(final_dest)
+                final_dest.rename(tmp_extract_path / f".{dir_name_without_prefix}.old")
 
-            shutil.move(str(extracted_dir), str(final_dest))
+            extracted_dir.rename(final_dest)
             logger.info(f"Moved extracted directory to {final_dest}")
 
-            return 1, "success"
+    return 1, "success"
+
+
+def _verify_extracted_crc(members, extract_path, chunk_size=1024 * 1024):
+    """Return the number of extracted files of which CRC-32 differs from the ZIP."""
+    n_mismatch = 0
+    for member in members:
+        if member.is_dir():
+            continue
+        crc = 0
+        with open(extract_path / member.filename, "rb") as f:
+            while chunk := f.read(chunk_size):
+                crc = zlib.crc32(chunk, crc)
+        if crc != member.CRC:
+            logger.error(f"CRC-32 mismatch: {member.filename}")
+            n_mismatch += 1
+    return n_mismatch
 
 
 def _process_single_upload(
-    upload_id, webapi_url, headers, verify_ssl, local_dir, force
+    upload_id, session, webapi_url, local_dir, force, verify=False
 ):
     """Process a single upload_id download."""
     # Skip empty or invalid upload_id
@@ -1624,16 +3115,23 @@ def _process_single_upload(
     full_url = f"{webapi_url}{upload_id}"
     logger.info(f"API endpoint: {full_url}")
 
+    # the partial file is kept on errors to resume the download in the next run
+    zip_path = local_dir / f".{upload_id}.zip.part"
+    if force and zip_path.exists():
+        zip_path.unlink()
     try:
-        zip_path = _download_zip_from_api(full_url, headers, verify_ssl, local_dir)
+        _download_zip_from_api(session, full_url, zip_path)
         try:
             n_transfer, status = _extract_and_validate_zip(
-                zip_path, upload_id, local_dir, force
+                zip_path, upload_id, local_dir, force, verify=verify
             )
-            return status, n_transfer
-        finally:
+        except zipfile.BadZipFile:
+            # do not resume from a broken file
             zip_path.unlink()
-            logger.info("Cleaned up temporary ZIP file")
+            raise
+        zip_path.unlink()
+        logger.info("Cleaned up temporary ZIP file")
+        return status, n_transfer
 
     except requests.exceptions.HTTPError as e:
         logger.error(f"HTTP error while downloading data for upload_id: {upload_id}")
@@ -1660,6 +3158,8 @@ def transfer_data_from_uploader_via_webapi(
     config,
     local_dir=Path("."),
     force=False,
+    n_workers=4,
+    verify_checksum=False,
 ):
     """
     Transfer data from the uploader server to local machine via Web API.
@@ -1681,12 +3181,17 @@ def transfer_data_from_uploader_via_webapi(
     force : bool, optional
         If True, re-download even if directory already exists locally.
         If False, skip transfer if directory exists. Defaults to False.
+    n_workers : int, optional
+        Number of uploads downloaded concurrently. Defaults to 4.
+    verify_checksum : bool, optional
+        If True, the CRC-32 of each extracted file is checked against the ZIP
+        archive after it is written to disk. Defaults to False.
 
     Returns
     -------
-    None
-        The function logs transfer status and errors. It does not return a value,
-        but prints a status DataFrame showing results for each upload_id.
+    df_status : pandas.DataFrame
+        The status and the number of transferred directories for each
+        upload_id, which is also logged.
 
     Raises
     ------
@@ -1697,12 +3202,23 @@ def transfer_data_from_uploader_via_webapi(
 
     Notes
     -----
-    - Downloads are streamed to handle large ZIP files efficiently
-    - Temporary files are created in local_dir and cleaned up after extraction
+    - Downloads are streamed to handle large ZIP files efficiently, with chunk
+      sizes scaled with the file size (64 KB to 8 MB)
+    - Up to n_workers uploads are downloaded concurrently over keep-alive
+      connections of a shared HTTP session, with the progress and throughput
+      logged per upload
+    - A ZIP file is downloaded to local_dir/.{upload_id}.zip.part, which is
+      removed after extraction. An interrupted download is retried, and a
+      partial file left by a failed run is resumed with an HTTP Range request
+      if the server supports it
+    - The directory structure is validated from the central directory of the
+      ZIP archive, and only the members under the matching directory are
+      extracted, into a temporary directory in local_dir which is then
+      renamed to the final location
     - Status tracking mirrors transfer_data_from_uploader() for consistency:
       * "success": 1 directory transferred successfully
       * "WARNING": 0 or >1 directories in ZIP archive
-      * "FAILED": Error during HTTP request or extraction
+      * "FAILED": Error during HTTP request or extraction, or CRC-32 mismatch
       * "skipped": Directory exists locally and force=False
     - The function continues processing remaining upload_ids even if one fails
 
@@ -1725,16 +3241,33 @@ def transfer_data_from_uploader_via_webapi(
     # Setup Web API configuration
     webapi_url, headers, verify_ssl = _setup_webapi_config(config)
 
-    # Process each upload_id
-    status = []
-    n_transfer = []
-
-    for upload_id in df["upload_id"]:
-        upload_status, upload_n_transfer = _process_single_upload(
-            upload_id, webapi_url, headers, verify_ssl, local_dir, force
+    # Process the upload_ids concurrently; a duplicated upload_id is
+    # transferred once
+    all_upload_ids = df["upload_id"].tolist()
+    upload_ids = list(dict.fromkeys(all_upload_ids))
+    with (
+        _make_webapi_session(headers, verify_ssl, n_workers) as session,
+        ThreadPoolExecutor(max_workers=n_workers) as executor,
+    ):
+        results = dict(
+            zip(
+                upload_ids,
+                executor.map(
+                    lambda upload_id: _process_single_upload(
+                        upload_id,
+                        session,
+                        webapi_url,
+                        local_dir,
+                        force,
+                        verify=verify_checksum,
+                    ),
+                    upload_ids,
+                ),
+                strict=True,
+            )
         )
-        status.append(upload_status)
-        n_transfer.append(upload_n_transfer)
+    status = [results[upload_id][0] for upload_id in all_upload_ids]
+    n_transfer = [results[upload_id][1] for upload_id in all_upload_ids]
 
     # Generate status report
     custom_status_dict = {"success": 0, "WARNING": 1, "skipped": 2, "FAILED": 3}
@@ -1764,6 +3297,275 @@ def transfer_data_from_uploader_via_webapi(
             "There are some issues with data transfer. Please check the status."
         )
 
+    return df_status
+
+
+def _find_upload_file(data_dir, file_prefix, upload_id):
+    # the input file in the directory of an upload transferred from the uploader
+    input_file = list(
+        Path(data_dir).glob(
+            f"????????-??????-{upload_id}/{file_prefix}_{upload_id}.ecsv"
+        )
+    )
+
+    if len(input_file) == 0:
+        logger.error(f"Input file for upload_id: {upload_id} is not found.")
+        raise FileNotFoundError(f"Input file for upload_id: {upload_id} is not found.")
+    elif len(input_file) > 1:
+        logger.error(f"Multiple input files are found for upload_id: {upload_id}")
+        raise ValueError(f"Multiple input files are found for upload_id: {upload_id}")
+    return input_file[0]
+
+
+def insert_uploads(
+    df_input_catalogs,
+    config,
+    table,
+    prepare,
+    data_dir=Path("."),
+    file_prefix="target",
+    commit=False,
+    fetch=False,
+    db=None,
+    transaction="single",
+    n_jobs=1,
+    skip=None,
+):
+    """
+    Insert the data of many uploads into a table in a single transaction.
+
+    Parameters
+    ----------
+    df_input_catalogs : pandas.DataFrame
+        DataFrame containing the input catalogs with the upload_id column.
+    config : dict
+        Configuration dictionary containing database connection details.
+    table : str
+        The name of the table to insert rows into.
+    prepare : callable
+        A function called as `prepare(df, db, row)` with the data of an upload,
+        a connected TargetDB, and the row of `df_input_catalogs`, which returns
+        the rows to insert with the back reference values resolved (e.g.,
+        `make_target_df_from_uploader`).
+    data_dir : Path, optional
+        Directory where the input files are located. Defaults to Path(".").
+    file_prefix : str, optional
+        Prefix for the input files. Defaults to "target".
+    commit : bool, optional
+        If True, commit the changes to the database. Defaults to False.
+    fetch : bool, optional
+        If True, fetch the results after inserting. Defaults to False.
+    db : TargetDB or sqlalchemy.engine.Engine, optional
+        A connected TargetDB instance or an engine to reuse, which is not closed
+        by this function. If None, a new connection is made from `config`.
+    transaction : str, optional
+        "single" (all or nothing: the uploads are written by a single COPY
+        only if all of them are loaded and validated) or "savepoint" (each
+        upload is written by its own COPY in a savepoint, and failed uploads
+        are skipped). The changes are committed once at the end in both
+        cases. Defaults to "single".
+    n_jobs : int, optional
+        Number of processes to load the input files. Defaults to 1.
+    skip : array_like of bool, optional
+        Uploads to skip (e.g., those without user pointings). Defaults to None.
+
+    Returns
+    -------
+    df_status : pandas.DataFrame
+        The upload_id, status, and number of inserted rows (n_rows) of each
+        upload. The status is "success", "FAILED" (the upload failed to load,
+        validate, or write), "ABORTED" (not written because another upload
+        failed with the "single" transaction), or "skipped".
+
+    Raises
+    ------
+    ValueError
+        If `transaction` is not "single" or "savepoint".
+
+    Notes
+    -----
+    Unlike calling `add_database_rows` for each upload, the dimension tables
+    for the back references are fetched once for all uploads, and the rows
+    are written in one transaction, so that the time is dominated by the COPY
+    rather than by the overhead per upload. Errors of each upload are logged
+    and recorded in the status instead of being raised.
+
+    As the rows are written by the binary COPY (see
+    `TargetDB.insert_by_binary_copy`), NaN in floating-point columns is stored
+    as NULL, whereas `add_database_rows` with the default "mappings" method
+    stores it as NaN. Columns missing in an upload get the model defaults.
+    """
+    if transaction not in ["single", "savepoint"]:
+        logger.error(f"transaction must be 'single' or 'savepoint'. {transaction=}")
+        raise ValueError(f"transaction must be 'single' or 'savepoint'. {transaction=}")
+
+    t_wall = time.time()
+    upload_ids = df_input_catalogs["upload_id"].tolist()
+    status = ["skipped"] * len(upload_ids)
+    n_rows = [0] * len(upload_ids)
+    skip = np.zeros(len(upload_ids), dtype=bool) if skip is None else np.asarray(skip)
+
+    # locate and load the input files (in parallel if n_jobs > 1)
+    input_files = {}
+    for k, upload_id in enumerate(upload_ids):
+        if skip[k]:
+            continue
+        try:
+            input_files[k] = _find_upload_file(data_dir, file_prefix, upload_id)
+        except (FileNotFoundError, ValueError):
+            status[k] = "FAILED"
+    loaded = _map_files(_load_upload_file, list(input_files.values()), n_jobs=n_jobs)
+    logger.info(f"Loaded {len(loaded)} uploads in {time.time() - t_wall:.2f} s")
+
+    with targetdb_session(config, db) as db:
+        # validate and resolve back references; the dimension tables are
+        # cached by the TargetDB instance and fetched only once
+        t_begin = time.time()
+        prepared = {}
+        for k, (df, error) in zip(input_files, loaded, strict=True):
+            if error is None:
+                try:
+                    df = prepare(df, db, df_input_catalogs.iloc[k])
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+            if error is None:
+                prepared[k] = df
+            else:
+                logger.error(f"Failed to prepare upload_id: {upload_ids[k]}: {error}")
+                status[k] = "FAILED"
+        logger.info(
+            f"Prepared {len(prepared)} uploads in {time.time() - t_begin:.2f} s"
+        )
+
+        t_begin = time.time()
+        try:
+            if transaction == "single":
+                if "FAILED" in status:
+                    logger.error("Nothing is inserted as some uploads failed")
+                    status = [
+                        "ABORTED" if k in prepared else s for k, s in enumerate(status)
+                    ]
+                    prepared = {}
+                elif prepared:
+                    _copy_uploads(db, table, list(prepared.values()))
+                    for k, df in prepared.items():
+                        status[k], n_rows[k] = "success", df.index.size
+            else:
+                for k, df in prepared.items():
+                    try:
+                        with db.session.begin_nested():
+                            _copy_uploads(db, table, [df])
+                        status[k], n_rows[k] = "success", df.index.size
+                    except Exception as e:
+                        logger.error(
+                            f"Failed to insert upload_id: {upload_ids[k]}: {e}"
+                        )
+                        status[k] = "FAILED"
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to insert the uploads: {e}")
+            status = ["ABORTED" if k in prepared else s for k, s in enumerate(status)]
+            n_rows = [0] * len(upload_ids)
+        else:
+            if commit:
+                db.commit()
+            else:
+                db.rollback()
+                logger.info("No changes are committed to targetDB (i.e., dry run)")
+        logger.info(
+            f"Inserted {sum(n_rows)} rows into the {table} table in "
+            f"{time.time() - t_begin:.2f} s"
+        )
+
+        if fetch:
+            logger.info("Fetching the first 100 table entries")
+            res = db.fetch_all(table)
+            logger.info(f"Fetched the first 100 entries in the {table} table: \n{res}")
+
+    # status report in the same form as the transfer commands
+    custom_status_dict = {
+        "success": 0,
+        "skipped": 1,
+        "ABORTED": 2,
+        "FAILED": 3,
+    }
+    df_status = pd.DataFrame(
+        {"upload_id": upload_ids, "status": status, "n_rows": n_rows}
+    )
+    df_status_out = df_status.sort_values(
+        by=["status"], key=lambda x: x.map(custom_status_dict)
+    )
+    logger.info(f"Insert status: \n{df_status_out.to_string(index=False)}")
+    if np.any(df_status["status"].isin(["FAILED", "ABORTED"])):
+        logger.error("There are some issues with the uploads. Please check the status.")
+    else:
+        logger.info("All uploads are inserted successfully.")
+    logger.info(f"Total elapsed time: {time.time() - t_wall:.2f} s")
+
+    return df_status
+
+
+def _load_upload_file(input_file, i):
+    # load an input file of an upload; errors are returned to be recorded in the
+    # status rather than raised from a worker process
+    try:
+        return load_input_data(input_file, engine="arrow"), None
+    except Exception as e:
+        logger.error(f"Failed to load {input_file}: {e}")
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _copy_uploads(db, table, dfs):
+    # write DataFrames by a single COPY; as the COPY takes the columns of the
+    # first DataFrame, each one is converted with the model defaults for its
+    # missing columns and then aligned to the union of the columns
+    model = getattr(models, table)
+    columns = [
+        c.name
+        for c in model.__table__.columns
+        if any(c.name in df.columns for df in dfs)
+        or (c.default is not None and c.default.is_scalar)
+    ]
+    schema = arrow_schema(model, columns)
+
+    def _aligned():
+        for df in dfs:
+            tb = dataframe_to_arrow(df, model)
+            yield pa.Table.from_arrays(
+                [
+                    (
+                        tb.column(field.name)
+                        if field.name in tb.schema.names
+                        else pa.nulls(tb.num_rows, type=field.type)
+                    )
+                    for field in schema
+                ],
+                schema=schema,
+            )
+
+    db.insert_by_binary_copy(table, _aligned(), autocommit=False)
+
+
+def _prepare_uploaded_targets(df, db, row, flux_type="total"):
+    return make_target_df_from_uploader(
+        df,
+        db=db,
+        table="target",
+        proposal_id=row["proposal_id"],
+        upload_id=row["upload_id"],
+        flux_type=flux_type,
+        insert=True,
+    )
+
+
+def _prepare_uploaded_pointings(df, db, row):
+    return add_backref_values(
+        df,
+        db=db,
+        table="user_pointing",
+        upload_id=row["upload_id"],
+    )
+
 
 def insert_targets_from_uploader(
     df_input_catalogs,
@@ -1774,57 +3576,103 @@ def insert_targets_from_uploader(
     commit=False,
     fetch=False,
     verbose=False,
+    db=None,
+    batch=False,
+    transaction="single",
+    n_jobs=1,
 ):
+    """
+    Insert targets from the uploader into the database.
+
+    Parameters
+    ----------
+    df_input_catalogs : pandas.DataFrame
+        DataFrame containing the input catalogs with the proposal_id and
+        upload_id columns.
+    config : dict
+        Configuration dictionary containing database connection details.
+    data_dir : Path, optional
+        Directory where the input files are located. Defaults to Path(".").
+    flux_type : str, optional
+        The kind of flux to use and must be "total" or "psf". Defaults to "total".
+    file_prefix : str, optional
+        Prefix for the input files. Defaults to "target".
+    commit : bool, optional
+        If True, commit the changes to the database. Defaults to False.
+    fetch : bool, optional
+        If True, fetch the results after inserting. Defaults to False.
+    verbose : bool, optional
+        If True, log additional information. Defaults to False.
+    db : TargetDB or sqlalchemy.engine.Engine, optional
+        A connected TargetDB instance or an engine to reuse, which is not closed
+        by this function. If None, a new connection is made from `config`.
+    batch : bool, optional
+        If True, all uploads are inserted in a single transaction by
+        `insert_uploads`. Otherwise, each upload is inserted and committed by
+        `add_database_rows` in turn. NaN values are stored as NULL in
+        the batch mode (see `insert_uploads`). Defaults to False.
+    transaction : str, optional
+        Transaction handling in the batch mode, "single" or "savepoint" (see
+        `insert_uploads`). Defaults to "single".
+    n_jobs : int, optional
+        Number of processes to load the input files in the batch mode.
+        Defaults to 1.
+
+    Returns
+    -------
+    df_status : pandas.DataFrame or None
+        The status of each upload in the batch mode (see `insert_uploads`).
+    """
 
     if flux_type not in ["total", "psf"]:
         logger.error(f"flux_type must be 'total' or 'psf'. {flux_type=}")
         raise ValueError(f"flux_type must be 'total' or 'psf'. {flux_type=}")
 
-    for _, row in df_input_catalogs.iterrows():
-        proposal_id = row["proposal_id"]
-        upload_id = row["upload_id"]
-
-        # input_file = list(
-        #     data_dir.cwd().glob(
-        #         f"????????-??????-{upload_id}/{file_prefix}_{upload_id}.ecsv"
-        #     )
-        # )
-        input_file = list(
-            data_dir.glob(f"????????-??????-{upload_id}/{file_prefix}_{upload_id}.ecsv")
-        )
-
-        if len(input_file) == 0:
-            logger.error(f"Input file for upload_id: {upload_id} is not found.")
-            raise FileNotFoundError(
-                f"Input file for upload_id: {upload_id} is not found."
-            )
-        elif len(input_file) > 1:
-            logger.error(f"Multiple input files are found for upload_id: {upload_id}")
-            raise ValueError(
-                f"Multiple input files are found for upload_id: {upload_id}"
-            )
-
-        logger.info(f"Loading input data from {input_file} into a DataFrame")
-        t_begin = time.time()
-        df = load_input_data(input_file[0])
-        t_end = time.time()
-        logger.info(f"Loaded input data in {t_end - t_begin:.2f} seconds")
-
-        add_database_rows(
-            input_file=input_file[0],
-            table="target",
+    if batch:
+        return insert_uploads(
+            df_input_catalogs,
+            config,
+            "target",
+            partial(_prepare_uploaded_targets, flux_type=flux_type),
+            data_dir=data_dir,
+            file_prefix=file_prefix,
             commit=commit,
             fetch=fetch,
-            verbose=verbose,
-            config=config,
-            df=df,
-            from_uploader=True,
-            flux_type=flux_type,
-            proposal_id=proposal_id,
-            upload_id=upload_id,
-            insert=True,
+            db=db,
+            transaction=transaction,
+            n_jobs=n_jobs,
         )
 
+    # one connection for all uploads so that dimension tables are read only once
+    with targetdb_session(config, db) as db:
+        for _, row in df_input_catalogs.iterrows():
+            proposal_id = row["proposal_id"]
+            upload_id = row["upload_id"]
+
+            input_file = _find_upload_file(data_dir, file_prefix, upload_id)
+
+            logger.info(f"Loading input data from {input_file} into a DataFrame")
+            t_begin = time.time()
+            df = load_input_data(input_file, engine="arrow")
+            t_end = time.time()
+            logger.info(f"Loaded input data in {t_end - t_begin:.2f} seconds")
+
+            add_database_rows(
+                input_file=input_file,
+                table="target",
+                commit=commit,
+                fetch=fetch,
+                verbose=verbose,
+                config=config,
+                df=df,
+                from_uploader=True,
+                flux_type=flux_type,
+                proposal_id=proposal_id,
+                upload_id=upload_id,
+                insert=True,
+                db=db,
+            )
+
 
 def insert_userppc_from_uploader(
     df_input_catalogs,
@@ -1834,6 +3682,10 @@ def insert_userppc_from_uploader(
     commit=False,
     fetch=False,
     verbose=False,
+    db=None,
+    batch=False,
+    transaction="single",
+    n_jobs=1,
 ):
     """
     Insert user pointing data from the uploader into the database.
@@ -1854,6 +3706,24 @@ def insert_userppc_from_uploader(
         If True, fetch the results after inserting. Defaults to False.
     verbose : bool, optional
         If True, log additional information. Defaults to False.
+    db : TargetDB or sqlalchemy.engine.Engine, optional
+        A connected TargetDB instance or an engine to reuse, which is not closed
+        by this function. If None, a new connection is made from `config`.
+    batch : bool, optional
+        If True, all uploads are inserted in a single transaction by
+        `insert_uploads`. NaN values are stored as NULL in
+        the batch mode (see `insert_uploads`). Defaults to False.
+    transaction : str, optional
+        Transaction handling in the batch mode, "single" or "savepoint" (see
+        `insert_uploads`). Defaults to "single".
+    n_jobs : int, optional
+        Number of processes to load the input files in the batch mode.
+        Defaults to 1.
+
+    Returns
+    -------
+    df_status : pandas.DataFrame or None
+        The status of each upload in the batch mode (see `insert_uploads`).
 
     Notes
     -----
@@ -1862,46 +3732,52 @@ def insert_userppc_from_uploader(
     renames columns, and prepares the DataFrame for insertion into the database.
     """
 
-    for _, row in df_input_catalogs.iterrows():
-        if not row["is_user_pointing"]:
-            logger.info(f"Skip user pointing for upload_id: {row['upload_id']}")
-            continue
-
-        upload_id = row["upload_id"]
-
-        input_file = list(
-            data_dir.glob(f"????????-??????-{upload_id}/{file_prefix}_{upload_id}.ecsv")
-        )
-
-        if len(input_file) == 0:
-            logger.error(f"Input file for upload_id: {upload_id} is not found.")
-            raise FileNotFoundError(
-                f"Input file for upload_id: {upload_id} is not found."
-            )
-        elif len(input_file) > 1:
-            logger.error(f"Multiple input files are found for upload_id: {upload_id}")
-            raise ValueError(
-                f"Multiple input files are found for upload_id: {upload_id}"
-            )
-
-        logger.info(f"Loading input data from {input_file} into a DataFrame")
-        t_begin = time.time()
-        df = load_input_data(input_file[0])
-        t_end = time.time()
-        logger.info(f"Loaded input data in {t_end - t_begin:.2f} seconds")
-
-        add_database_rows(
-            input_file=input_file[0],
-            table="user_pointing",
+    if batch:
+        return insert_uploads(
+            df_input_catalogs,
+            config,
+            "user_pointing",
+            _prepare_uploaded_pointings,
+            data_dir=data_dir,
+            file_prefix=file_prefix,
             commit=commit,
             fetch=fetch,
-            verbose=verbose,
-            config=config,
-            df=df,
-            upload_id=upload_id,
-            insert=True,
+            db=db,
+            transaction=transaction,
+            n_jobs=n_jobs,
+            skip=~df_input_catalogs["is_user_pointing"].astype(bool),
         )
 
+    # one connection for all uploads so that dimension tables are read only once
+    with targetdb_session(config, db) as db:
+        for _, row in df_input_catalogs.iterrows():
+            if not row["is_user_pointing"]:
+                logger.info(f"Skip user pointing for upload_id: {row['upload_id']}")
+                continue
+
+            upload_id = row["upload_id"]
+
+            input_file = _find_upload_file(data_dir, file_prefix, upload_id)
+
+            logger.info(f"Loading input data from {input_file} into a DataFrame")
+            t_begin = time.time()
+            df = load_input_data(input_file)
+            t_end = time.time()
+            logger.info(f"Loaded input data in {t_end - t_begin:.2f} seconds")
+
+            add_database_rows(
+                input_file=input_file,
+                table="user_pointing",
+                commit=commit,
+                fetch=fetch,
+                verbose=verbose,
+                config=config,
+                df=df,
+                upload_id=upload_id,
+                insert=True,
+                db=db,
+            )
+
 
 def update_input_catalog_active(
     input_catalog_id: int,
@@ -1909,6 +3785,7 @@ def update_input_catalog_active(
     config: dict,
     commit: bool = False,
     verbose: bool = False,
+    db=None,
 ):
     """
     Update the active status of an input catalog in the database.
@@ -1926,6 +3803,9 @@ def update_input_catalog_active(
         without committing the changes. Default is False.
     verbose : bool, optional
         If True, log additional information about the update process. Default is False.
+    db : TargetDB or sqlalchemy.engine.Engine, optional
+        A connected TargetDB instance or an engine to reuse, which is not closed
+        by this function. If None, a new connection is made from `config`.
 
     Notes
     -----
@@ -1950,40 +3830,36 @@ def update_input_catalog_active(
     >>> update_input_catalog_active(123, True, config, commit=True, verbose=True)
     """
 
-    db = TargetDB(**config["targetdb"]["db"])
-    db.connect()
-
-    df = pd.DataFrame(
-        {"input_catalog_id": [input_catalog_id], "active": [active_flag]},
-        # index="input_catalog_id",
-    )
-
-    if verbose:
-        logger.info(
-            f"Updating input_catalog_id {input_catalog_id} to active={active_flag}"
-        )
-        df_res = db.fetch_by_id(
-            "input_catalog",
-            input_catalog_id=input_catalog_id,
+    with targetdb_session(config, db) as db:
+        df = pd.DataFrame(
+            {"input_catalog_id": [input_catalog_id], "active": [active_flag]},
+            # index="input_catalog_id",
         )
-        logger.info(f"Original input_catalog table: \n{df_res}")
 
-    if commit:
-        logger.info(
-            f"Updating input_catalog_id {input_catalog_id} to active={active_flag}"
-        )
-    else:
-        logger.info(
-            f"Updating input_catalog_id {input_catalog_id} to active={active_flag} (dry run)"
-        )
+        if verbose:
+            logger.info(
+                f"Updating input_catalog_id {input_catalog_id} to active={active_flag}"
+            )
+            df_res = db.fetch_by_id(
+                "input_catalog",
+                input_catalog_id=input_catalog_id,
+            )
+            logger.info(f"Original input_catalog table: \n{df_res}")
 
-    db.update("input_catalog", df, dry_run=not commit)
+        if commit:
+            logger.info(
+                f"Updating input_catalog_id {input_catalog_id} to active={active_flag}"
+            )
+        else:
+            logger.info(
+                f"Updating input_catalog_id {input_catalog_id} to active={active_flag} (dry run)"
+            )
 
-    if verbose:
-        df_res = db.fetch_by_id(
-            "input_catalog",
-            input_catalog_id=input_catalog_id,
-        )
-        logger.info(f"Updated input_catalog table: \n{df_res}")
+        db.update("input_catalog", df, dry_run=not commit)
 
-    db.close()
+        if verbose:
+            df_res = db.fetch_by_id(
+                "input_catalog",
+                input_catalog_id=input_catalog_id,
+            )
+            logger.info(f"Updated input_catalog table: \n{df_res}")
@@ -27,6 +27,7 @@ from astropy.table import Table
 from sqlalchemy import create_engine, text
 from typer.testing import CliRunner
 
+from targetdb import TargetDB
 from targetdb.cli.cli_main import app
 from targetdb.utils import get_url_object, load_config
 
@@ -264,3 +265,36 @@ def pointing_data(target_data, db_config):
         target_data["local_dir"],
         "--commit",
     )
+
+
+@pytest.fixture(scope="module")
+def seed_rows():
+    """
+    Synthetic rows inserted by the `db` fixture, as ``[(table, dataframe, key)]``.
+
+    Override this fixture in a test module to seed its own rows. On teardown,
+    every row of ``table`` whose ``key`` column matches a value in
+    ``dataframe[key]`` is deleted, including rows added later by the tests.
+    """
+    return []
+
+
+@pytest.fixture(scope="module")
+def db(master_data, db_config, seed_rows):
+    """Connected `TargetDB` with the module's `seed_rows` inserted and cleaned up."""
+    db = TargetDB(**load_config(db_config)["targetdb"]["db"])
+    db.connect()
+    try:
+        for table, df, _ in seed_rows:
+            db.insert(table, df)
+        yield db
+    finally:
+        # a failed test can leave the session in an aborted transaction
+        db.rollback()
+        for table, df, key in reversed(seed_rows):
+            db.session.execute(
+                text(f"DELETE FROM {table} WHERE {key} = ANY(:values)"),
+                {"values": df[key].unique().tolist()},
+            )
+        db.commit()
+        db.close()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Verify the batch mode of insert-targets: all-or-nothing and savepoint-per-upload
+semantics and the per-upload status table."""
+
+import shutil
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from targetdb.utils import insert_targets_from_uploader, load_config
+
+from .conftest import (
+    EXAMPLES_DATA,
+    TARGETS_DATA_DIR,
+    count_rows,
+    ecsv_row_count,
+    run_cli,
+)
+
+# copies of the example uploads under their own proposals and upload IDs, so
+# that the test does not depend on the target_data fixture
+UPLOADS = {
+    "c9d7ad93118243b5": ("S98A-BT001", "ba7c000000000001"),
+    "b63373793afeaaf8": ("S98A-BT002", "ba7c000000000002"),
+}
+MISSING_UPLOAD_ID = "ba7c0000000000ff"
+
+
+def _n_targets(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT count(*) FROM target WHERE proposal_id LIKE 'S98A-BT%'")
+        ).scalar_one()
+
+
+@pytest.fixture(scope="module")
+def uploads(master_data, db_config, engine, tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp("batch-ingest")
+    df_proposals = pd.read_csv(TARGETS_DATA_DIR / "example_proposals.csv")
+    df_proposals = df_proposals.iloc[: len(UPLOADS)].assign(
+        proposal_id=[p for p, _ in UPLOADS.values()]
+    )
+    df_proposals.to_csv(work_dir / "proposals.csv", index=False)
+    run_cli(
+        "insert",
+        work_dir / "proposals.csv",
+        "-c",
+        db_config,
+        "-t",
+        "proposal",
+        "--commit",
+    )
+
+    rows = []
+    n_rows = {}
+    for src_id, (proposal_id, upload_id) in UPLOADS.items():
+        src = next(
+            (EXAMPLES_DATA / "uploader").glob(f"*/*/*-{src_id}/target_{src_id}.ecsv")
+        )
+        dst_dir = work_dir / "data" / f"20250101-000000-{upload_id}"
+        dst_dir.mkdir(parents=True)
+        shutil.copy(src, dst_dir / f"target_{upload_id}.ecsv")
+        n_rows[upload_id] = ecsv_row_count(src)
+        rows.append(
+            {
+                "input_catalog_name": f"batch_{upload_id}",
+                "input_catalog_description": "batch ingest test",
+                "upload_id": upload_id,
+                "proposal_id": proposal_id,
+                "is_classical": False,
+                "is_user_pointing": False,
+            }
+        )
+    df_catalogs = pd.DataFrame(rows)
+    df_catalogs.to_csv(work_dir / "input_catalogs.csv", index=False)
+    run_cli(
+        "insert",
+        work_dir / "input_catalogs.csv",
+        "-c",
+        db_config,
+        "-t",
+        "input_catalog",
+        "--commit",
+    )
+    yield {"data_dir": work_dir / "data", "catalogs": df_catalogs, "n_rows": n_rows}
+
+    # remove the rows so that the row counts checked by other tests are unchanged
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM target WHERE proposal_id LIKE 'S98A-BT%'"))
+        conn.execute(
+            text("DELETE FROM input_catalog WHERE input_catalog_name LIKE 'batch_%'")
+        )
+        conn.execute(text("DELETE FROM proposal WHERE proposal_id LIKE 'S98A-BT%'"))
+
+
+def test_batch_single_transaction_is_all_or_nothing(uploads, db_config, engine):
+    config = load_config(db_config)
+    df_catalogs = pd.concat(
+        [
+            uploads["catalogs"],
+            pd.DataFrame(
+                {"proposal_id": ["S98A-BT001"], "upload_id": [MISSING_UPLOAD_ID]}
+            ),
+        ],
+        ignore_index=True,
+    )
+    n_before = count_rows(engine, "target")
+
+    df_status = insert_targets_from_uploader(
+        df_catalogs, config, data_dir=uploads["data_dir"], commit=True, batch=True
+    )
+
+    assert df_status["status"].tolist() == ["ABORTED", "ABORTED", "FAILED"]
+    assert count_rows(engine, "target") == n_before
+
+
+def test_batch_savepoint_skips_failed_uploads(uploads, db_config, engine):
+    config = load_config(db_config)
+    df_catalogs = pd.concat(
+        [
+            uploads["catalogs"],
+            pd.DataFrame(
+                {"proposal_id": ["S98A-BT001"], "upload_id": [MISSING_UPLOAD_ID]}
+            ),
+        ],
+        ignore_index=True,
+    )
+
+    df_status = insert_targets_from_uploader(
+        df_catalogs,
+        config,
+        data_dir=uploads["data_dir"],
+        commit=True,
+        batch=True,
+        transaction="savepoint",
+        n_jobs=2,
+    )
+
+    assert df_status["status"].tolist() == ["success", "success", "FAILED"]
+    assert df_status["n_rows"].tolist()[:2] == list(uploads["n_rows"].values())
+    assert _n_targets(engine) == sum(uploads["n_rows"].values())
+
+    # the rows exist now, so each COPY fails and is rolled back to its savepoint
+    df_status = insert_targets_from_uploader(
+        uploads["catalogs"],
+        config,
+        data_dir=uploads["data_dir"],
+        commit=True,
+        batch=True,
+        transaction="savepoint",
+    )
+    assert df_status["status"].tolist() == ["FAILED", "FAILED"]
+    assert _n_targets(engine) == sum(uploads["n_rows"].values())
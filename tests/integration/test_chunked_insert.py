@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Verify `insert --chunk-size` reads and writes the input file chunk by chunk
+under both commit policies."""
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from .conftest import run_cli
+
+N_SKY = 23
+CHUNK_SIZE = 5
+
+
+def _write_sky_csv(path, version):
+    pd.DataFrame(
+        {
+            "obj_id": range(N_SKY),
+            "ra": [210.0 + 0.01 * i for i in range(N_SKY)],
+            "dec": [-1.0] * N_SKY,
+            "input_catalog_id": [1001] * N_SKY,
+            "version": [version] * N_SKY,
+        }
+    ).to_csv(path, index=False)
+
+
+def _fetch_obj_ids(engine, version):
+    with engine.connect() as conn:
+        return (
+            conn.execute(
+                text("SELECT obj_id FROM sky WHERE version = :version ORDER BY obj_id"),
+                {"version": version},
+            )
+            .scalars()
+            .all()
+        )
+
+
+@pytest.mark.parametrize(
+    "commit_policy,method",
+    [("single", "mappings"), ("chunk", "mappings"), ("single", "copy")],
+)
+def test_chunked_insert(
+    engine, master_data, db_config, work_dir, commit_policy, method
+):
+    version = f"chunked-{commit_policy}-{method}"
+    input_file = work_dir / f"sky_{version}.csv"
+    _write_sky_csv(input_file, version)
+
+    run_cli(
+        "insert",
+        input_file,
+        "-c",
+        db_config,
+        "-t",
+        "sky",
+        "--method",
+        method,
+        "--chunk-size",
+        CHUNK_SIZE,
+        "--commit-policy",
+        commit_policy,
+        "--commit",
+    )
+
+    assert _fetch_obj_ids(engine, version) == list(range(N_SKY))
+
+
+def test_chunked_insert_dry_run(engine, master_data, db_config, work_dir):
+    version = "chunked-dry-run"
+    input_file = work_dir / f"sky_{version}.csv"
+    _write_sky_csv(input_file, version)
+
+    run_cli(
+        "insert",
+        input_file,
+        "-c",
+        db_config,
+        "-t",
+        "sky",
+        "--chunk-size",
+        CHUNK_SIZE,
+    )
+
+    assert _fetch_obj_ids(engine, version) == []
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Verify `cluster_targets` writes friends-of-friends clusters to the cluster
+table, and that the incremental mode merges new targets into existing clusters."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from astropy import units as u
+from sqlalchemy import text
+
+from targetdb.clustering import cluster_targets
+
+PROPOSAL_ID = "S21B-EN01"
+RA0, DEC0 = 200.0, 45.0
+ARCSEC = 1.0 / 3600.0
+
+
+def _targets(input_catalog_id, ob_codes, offsets):
+    # offsets are (dRA * cos(Dec), dDec) in arcsec from (RA0, DEC0)
+    d_ra, d_dec = np.array(offsets, dtype=float).T * ARCSEC
+    n = len(ob_codes)
+    return pd.DataFrame(
+        {
+            "proposal_id": [PROPOSAL_ID] * n,
+            "ob_code": ob_codes,
+            "obj_id": range(n),
+            "ra": RA0 + d_ra / np.cos(np.deg2rad(DEC0)),
+            "dec": DEC0 + d_dec,
+            "input_catalog_id": [input_catalog_id] * n,
+            "effective_exptime": [900.0] * n,
+            "is_medium_resolution": [False] * n,
+            "target_type_id": [1] * n,
+            "qa_reference_arm": ["r"] * n,
+        }
+    )
+
+
+def _fetch_groups(engine):
+    with engine.connect() as conn:
+        df = pd.read_sql(
+            text(
+                "SELECT c.cluster_id, t.ob_code FROM cluster AS c "
+                "JOIN target AS t USING (target_id) WHERE t.proposal_id = :proposal_id"
+            ),
+            conn,
+            params={"proposal_id": PROPOSAL_ID},
+        )
+    return sorted(sorted(g) for g in df.groupby("cluster_id")["ob_code"].agg(list))
+
+
+def _fetch_is_cluster(engine):
+    with engine.connect() as conn:
+        df = pd.read_sql(
+            text(
+                "SELECT ob_code, is_cluster FROM target "
+                "WHERE proposal_id = :proposal_id ORDER BY ob_code"
+            ),
+            conn,
+            params={"proposal_id": PROPOSAL_ID},
+        )
+    return dict(zip(df["ob_code"], df["is_cluster"], strict=True))
+
+
+@pytest.fixture(scope="module")
+def seed_rows():
+    df = _targets(
+        5, ["cl_a", "cl_b", "cl_c", "cl_d"], [(0, 0), (0.6, 0), (60, 0), (0, 300)]
+    )
+    return [("target", df, "proposal_id")]
+
+
+@pytest.fixture(scope="module")
+def db(db):
+    yield db
+    # cluster rows refer to the targets deleted by the shared fixture
+    db.rollback()
+    db.execute_query(
+        "DELETE FROM cluster WHERE target_id IN "
+        f"(SELECT target_id FROM target WHERE proposal_id = '{PROPOSAL_ID}')"
+    )
+
+
+def test_cluster_targets(db, engine):
+    df = cluster_targets(db, 1.0 * u.arcsec, input_catalog_id=5, dry_run=True)
+
+    assert df["n_targets"].tolist() == [2, 2]
+    assert _fetch_groups(engine) == []
+
+    cluster_targets(db, 1.0 * u.arcsec, input_catalog_id=5)
+
+    assert _fetch_groups(engine) == [["cl_a", "cl_b"]]
+    assert _fetch_is_cluster(engine) == {
+        "cl_a": True,
+        "cl_b": True,
+        "cl_c": False,
+        "cl_d": False,
+    }
+
+
+def test_cluster_targets_incremental(db, engine):
+    # cl_e links to cl_b (but not to cl_a), and cl_f to cl_c
+    db.insert(
+        "target",
+        _targets(6, ["cl_e", "cl_f"], [(1.4, 0), (60, 0.5)]),
+        method="copy",
+    )
+
+    cluster_targets(db, 1.0 * u.arcsec, input_catalog_id=6, incremental=True)
+
+    assert _fetch_groups(engine) == [["cl_a", "cl_b", "cl_e"], ["cl_c", "cl_f"]]
+    assert _fetch_is_cluster(engine)["cl_c"]
+    assert not _fetch_is_cluster(engine)["cl_d"]
+
+    # re-clustering all of them from scratch gives the same clusters
+    cluster_targets(db, 1.0 * u.arcsec, input_catalog_id=[5, 6])
+
+    assert _fetch_groups(engine) == [["cl_a", "cl_b", "cl_e"], ["cl_c", "cl_f"]]
+
+
+def test_cluster_targets_incremental_follows_chains(db, engine):
+    # cl_g and cl_h are existing targets which have not been clustered, and
+    # the new cl_i links to cl_h only through cl_g
+    db.insert(
+        "target",
+        _targets(7, ["cl_g", "cl_h"], [(120, 0), (120.8, 0)]),
+        method="copy",
+    )
+    db.insert("target", _targets(8, ["cl_i"], [(119.2, 0)]), method="copy")
+
+    cluster_targets(db, 1.0 * u.arcsec, input_catalog_id=8, incremental=True)
+
+    assert ["cl_g", "cl_h", "cl_i"] in _fetch_groups(engine)
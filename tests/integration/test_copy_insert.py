@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Verify `insert --method copy` streams rows through the binary COPY path
+with Python-side defaults applied and missing values stored as NULL."""
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from .conftest import run_cli
+
+SKY_VERSION = "copy-test"
+N_SKY = 25
+
+
+@pytest.fixture(scope="module")
+def sky_copy_data(master_data, db_config, work_dir):
+    input_file = work_dir / "sky_copy.csv"
+    pd.DataFrame(
+        {
+            "obj_id": range(N_SKY),
+            "ra": [150.0 + 0.01 * i for i in range(N_SKY)],
+            "dec": [2.0] * N_SKY,
+            "mag_thresh": [""] * (N_SKY - 1) + ["25.5"],
+            "input_catalog_id": [1001] * N_SKY,
+            "version": [SKY_VERSION] * N_SKY,
+        }
+    ).to_csv(input_file, index=False)
+
+    run_cli(
+        "insert",
+        input_file,
+        "-c",
+        db_config,
+        "-t",
+        "sky",
+        "--method",
+        "copy",
+        "--batch-size",
+        "10",
+        "--commit",
+    )
+    return input_file
+
+
+def test_copy_insert_row_count(engine, sky_copy_data):
+    with engine.connect() as conn:
+        n_rows = conn.execute(
+            text("SELECT count(*) FROM sky WHERE version = :version"),
+            {"version": SKY_VERSION},
+        ).scalar_one()
+    assert n_rows == N_SKY
+
+
+def test_copy_insert_defaults_and_nulls(engine, sky_copy_data):
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                "SELECT obj_id, epoch, target_type_id, mag_thresh, created_at "
+                "FROM sky WHERE version = :version ORDER BY obj_id"
+            ),
+            {"version": SKY_VERSION},
+        ).fetchall()
+
+    assert [r.obj_id for r in rows] == list(range(N_SKY))
+    assert {r.epoch for r in rows} == {"J2000.0"}
+    assert {r.target_type_id for r in rows} == {2}
+    assert all(r.mag_thresh is None for r in rows[:-1])
+    assert rows[-1].mag_thresh == 25.5
+    assert all(r.created_at is not None for r in rows)
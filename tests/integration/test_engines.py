@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Verify that the utilities reuse a given TargetDB or engine and that the pool
+options of the shared engines reach the sessions."""
+
+from sqlalchemy import text
+
+from targetdb import TargetDB, dispose_engines, get_engine
+from targetdb.utils import get_url_object, load_config, update_input_catalog_active
+
+TARGET_CATALOG_ID = 1003
+
+
+def test_shared_engine_statement_timeout(master_data, db_config):
+    config = load_config(db_config)
+    try:
+        with TargetDB(
+            **config["targetdb"]["db"],
+            shared_engine=True,
+            pool_pre_ping=True,
+            statement_timeout=1234,
+        ) as db:
+            timeout = db.session.execute(text("SHOW statement_timeout")).scalar_one()
+            engine = db.engine
+        assert timeout == "1234ms"
+        assert get_engine(db.dbinfo, pool_pre_ping=True, statement_timeout=1234) is (
+            engine
+        )
+    finally:
+        dispose_engines()
+
+
+def test_utilities_reuse_engine(master_data, db_config):
+    config = load_config(db_config)
+    engine = get_engine(get_url_object(config), pool_size=1, max_overflow=0)
+    try:
+        # a single pooled connection is enough for consecutive calls
+        for flag in [False, True]:
+            update_input_catalog_active(TARGET_CATALOG_ID, flag, None, True, db=engine)
+            with engine.connect() as conn:
+                active = conn.execute(
+                    text(
+                        "SELECT active FROM input_catalog WHERE input_catalog_id = :id"
+                    ),
+                    {"id": TARGET_CATALOG_ID},
+                ).scalar_one()
+            assert active is flag
+        assert engine.pool.checkedout() == 0
+    finally:
+        dispose_engines()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Verify filters on Enum columns are bound with their labels by the fetch
+methods running on the DBAPI cursor."""
+
+import pandas as pd
+import pytest
+
+from targetdb.models import ResolutionMode
+
+PPC_CODES = ["enum-test-L", "enum-test-M"]
+
+
+@pytest.fixture(scope="module")
+def seed_rows():
+    df = pd.DataFrame(
+        {
+            "ppc_code": PPC_CODES,
+            "ppc_ra": [10.0, 20.0],
+            "ppc_dec": [0.0, 0.0],
+            "ppc_pa": [0.0, 0.0],
+            "ppc_resolution": [ResolutionMode.L, ResolutionMode.M],
+            "ppc_priority": [1.0, 1.0],
+            "input_catalog_id": [1001, 1001],
+        }
+    )
+    return [("user_pointing", df, "ppc_code")]
+
+
+def test_filter_on_enum_column(db):
+    df = db.fetch_by_id(
+        "user_pointing", ppc_code=PPC_CODES, ppc_resolution=ResolutionMode.L
+    )
+    assert df["ppc_code"].tolist() == ["enum-test-L"]
+    assert df["ppc_resolution"].tolist() == [ResolutionMode.L]
+
+    tb = db.fetch_columns(
+        "user_pointing",
+        columns=["ppc_code"],
+        as_arrow=True,
+        ppc_code=PPC_CODES,
+        ppc_resolution=[ResolutionMode.L, ResolutionMode.M],
+    )
+    assert sorted(tb.column("ppc_code").to_pylist()) == PPC_CODES
+
+    batches = list(
+        db.iter_table(
+            "user_pointing",
+            columns=["ppc_code"],
+            ppc_code=PPC_CODES,
+            ppc_resolution=ResolutionMode.M,
+        )
+    )
+    assert pd.concat(batches)["ppc_code"].tolist() == ["enum-test-M"]
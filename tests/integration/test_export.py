@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Verify `TargetDB.export_dataset` writes a Hive-partitioned parquet dataset
+with the same rows as `fetch_columns`."""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+
+from targetdb.spatial import healpix_index
+
+SKY_VERSIONS = ["export-test-1", "export-test-2"]
+N_SKY = 30
+
+
+@pytest.fixture(scope="module")
+def seed_rows():
+    rng = np.random.default_rng(0)
+    df = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "obj_id": range(N_SKY),
+                    "ra": rng.uniform(0, 360, N_SKY),
+                    "dec": rng.uniform(-60, 60, N_SKY),
+                    "input_catalog_id": [1001] * N_SKY,
+                    "version": [version] * N_SKY,
+                }
+            )
+            for version in SKY_VERSIONS
+        ],
+        ignore_index=True,
+    )
+    return [("sky", df, "version")]
+
+
+def test_export_dataset_partitioned(db, tmp_path):
+    n_rows = db.export_dataset(
+        "sky",
+        tmp_path,
+        columns=["sky_id", "obj_id"],
+        partition_by=["version"],
+        healpix_nside=2,
+        batch_size=7,
+        row_group_size=10,
+        version=SKY_VERSIONS,
+        obj_id={"max": 19},
+    )
+
+    assert n_rows == 40
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        f"version={v}" for v in SKY_VERSIONS
+    ]
+    df = (
+        ds.dataset(tmp_path, format="parquet", partitioning="hive")
+        .to_table()
+        .to_pandas()
+        .sort_values("sky_id", ignore_index=True)
+    )
+    df_expected = db.fetch_columns(
+        "sky",
+        columns=["sky_id", "obj_id", "version", "ra", "dec"],
+        version=SKY_VERSIONS,
+        obj_id={"max": 19},
+    ).sort_values("sky_id", ignore_index=True)
+    assert list(df.columns) == ["sky_id", "obj_id", "version", "healpix"]
+    np.testing.assert_array_equal(df["sky_id"], df_expected["sky_id"])
+    np.testing.assert_array_equal(df["version"], df_expected["version"])
+    np.testing.assert_array_equal(
+        df["healpix"], healpix_index(df_expected["ra"], df_expected["dec"], 2)
+    )
+
+    # the existing files are kept without overwrite
+    with pytest.raises(pa.ArrowInvalid, match="not empty"):
+        db.export_dataset("sky", tmp_path, version=SKY_VERSIONS[0])
+    assert db.export_dataset("sky", tmp_path / "all", version=SKY_VERSIONS[0]) == N_SKY
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Verify `TargetDB.fetch_by_keys` resolves many composite keys in one query."""
+
+import pandas as pd
+import pytest
+
+SKY_VERSION = "keys-test"
+N_SKY = 12
+
+
+@pytest.fixture(scope="module")
+def seed_rows():
+    df = pd.DataFrame(
+        {
+            "obj_id": range(N_SKY),
+            "ra": [60.0] * N_SKY,
+            "dec": [-5.0] * N_SKY,
+            "input_catalog_id": [1001] * N_SKY,
+            "version": [SKY_VERSION] * N_SKY,
+        }
+    )
+    return [("sky", df, "version")]
+
+
+def test_fetch_by_keys(db):
+    keys = pd.DataFrame(
+        {
+            "obj_id": [3, 7, 7, 100],
+            "version": [SKY_VERSION, SKY_VERSION, SKY_VERSION, SKY_VERSION],
+        }
+    )
+
+    df = db.fetch_by_keys("sky", keys, columns=["sky_id", "obj_id", "version"])
+    df_all = db.fetch_by_id("sky", version=SKY_VERSION)
+
+    # one record per matching key row, and no record for the unknown key
+    assert sorted(df["obj_id"].tolist()) == [3, 7, 7]
+    expected = df_all.set_index("obj_id").loc[df["obj_id"], "sky_id"]
+    assert df["sky_id"].tolist() == expected.tolist()
+
+
+def test_fetch_by_keys_empty(db):
+    keys = pd.DataFrame({"obj_id": [], "version": []})
+
+    df = db.fetch_by_keys("sky", keys, columns=["sky_id"])
+
+    assert df.empty
+    assert df.columns.tolist() == ["sky_id"]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Verify `TargetDB.iter_table` / `iter_query` stream a table in batches through
+a server-side cursor and return the same rows as `fetch_all`."""
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+SKY_VERSION = "iter-test"
+N_SKY = 23
+BATCH_SIZE = 5
+
+
+@pytest.fixture(scope="module")
+def seed_rows():
+    df = pd.DataFrame(
+        {
+            "obj_id": range(N_SKY),
+            "ra": [30.0 + 0.01 * i for i in range(N_SKY)],
+            "dec": [5.0] * N_SKY,
+            "input_catalog_id": [1001] * N_SKY,
+            "version": [SKY_VERSION] * N_SKY,
+        }
+    )
+    return [("sky", df, "version")]
+
+
+def test_iter_table_dataframes(db):
+    batches = list(db.iter_table("sky", batch_size=BATCH_SIZE, version=SKY_VERSION))
+
+    assert [b.index.size for b in batches] == [5, 5, 5, 5, 3]
+    pd.testing.assert_frame_equal(
+        pd.concat(batches, ignore_index=True).sort_values("obj_id", ignore_index=True),
+        db.fetch_by_id("sky", version=SKY_VERSION).sort_values(
+            "obj_id", ignore_index=True
+        ),
+    )
+
+
+def test_iter_table_record_batches(db):
+    batches = list(
+        db.iter_table(
+            "sky",
+            columns=["obj_id", "ra"],
+            batch_size=BATCH_SIZE,
+            as_arrow=True,
+            version=SKY_VERSION,
+        )
+    )
+
+    assert all(isinstance(b, pa.RecordBatch) for b in batches)
+    tb = pa.Table.from_batches(batches)
+    assert tb.column_names == ["obj_id", "ra"]
+    assert sorted(tb.column("obj_id").to_pylist()) == list(range(N_SKY))
+
+
+def test_iter_query(db):
+    batches = list(
+        db.iter_query(
+            "SELECT obj_id FROM sky WHERE version = %(version)s ORDER BY obj_id",
+            params={"version": SKY_VERSION},
+            batch_size=BATCH_SIZE,
+        )
+    )
+
+    assert pd.concat(batches)["obj_id"].tolist() == list(range(N_SKY))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Verify `sync_snapshot` materializes a table in a local parquet dataset and
+keeps it in sync with inserts, updates, and deletes."""
+
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from targetdb.snapshot import read_snapshot, sync_snapshot
+
+SKY_VERSION = "snapshot-test"
+N_SKY = 20
+
+
+def _sky(obj_ids):
+    return pd.DataFrame(
+        {
+            "obj_id": obj_ids,
+            "ra": [40.0 + 0.01 * i for i in obj_ids],
+            "dec": [-5.0] * len(obj_ids),
+            "input_catalog_id": [1001] * len(obj_ids),
+            "version": [SKY_VERSION] * len(obj_ids),
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def seed_rows():
+    return [("sky", _sky(list(range(N_SKY))), "version")]
+
+
+@pytest.fixture(scope="module")
+def db(db):
+    # rows of a single insert have the same created_at
+    db.execute_query(
+        "UPDATE sky SET created_at = created_at - (100 - obj_id) * interval '1 second' "
+        f"WHERE version = '{SKY_VERSION}'"
+    )
+    return db
+
+
+def _assert_snapshot_equal(db, snapshot_dir):
+    df_snapshot = read_snapshot(snapshot_dir, "sky_test").to_pandas()
+    df_db = db.fetch_columns("sky", as_arrow=True, version=SKY_VERSION).to_pandas()
+    pd.testing.assert_frame_equal(
+        df_snapshot.sort_values("sky_id", ignore_index=True),
+        df_db.sort_values("sky_id", ignore_index=True),
+    )
+
+
+def test_sync_snapshot_incrementally(db, tmp_path):
+    kwargs = {
+        "name": "sky_test",
+        "filters": {"version": SKY_VERSION},
+        "overlap": timedelta(0),
+        "n_partitions": 4,
+    }
+
+    metadata = sync_snapshot(db, "sky", tmp_path, **kwargs)
+    assert metadata["last_sync"] == {"mode": "full", "n_written": N_SKY, "n_deleted": 0}
+    assert len(list((tmp_path / "sky_test").glob("part-*.parquet"))) == 4
+    _assert_snapshot_equal(db, tmp_path)
+
+    # only the new and updated rows (and the latest one at the watermark) are fetched
+    db.insert("sky", _sky([100, 101]))
+    df_update = db.fetch_columns(
+        "sky", columns=["sky_id"], version=SKY_VERSION, obj_id=[3]
+    )
+    df_update["ra"] = 45.0
+    db.update("sky", df_update)
+    metadata = sync_snapshot(db, "sky", tmp_path, **kwargs)
+    assert metadata["last_sync"] == {
+        "mode": "incremental",
+        "n_written": 4,
+        "n_deleted": 0,
+    }
+    assert metadata["n_rows"] == N_SKY + 2
+    _assert_snapshot_equal(db, tmp_path)
+
+    # deletes are detected by the reconciliation
+    db.execute_query(
+        f"DELETE FROM sky WHERE version = '{SKY_VERSION}' AND obj_id IN (5, 100)"
+    )
+    metadata = sync_snapshot(db, "sky", tmp_path, **kwargs)
+    assert metadata["last_sync"]["n_deleted"] == 0
+    metadata = sync_snapshot(db, "sky", tmp_path, reconcile=True, **kwargs)
+    assert metadata["last_sync"] == {
+        "mode": "incremental",
+        "n_written": 1,
+        "n_deleted": 2,
+    }
+    assert metadata["n_rows"] == N_SKY
+    _assert_snapshot_equal(db, tmp_path)
+
+    # a change of the filters rebuilds the snapshot
+    metadata = sync_snapshot(
+        db,
+        "sky",
+        tmp_path,
+        **{**kwargs, "filters": {"version": SKY_VERSION, "obj_id": [1, 2]}},
+    )
+    assert metadata["last_sync"]["mode"] == "full"
+    assert metadata["n_rows"] == 2
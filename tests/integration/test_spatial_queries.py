@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Verify `TargetDB.cone_search`, `TargetDB.crossmatch`, `TargetDB.fetch_field`,
+and `TargetDB.fetch_fields` against positions computed on the client."""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from targetdb.spatial import in_hexagon, radec_to_xyz
+
+SKY_VERSION = "spatial-test"
+N_SKY = 200
+RA0, DEC0 = 30.0, -20.0
+
+
+@pytest.fixture(scope="module")
+def seed_rows():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "obj_id": range(N_SKY),
+            "ra": RA0 + rng.uniform(-0.5, 0.5, N_SKY),
+            "dec": DEC0 + rng.uniform(-0.5, 0.5, N_SKY),
+            "input_catalog_id": [1001] * N_SKY,
+            "version": [SKY_VERSION] * N_SKY,
+        }
+    )
+    return [("sky", df, "version")]
+
+
+def _separation(ra1, dec1, ra2, dec2):
+    d = np.linalg.norm(radec_to_xyz(ra1, dec1) - radec_to_xyz(ra2, dec2), axis=1)
+    return np.rad2deg(2 * np.arcsin(d / 2))
+
+
+def test_cone_search(db):
+    df_all = db.fetch_by_id("sky", columns=["obj_id", "ra", "dec"], version=SKY_VERSION)
+    sep = _separation(df_all["ra"], df_all["dec"], RA0, DEC0)
+
+    df = db.cone_search(
+        "sky", RA0, DEC0, 0.2, columns=["obj_id", "ra", "dec"], version=SKY_VERSION
+    )
+
+    assert df.columns.tolist() == ["obj_id", "ra", "dec", "separation"]
+    assert sorted(df["obj_id"]) == sorted(df_all.loc[sep < 0.2, "obj_id"])
+    np.testing.assert_allclose(
+        df["separation"], _separation(df["ra"], df["dec"], RA0, DEC0), atol=1e-8
+    )
+
+
+def test_crossmatch(db):
+    positions = pd.DataFrame(
+        {"ra": [RA0, RA0 + 0.3, RA0 + 5.0], "dec": [DEC0, DEC0 - 0.3, DEC0]}
+    )
+
+    df = db.crossmatch("sky", positions, 0.1, columns=["obj_id"], version=SKY_VERSION)
+
+    assert df.columns.tolist() == ["obj_id", "position_index", "separation"]
+    for i, (ra, dec) in positions.iterrows():
+        expected = db.cone_search(
+            "sky", ra, dec, 0.1, columns=["obj_id"], version=SKY_VERSION
+        )
+        matched = df[df["position_index"] == i]
+        assert sorted(matched["obj_id"]) == sorted(expected["obj_id"])
+    assert (df["position_index"] != 2).all()
+
+    tb = db.crossmatch(
+        "sky", positions, 0.1, columns=["obj_id"], as_arrow=True, version=SKY_VERSION
+    )
+    assert tb.schema.field("position_index").type == pa.int64()
+    assert tb.num_rows == df.index.size
+
+
+def test_fetch_field(db):
+    df_all = db.fetch_by_id("sky", columns=["obj_id", "ra", "dec"], version=SKY_VERSION)
+    sep = _separation(df_all["ra"], df_all["dec"], RA0, DEC0)
+
+    res = db.fetch_field(
+        RA0,
+        DEC0,
+        radius=0.4,
+        tables=["sky", "fluxstd"],
+        columns={"sky": ["obj_id", "ra", "dec"]},
+        filters={"sky": {"version": SKY_VERSION, "obj_id": {"min": 10, "max": 150}}},
+    )
+
+    assert list(res) == ["sky", "fluxstd"]
+    tb = res["sky"]
+    assert tb.column_names == ["obj_id", "ra", "dec", "separation"]
+    is_in = (sep < 0.4) & df_all["obj_id"].between(10, 150)
+    assert sorted(tb.column("obj_id").to_pylist()) == sorted(
+        df_all.loc[is_in, "obj_id"]
+    )
+
+    # the hexagon is inscribed in the circle; ra and dec are always fetched
+    tb_hex = db.fetch_field(
+        RA0,
+        DEC0,
+        position_angle=30.0,
+        radius=0.4,
+        tables=["sky"],
+        columns={"sky": ["obj_id"]},
+        filters={"sky": {"version": SKY_VERSION}},
+    )["sky"]
+    is_in = (sep < 0.4) & in_hexagon(df_all["ra"], df_all["dec"], RA0, DEC0, 30.0, 0.4)
+    assert 0 < tb_hex.num_rows < np.count_nonzero(sep < 0.4)
+    assert sorted(tb_hex.column("obj_id").to_pylist()) == sorted(
+        df_all.loc[is_in, "obj_id"]
+    )
+
+    # rows of inactive input catalogs are excluded by default
+    db.execute_query(
+        "UPDATE input_catalog SET active = FALSE WHERE input_catalog_id = 1001"
+    )
+    try:
+        res = db.fetch_field(
+            RA0,
+            DEC0,
+            radius=1.0,
+            tables=["sky"],
+            filters={"sky": {"version": SKY_VERSION}},
+        )
+        assert res["sky"].num_rows == 0
+        res = db.fetch_field(
+            RA0,
+            DEC0,
+            radius=1.0,
+            tables=["sky"],
+            filters={"sky": {"version": SKY_VERSION}},
+            active=False,
+        )
+        assert res["sky"].num_rows == N_SKY
+    finally:
+        db.execute_query(
+            "UPDATE input_catalog SET active = TRUE WHERE input_catalog_id = 1001"
+        )
+
+    with pytest.raises(ValueError):
+        db.fetch_field(RA0, DEC0, tables=["sky"], filters={"target": {}})
+
+
+def test_fetch_fields(db):
+    # overlapping pointings, one of which is a hexagon, and one without rows
+    pointings = pd.DataFrame(
+        {
+            "ra": [RA0 - 0.2, RA0 + 0.2, RA0 + 10.0],
+            "dec": [DEC0, DEC0 + 0.1, DEC0],
+            "pa": [np.nan, 30.0, 0.0],
+        }
+    )
+
+    res = db.fetch_fields(
+        pointings,
+        radius=0.3,
+        tables=["sky"],
+        columns={"sky": ["obj_id"]},
+        filters={"sky": {"version": SKY_VERSION}},
+        pa_column="pa",
+    )
+
+    tb = res["sky"]
+    assert tb.column_names == ["pointing_index", "obj_id", "ra", "dec", "separation"]
+    df = tb.to_pandas()
+    for i, p in pointings.iterrows():
+        expected = db.fetch_field(
+            p["ra"],
+            p["dec"],
+            position_angle=None if np.isnan(p["pa"]) else p["pa"],
+            radius=0.3,
+            tables=["sky"],
+            columns={"sky": ["obj_id"]},
+            filters={"sky": {"version": SKY_VERSION}},
+        )["sky"]
+        matched = df[df["pointing_index"] == i]
+        assert sorted(matched["obj_id"]) == sorted(
+            expected.column("obj_id").to_pylist()
+        )
+        np.testing.assert_allclose(
+            matched.sort_values("obj_id")["separation"],
+            expected.to_pandas().sort_values("obj_id")["separation"],
+            atol=1e-8,
+        )
+    # some rows are in both of the overlapping fields
+    assert df["obj_id"].duplicated().any()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Verify `update --method staging` applies all rows with one UPDATE ... FROM
+a staging table, honours the dry run, and leaves other columns unchanged."""
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from targetdb import TargetDB
+from targetdb.utils import load_config
+
+from .conftest import run_cli
+
+SKY_VERSION = "staging-test"
+N_SKY = 15
+
+
+def _fetch_sky(engine):
+    with engine.connect() as conn:
+        return pd.read_sql(
+            text(
+                "SELECT sky_id, mag_thresh, ra, updated_at FROM sky "
+                "WHERE version = :version ORDER BY sky_id"
+            ),
+            conn,
+            params={"version": SKY_VERSION},
+        )
+
+
+@pytest.fixture(scope="module")
+def update_file(master_data, db_config, engine, work_dir):
+    with TargetDB(**load_config(db_config)["targetdb"]["db"]) as db:
+        db.insert(
+            "sky",
+            pd.DataFrame(
+                {
+                    "obj_id": range(N_SKY),
+                    "ra": [90.0] * N_SKY,
+                    "dec": [1.0] * N_SKY,
+                    "input_catalog_id": [1001] * N_SKY,
+                    "version": [SKY_VERSION] * N_SKY,
+                }
+            ),
+        )
+
+    input_file = work_dir / "sky_staging_update.csv"
+    df = _fetch_sky(engine)
+    pd.DataFrame(
+        {
+            "sky_id": df["sky_id"],
+            "input_catalog_id": [1001] * N_SKY,
+            "mag_thresh": [20.0 + i for i in range(N_SKY)],
+        }
+    ).to_csv(input_file, index=False)
+    return input_file
+
+
+def test_staging_update_dry_run(engine, db_config, update_file):
+    run_cli("update", update_file, "-c", db_config, "-t", "sky", "--method", "staging")
+
+    assert _fetch_sky(engine)["mag_thresh"].isna().all()
+
+
+def test_staging_update(engine, db_config, update_file):
+    run_cli(
+        "update",
+        update_file,
+        "-c",
+        db_config,
+        "-t",
+        "sky",
+        "--method",
+        "staging",
+        "--batch-size",
+        3,
+        "--commit",
+    )
+
+    df = _fetch_sky(engine)
+    assert df["mag_thresh"].tolist() == [20.0 + i for i in range(N_SKY)]
+    assert (df["ra"] == 90.0).all()
+    assert df["updated_at"].notna().all()
+
+
+def test_staging_update_failure_keeps_caller_transaction(
+    engine, db_config, update_file
+):
+    version = "staging-test-savepoint"
+    df_sky = _fetch_sky(engine)
+    with TargetDB(**load_config(db_config)["targetdb"]["db"]) as db:
+        try:
+            db.insert_by_binary_copy(
+                "sky",
+                pd.DataFrame(
+                    {
+                        "obj_id": [0],
+                        "ra": [91.0],
+                        "dec": [1.0],
+                        "input_catalog_id": [1001],
+                        "version": [version],
+                    }
+                ),
+                autocommit=False,
+            )
+            # the unknown sky_id fails only the update in the savepoint
+            with pytest.raises(ValueError), db.session.begin_nested():
+                db.update_by_staging(
+                    "sky",
+                    pd.DataFrame(
+                        {
+                            "sky_id": [df_sky["sky_id"].iloc[0], -1],
+                            "mag_thresh": [0.0, 0.0],
+                        }
+                    ),
+                    autocommit=False,
+                )
+            db.commit()
+
+            assert db.fetch_columns("sky", version=version).index.size == 1
+            assert (
+                _fetch_sky(engine)["mag_thresh"].tolist()
+                == df_sky["mag_thresh"].tolist()
+            )
+        finally:
+            db.execute_query(f"DELETE FROM sky WHERE version = '{version}'")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Verify `insert --method upsert` inserts new rows and updates existing ones
+matched by the natural key (obj_id, input_catalog_id, version) of the sky table."""
+
+import pandas as pd
+import psycopg2
+import pytest
+from sqlalchemy import text
+
+from targetdb import TargetDB
+from targetdb.utils import load_config
+
+from .conftest import run_cli
+
+SKY_VERSION = "upsert-test"
+
+
+def _write_sky_csv(path, obj_ids, mag_thresh):
+    pd.DataFrame(
+        {
+            "obj_id": obj_ids,
+            "ra": [120.0] * len(obj_ids),
+            "dec": [3.0] * len(obj_ids),
+            "mag_thresh": [mag_thresh] * len(obj_ids),
+            "input_catalog_id": [1001] * len(obj_ids),
+            "version": [SKY_VERSION] * len(obj_ids),
+        }
+    ).to_csv(path, index=False)
+
+
+def _fetch_sky(engine):
+    with engine.connect() as conn:
+        return pd.read_sql(
+            text(
+                "SELECT obj_id, mag_thresh FROM sky WHERE version = :version "
+                "ORDER BY obj_id"
+            ),
+            conn,
+            params={"version": SKY_VERSION},
+        )
+
+
+def _upsert(input_file, db_config, *args):
+    run_cli(
+        "insert",
+        input_file,
+        "-c",
+        db_config,
+        "-t",
+        "sky",
+        "--method",
+        "upsert",
+        "--batch-size",
+        "4",
+        "--commit",
+        *args,
+    )
+
+
+def test_upsert(engine, master_data, db_config, work_dir):
+    first = work_dir / "sky_upsert_1.csv"
+    second = work_dir / "sky_upsert_2.csv"
+    third = work_dir / "sky_upsert_3.csv"
+    _write_sky_csv(first, list(range(10)), 21.0)
+    _write_sky_csv(second, list(range(5, 15)), 22.0)
+    _write_sky_csv(third, list(range(10, 20)), 23.0)
+
+    _upsert(first, db_config)
+    _upsert(second, db_config)
+
+    df = _fetch_sky(engine)
+    assert df["obj_id"].tolist() == list(range(15))
+    assert df["mag_thresh"].tolist() == [21.0] * 5 + [22.0] * 10
+
+    # existing rows are kept as they are with --on-conflict nothing
+    _upsert(third, db_config, "--on-conflict", "nothing")
+
+    df = _fetch_sky(engine)
+    assert df["obj_id"].tolist() == list(range(20))
+    assert df["mag_thresh"].tolist() == [21.0] * 5 + [22.0] * 10 + [23.0] * 5
+
+
+def test_upsert_failure_keeps_caller_transaction(master_data, db_config):
+    version = "upsert-test-savepoint"
+    df = pd.DataFrame(
+        {
+            "obj_id": [0, 1],
+            "ra": [121.0, 121.0],
+            "dec": [3.0, 3.0],
+            "input_catalog_id": [1001, 1001],
+            "version": [version, version],
+        }
+    )
+    with TargetDB(**load_config(db_config)["targetdb"]["db"]) as db:
+        try:
+            db.insert_by_binary_copy("sky", df.iloc[:1], autocommit=False)
+            # the unknown input_catalog_id fails only the upsert in the savepoint
+            with (
+                pytest.raises(psycopg2.errors.ForeignKeyViolation),
+                db.session.begin_nested(),
+            ):
+                db.upsert(
+                    "sky", df.iloc[1:].assign(input_catalog_id=-1), autocommit=False
+                )
+            db.upsert("sky", df.iloc[1:], autocommit=False)
+            db.commit()
+
+            df_sky = db.fetch_columns("sky", columns=["obj_id"], version=version)
+            assert sorted(df_sky["obj_id"]) == [0, 1]
+        finally:
+            db.execute_query(f"DELETE FROM sky WHERE version = '{version}'")
@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 
-import pytest
 from astropy import units as u
 
+from targetdb import clustering as clustering_targets
+
 
-@pytest.mark.skip(reason="clustering_targets is not part of targetdb")
 def test_run_clustering():
     ra = [0.0, 0.5, 0.0, 0.5, 0.0, 0.5, 0.0, 0.5]
     dec = [0.0, 0.0, 30.0, 30.0, 60.0, 60.0, 85.0, 85.0]
@@ -24,9 +24,7 @@ def test_run_clustering():
     # returned_n_noises = []
 
     for th in threshs:
-        labels = clustering_targets.run_clustering(  # noqa: F821
-            ra, dec, distance_threshold=th
-        )
+        labels = clustering_targets.run_clustering(ra, dec, distance_threshold=th)
         print(f"{labels=}")
         n_clusters_ = len(set(labels)) - (1 if -1 in labels else 0)
         # n_noise_ = list(labels).count(-1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import struct
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from targetdb import models
+from targetdb.pgcopy import (
+    PGCOPY_HEADER,
+    PGCOPY_TRAILER,
+    CopyStream,
+    column_kind,
+    dataframe_to_arrow,
+    encode_record_batch,
+    iter_copy_binary,
+    iter_record_batches,
+)
+
+
+def _decode_tuples(data, n_cols):
+    # minimal reader of the binary COPY tuple format used to check the encoder
+    rows = []
+    pos = 0
+    while pos < len(data):
+        (n,) = struct.unpack_from("!h", data, pos)
+        assert n == n_cols
+        pos += 2
+        fields = []
+        for _ in range(n):
+            (length,) = struct.unpack_from("!i", data, pos)
+            pos += 4
+            if length < 0:
+                fields.append(None)
+            else:
+                fields.append(data[pos : pos + length])
+                pos += length
+        rows.append(fields)
+    return rows
+
+
+def test_encode_record_batch_round_trip():
+    df = pd.DataFrame(
+        {
+            "ppc_code": ["a", "ééé", None],
+            "ppc_ra": [1.5, np.nan, -3.0],
+            "ppc_resolution": [models.ResolutionMode.L, "M", "L"],
+            "input_catalog_id": [1, 2, 3],
+            "created_at": pd.to_datetime(
+                ["2000-01-01 00:00:01", None, "1999-12-31 00:00:00"]
+            ),
+        }
+    )
+    table = dataframe_to_arrow(df, models.user_pointing)
+    kinds = [
+        column_kind(models.user_pointing.__table__.columns[name])
+        for name in table.schema.names
+    ]
+    assert kinds == ["text", "float8", "text", "int4", "timestamp"]
+
+    rows = _decode_tuples(encode_record_batch(table.to_batches()[0], kinds), 5)
+
+    assert [r[0] for r in rows] == [b"a", "ééé".encode(), None]
+    assert struct.unpack("!d", rows[0][1])[0] == 1.5
+    assert rows[1][1] is None
+    assert [r[2] for r in rows] == [b"L", b"M", b"L"]
+    assert [struct.unpack("!i", r[3])[0] for r in rows] == [1, 2, 3]
+    assert struct.unpack("!q", rows[0][4])[0] == 1_000_000
+    assert rows[1][4] is None
+    assert struct.unpack("!q", rows[2][4])[0] == -86_400_000_000
+
+
+def test_dataframe_to_arrow_fills_scalar_defaults_and_drops_extra_columns():
+    df = pd.DataFrame({"obj_id": [1], "ra": [0.0], "target_type_name": ["SCIENCE"]})
+
+    table = dataframe_to_arrow(df, models.target)
+
+    assert "target_type_name" not in table.schema.names
+    assert table.column("single_exptime").to_pylist() == [900.0]
+    assert table.column("is_medium_resolution").to_pylist() == [False]
+    assert table.schema.field("obj_id").type == pa.int64()
+
+    table = dataframe_to_arrow(df, models.target, fill_defaults=False)
+
+    assert table.schema.names == ["obj_id", "ra"]
+
+
+def test_nan_is_null_for_both_dataframe_and_arrow_input():
+    df = pd.DataFrame({"obj_id": [1, 2], "ra": [np.nan, 1.0]})
+
+    batches = [
+        next(iter_record_batches(data, models.target))
+        for data in [df, pa.table({"obj_id": [1, 2], "ra": [float("nan"), 1.0]})]
+    ]
+
+    for batch in batches:
+        assert batch.column("ra").to_pylist() == [None, 1.0]
+
+
+def test_copy_stream_reads_header_batches_and_trailer():
+    df = pd.DataFrame({"obj_id": np.arange(10), "is_cluster": [True, False] * 5})
+    batches = list(iter_record_batches(df, models.target, batch_size=3))
+    assert [b.num_rows for b in batches] == [3, 3, 3, 1]
+
+    kinds = [
+        column_kind(models.target.__table__.columns[name])
+        for name in batches[0].schema.names
+    ]
+    stream = CopyStream(iter_copy_binary(batches, kinds))
+    data = b""
+    while chunk := stream.read(7):
+        data += chunk
+
+    assert data.startswith(PGCOPY_HEADER)
+    assert data.endswith(PGCOPY_TRAILER)
+    rows = _decode_tuples(data[len(PGCOPY_HEADER) : -len(PGCOPY_TRAILER)], len(kinds))
+    assert [struct.unpack("!q", r[0])[0] for r in rows] == list(range(10))
+    assert [r[1] for r in rows] == [b"\x01", b"\x00"] * 5
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from targetdb.spatial import (
+    find_pairs,
+    friends_of_friends,
+    healpix_index,
+    in_hexagon,
+    make_cluster_table,
+    match_pointings,
+    radec_to_xyz,
+)
+
+
+@pytest.mark.parametrize("radius", [0.05, 0.5, 3.0])
+def test_find_pairs_matches_brute_force(radius):
+    rng = np.random.default_rng(0)
+    # uniform on the sphere plus crowded regions around RA = 0 and the pole
+    ra = np.concatenate(
+        [
+            rng.uniform(0, 360, 1000),
+            rng.uniform(-0.1, 0.1, 100) % 360,
+            rng.uniform(0, 360, 100),
+        ]
+    )
+    dec = np.concatenate(
+        [
+            np.rad2deg(np.arcsin(rng.uniform(-1, 1, 1000))),
+            rng.uniform(-1, 1, 100),
+            rng.uniform(89.8, 90, 100),
+        ]
+    )
+
+    xyz = radec_to_xyz(ra, dec)
+    chord2 = (2 * np.sin(np.deg2rad(radius) / 2)) ** 2
+    d2 = np.sum((xyz[:, None, :] - xyz[None, :, :]) ** 2, axis=-1)
+    expected = set(zip(*np.nonzero(np.triu(d2 <= chord2, k=1)), strict=True))
+
+    i, j = find_pairs(ra, dec, radius, max_candidates=1000)
+
+    assert np.all(i < j)
+    assert set(zip(i, j, strict=True)) == expected
+
+
+def test_make_cluster_table_from_friends_of_friends():
+    ra = [359.9, 0.1, 10.0, 0.0, 10.0]
+    dec = [0.0, 0.0, 10.0, 0.05, 30.0]
+
+    labels = friends_of_friends(ra, dec, 0.15)
+    df = make_cluster_table(
+        ra, dec, labels, [10, 11, 12, 13, 14], input_catalog_id=[1, 1, 1, 2, 2]
+    )
+
+    assert df.columns.tolist() == [
+        "cluster_id",
+        "target_id",
+        "n_targets",
+        "ra_cluster",
+        "dec_cluster",
+        "d_ra",
+        "d_dec",
+        "input_catalog_id",
+    ]
+    assert df["cluster_id"].tolist() == [1, 1, 1]
+    assert df["target_id"].tolist() == [10, 11, 13]
+    assert df["n_targets"].tolist() == [3, 3, 3]
+    # the centre is across RA = 0
+    ra_cluster = df["ra_cluster"].iloc[0]
+    assert min(ra_cluster, 360.0 - ra_cluster) == pytest.approx(0.0, abs=1e-6)
+    np.testing.assert_allclose(df["d_ra"], [-0.1, 0.1, 0.0], atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "pa, expected",
+    [
+        # vertices to the north and the south
+        (0.0, [True, True, True, False, True, False, False]),
+        # vertices to the east and the west
+        (90.0, [True, False, False, True, True, True, False]),
+    ],
+)
+def test_in_hexagon(pa, expected):
+    # the center, near the north/south vertices, near the east vertex, near
+    # the west edge across RA = 0, and the antipode
+    ra = [0.0, 0.0, 0.0, 0.65, 359.5, 359.35, 180.0]
+    dec = [0.0, 0.68, -0.68, 0.0, 0.0, 0.0, 0.0]
+
+    mask = in_hexagon(ra, dec, 0.0, 0.0, pa, 0.69)
+
+    assert mask.tolist() == expected
+
+
+def test_match_pointings_matches_per_pointing_tests():
+    rng = np.random.default_rng(1)
+    ra = rng.uniform(-2, 2, 5000) % 360
+    dec = rng.uniform(-2, 2, 5000)
+    # overlapping pointings across RA = 0, one of which is a hexagon
+    ra_p = np.array([359.5, 0.3, 1.5, 100.0])
+    dec_p = np.array([0.0, 0.2, -1.0, 0.0])
+    pa = np.array([np.nan, 15.0, np.nan, np.nan])
+
+    index, pointing_index, separation = match_pointings(
+        ra, dec, ra_p, dec_p, 0.69, pa=pa
+    )
+
+    assert np.all(np.diff(pointing_index) >= 0)
+    xyz = radec_to_xyz(ra, dec)
+    for k in range(ra_p.size):
+        cos_sep = xyz @ radec_to_xyz(ra_p[k], dec_p[k])[0]
+        expected = cos_sep >= np.cos(np.deg2rad(0.69))
+        if not np.isnan(pa[k]):
+            expected &= in_hexagon(ra, dec, ra_p[k], dec_p[k], pa[k], 0.69)
+        is_k = pointing_index == k
+        assert sorted(index[is_k]) == np.flatnonzero(expected).tolist()
+        np.testing.assert_allclose(
+            separation[is_k],
+            np.rad2deg(np.arccos(np.clip(cos_sep[index[is_k]], -1, 1))),
+            atol=1e-6,
+        )
+    assert np.count_nonzero(pointing_index == 3) == 0
+
+
+def test_healpix_index_nested_pixels():
+    # centers of the 12 base pixels
+    dec_c = np.rad2deg(np.arcsin(2.0 / 3.0))
+    ra = [45, 135, 225, 315, 0, 90, 180, 270, 45, 135, 225, 315]
+    dec = [dec_c] * 4 + [0.0] * 4 + [-dec_c] * 4
+    assert healpix_index(ra, dec, 1).tolist() == list(range(12))
+    # the poles are at the corners of the base pixels
+    assert healpix_index([0, 0], [90, -90], 16).tolist() == [255, 2048]
+
+    rng = np.random.default_rng(0)
+    ra = rng.uniform(0, 360, 100_000)
+    dec = np.rad2deg(np.arcsin(rng.uniform(-1, 1, 100_000)))
+    for nside in [1, 4, 32]:
+        ipix = healpix_index(ra, dec, nside)
+        # each pixel is divided into four of the next resolution
+        np.testing.assert_array_equal(healpix_index(ra, dec, 2 * nside) >> 2, ipix)
+        # equal-area pixels
+        counts = np.bincount(ipix, minlength=12 * nside**2)
+        assert counts.size == 12 * nside**2
+        expected = ra.size / counts.size
+        assert np.all(np.abs(counts - expected) < 6 * np.sqrt(expected))
+
+    with pytest.raises(ValueError):
+        healpix_index(ra, dec, 3)
+
+
+@pytest.mark.parametrize(
+    "func",
+    [
+        radec_to_xyz,
+        lambda ra, dec: healpix_index(ra, dec, 16),
+        lambda ra, dec: find_pairs(ra, dec, 1.0),
+    ],
+)
+@pytest.mark.parametrize("bad", [(np.nan, 0.0), (10.0, np.inf), (np.nan, np.nan)])
+def test_non_finite_positions_are_rejected(func, bad):
+    ra = [10.0, 20.0, bad[0]]
+    dec = [0.0, 5.0, bad[1]]
+    with pytest.raises(ValueError, match="1 positions are not"):
+        func(ra, dec)
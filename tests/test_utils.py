@@ -1,10 +1,40 @@
 #!/usr/bin/env python
 
+import io
+import shutil
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pytest
+from astropy.table import MaskedColumn
+from astropy.table import Table as AstropyTable
+from loguru import logger
+from pyarrow import Table, feather
 
-from targetdb.utils import add_backref_values, check_filter_flux_consistency
+from targetdb import dispose_engines
+from targetdb.spatial import healpix_index
+from targetdb.utils import (
+    _copy_uploads,
+    _extract_and_validate_zip,
+    _list_uploader_directories,
+    add_backref_values,
+    check_duplicates,
+    check_filter_flux_consistency,
+    check_input_catalog,
+    check_positional_duplicates,
+    connect_targetdb,
+    iter_input_data,
+    join_backref_values,
+    load_input_data,
+    model_dtypes,
+    prep_fluxstd_data,
+    transfer_data_from_uploader,
+    transfer_data_from_uploader_via_webapi,
+)
 
 
 def test_add_backref_values_normalizes_missing_filter_values_for_fluxstd():
@@ -67,3 +97,690 @@ def test_check_filter_flux_consistency_allows_missing_filter_and_flux():
 
     # should not raise
     check_filter_flux_consistency(df)
+
+
+@pytest.mark.parametrize("ext", [".csv", ".feather", ".parquet"])
+def test_iter_input_data_matches_load_input_data(tmp_path, ext):
+    df = pd.DataFrame(
+        {
+            "obj_id": np.arange(10, dtype=np.int64),
+            "ra": np.linspace(0.0, 9.0, 10),
+            "name": [f"obj{i}" for i in range(10)],
+        }
+    )
+    input_file = tmp_path / f"input{ext}"
+    if ext == ".csv":
+        df.to_csv(input_file, index=False)
+    elif ext == ".feather":
+        # small record batches so that chunks have to be assembled from several of them
+        feather.write_feather(
+            Table.from_pandas(df, preserve_index=False), input_file, chunksize=3
+        )
+    else:
+        df.to_parquet(input_file, index=False)
+
+    chunks = list(iter_input_data(str(input_file), 4))
+
+    assert [chunk.index.size for chunk in chunks] == [4, 4, 2]
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True), load_input_data(str(input_file))
+    )
+
+
+def test_iter_input_data_pins_csv_dtypes(tmp_path):
+    input_file = str(tmp_path / "input.csv")
+    pd.DataFrame(
+        {
+            "obj_id": np.arange(6),
+            "mag_thresh": [20.0, 21.0, 22.0, None, None, None],
+            "version": ["v1"] * 6,
+        }
+    ).to_csv(input_file, index=False)
+
+    chunks = list(iter_input_data(input_file, 3, dtypes=model_dtypes("sky")))
+
+    assert [chunk.index.size for chunk in chunks] == [3, 3]
+    for chunk in chunks:
+        assert chunk["obj_id"].dtype == np.int64
+        assert chunk["mag_thresh"].dtype == np.float64
+        assert chunk["version"].tolist() == ["v1"] * 3
+    assert chunks[1]["mag_thresh"].isna().all()
+
+
+@pytest.mark.parametrize("ext", [".csv", ".feather", ".parquet"])
+def test_load_input_data_arrow_engine_matches_pandas(tmp_path, ext):
+    df = pd.DataFrame(
+        {
+            "obj_id": np.arange(5, dtype=np.int64),
+            "ra": [0.0, 1.0, 2.5, 3.0, 4.0],
+            "name": ["a", "", "c", "d", "e"],
+        }
+    )
+    input_file = str(tmp_path / f"input{ext}")
+    if ext == ".csv":
+        df.to_csv(input_file, index=False)
+    elif ext == ".feather":
+        df.to_feather(input_file)
+    else:
+        df.to_parquet(input_file, index=False)
+
+    pd.testing.assert_frame_equal(
+        load_input_data(input_file, engine="arrow"), load_input_data(input_file)
+    )
+    pd.testing.assert_frame_equal(
+        load_input_data(input_file, engine="arrow", columns=["obj_id", "name"]),
+        df.loc[:, ["obj_id", "name"]],
+    )
+
+
+def test_load_input_data_arrow_engine_reads_ecsv(tmp_path):
+    tb = AstropyTable(
+        {
+            "obj_id": np.arange(4, dtype=np.int64),
+            "ra": MaskedColumn([0.0, 1.0, 2.0, 3.0], mask=[False, True, False, False]),
+            "name": ["a", "b c", "d", "e"],
+        }
+    )
+    tb.meta["upload_id"] = "0123456789abcdef"
+    input_file = str(tmp_path / "input.ecsv")
+    tb.write(input_file)
+
+    df_pandas, meta_pandas = load_input_data(input_file, metadata=True)
+    df_arrow, meta_arrow = load_input_data(input_file, metadata=True, engine="arrow")
+
+    pd.testing.assert_frame_equal(df_arrow, df_pandas, check_dtype=False)
+    assert meta_arrow == meta_pandas
+    assert df_arrow["obj_id"].dtype == np.int64
+
+
+def test_load_input_data_pins_dtypes_from_model(tmp_path):
+    input_file = str(tmp_path / "input.csv")
+    pd.DataFrame(
+        {"obj_id": [1, 2], "epoch": ["J2016.0", "J2000.0"], "x": [1, 2]}
+    ).to_csv(input_file, index=False)
+    dtypes = model_dtypes("fluxstd", ["obj_id", "epoch", "x"])
+
+    assert set(dtypes) == {"obj_id", "epoch"}
+
+    tb = load_input_data(input_file, engine="arrow", dtypes=dtypes, as_arrow=True)
+
+    assert tb.schema.field("obj_id").type == pa.int64()
+    assert tb.schema.field("x").type == pa.int64()
+
+    with pytest.raises(ValueError):
+        load_input_data(input_file, dtypes=dtypes)
+
+
+def test_connect_targetdb_shares_the_engine():
+    config = {
+        "targetdb": {
+            "db": {"dbname": "registry_test", "user": "user", "password": "pass"}
+        }
+    }
+    try:
+        db_1, owned = connect_targetdb(config)
+        db_1.close()
+        db_2, _ = connect_targetdb(config)
+        db_2.close()
+        assert owned
+        assert db_1.engine is db_2.engine
+
+        config["targetdb"]["db"]["shared_engine"] = False
+        db_3, _ = connect_targetdb(config)
+        db_3.close()
+        assert db_3.engine is not db_1.engine
+    finally:
+        dispose_engines()
+
+
+def test_join_backref_values_adds_only_the_id_column():
+    class FakeDB:
+        def fetch_dimension(self, table, key, id_column):
+            return pd.DataFrame({key: ["a", "b"], id_column: [10, 20]})
+
+    df = pd.DataFrame({"obj_id": [1, 2, 3], "upload_id": ["b", "a", "b"]})
+    df_joined = join_backref_values(
+        df,
+        db=FakeDB(),
+        table="input_catalog",
+        key="upload_id",
+        check_key="input_catalog_id",
+    )
+
+    assert df_joined.columns.tolist() == ["obj_id", "upload_id", "input_catalog_id"]
+    assert df_joined["input_catalog_id"].tolist() == [20, 10, 20]
+
+    with pytest.raises(ValueError):
+        join_backref_values(
+            pd.DataFrame({"upload_id": ["c"]}),
+            db=FakeDB(),
+            table="input_catalog",
+            key="upload_id",
+            check_key="input_catalog_id",
+        )
+
+
+def test_check_input_catalog_reports_all_offending_rows():
+    class FakeDB:
+        def fetch_all(self, table, columns=None):
+            assert columns == ["upload_id"]
+            return pd.DataFrame({"upload_id": ["aaaa", None, ""]})
+
+    df_ok = pd.DataFrame(
+        {"input_catalog_id": [1, 2, 3], "upload_id": ["bbbb", "", None]}
+    )
+    check_input_catalog(df_ok, db=FakeDB())
+
+    df_bad = pd.DataFrame(
+        {"input_catalog_id": [1, 10001, 200000], "upload_id": ["aaaa", "aaaa", ""]}
+    )
+    with pytest.raises(ValueError) as excinfo:
+        check_input_catalog(
+            df_bad,
+            db=FakeDB(),
+            input_catalog_id_start=10000,
+            input_catalog_id_max=20000,
+        )
+
+    message = str(excinfo.value)
+    assert "2 upload_id(s) are already in the input_catalog table: ['aaaa']" in message
+    assert "outside of 10000 to 20000" in message
+    assert "too large" in message
+
+
+@pytest.mark.parametrize("file_format", ["feather", "parquet"])
+def test_check_duplicates_out_of_core_matches_in_memory(tmp_path, file_format):
+    rng = np.random.default_rng(0)
+    indir = tmp_path / "input"
+    indir.mkdir()
+    for i in range(3):
+        n = 100
+        df = pd.DataFrame(
+            {
+                "obj_id": rng.integers(0, 150, n),
+                "ra": rng.uniform(0.0, 360.0, n),
+                "dec": rng.uniform(-90.0, 90.0, n),
+                "input_catalog_id": np.full(n, 3006),
+                "version": ["v1.0"] * n,
+                "is_fstar_gaia": rng.random(n) > 0.5,
+                "prob_f_star": rng.random(n),
+            }
+        )
+        getattr(df, f"to_{file_format}")(indir / f"input_{i}.{file_format}")
+
+    for out_of_core in [False, True]:
+        check_duplicates(
+            indir=str(indir),
+            outdir=str(tmp_path / f"output_{out_of_core}"),
+            file_format=file_format,
+            out_of_core=out_of_core,
+            n_buckets=4,
+            batch_size=30,
+            n_jobs=2,
+        )
+
+    read = getattr(pd, f"read_{file_format}")
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "output_True" / "duplicates.csv"),
+        pd.read_csv(tmp_path / "output_False" / "duplicates.csv"),
+    )
+    pd.testing.assert_frame_equal(
+        read(tmp_path / "output_True" / f"all_merged_nodups.{file_format}"),
+        read(tmp_path / "output_False" / f"all_merged_nodups.{file_format}"),
+    )
+
+
+def test_prep_fluxstd_data_in_parallel_matches_serial(tmp_path):
+    indir = tmp_path / "input"
+    indir.mkdir()
+    for i in range(3):
+        pd.DataFrame(
+            {"obj_id": np.arange(5) + 10 * i, "fstar_gaia": [True] * 5}
+        ).to_parquet(indir / f"input_{i}.parquet", index=False)
+    (indir / "README.txt").write_text("not an input file")
+
+    for n_jobs in [1, 2]:
+        prep_fluxstd_data(
+            str(indir),
+            str(tmp_path / f"output_{n_jobs}"),
+            "v1.0",
+            3006,
+            None,
+            rename_cols={"fstar_gaia": "is_fstar_gaia"},
+            n_jobs=n_jobs,
+        )
+
+    for i in range(3):
+        df = pd.read_parquet(tmp_path / "output_2" / f"input_{i}.parquet")
+        pd.testing.assert_frame_equal(
+            df, pd.read_parquet(tmp_path / "output_1" / f"input_{i}.parquet")
+        )
+        assert df.columns.tolist() == [
+            "obj_id",
+            "is_fstar_gaia",
+            "input_catalog_id",
+            "version",
+        ]
+
+
+def test_prep_fluxstd_data_in_parallel_logs_in_parent(tmp_path):
+    indir = tmp_path / "input"
+    indir.mkdir()
+    for i in range(3):
+        pd.DataFrame({"obj_id": np.arange(5) + 10 * i}).to_parquet(
+            indir / f"input_{i}.parquet", index=False
+        )
+
+    messages = []
+    handler_id = logger.add(lambda m: messages.append(m.record["message"]))
+    try:
+        prep_fluxstd_data(
+            str(indir), str(tmp_path / "output"), "v1.0", 3006, None, n_jobs=2
+        )
+    finally:
+        logger.remove(handler_id)
+
+    # the messages of the workers reach the sinks of the parent exactly once
+    for i in range(3):
+        assert messages.count(f"Processing... {i + 1}/3: input_{i}.parquet") == 1
+        assert (
+            messages.count(f"\t[input_{i}.parquet] Converting to the parquet format")
+            == 1
+        )
+
+
+def test_prep_fluxstd_data_in_parallel_logs_failed_file(tmp_path):
+    indir = tmp_path / "input"
+    indir.mkdir()
+    pd.DataFrame({"obj_id": np.arange(5)}).to_parquet(
+        indir / "input_0.parquet", index=False
+    )
+    (indir / "input_1.parquet").write_text("not a parquet file")
+
+    messages = []
+    handler_id = logger.add(lambda m: messages.append(m.record["message"]))
+    try:
+        with pytest.raises(pa.ArrowInvalid):
+            prep_fluxstd_data(
+                str(indir), str(tmp_path / "output"), "v1.0", 3006, None, n_jobs=2
+            )
+    finally:
+        logger.remove(handler_id)
+
+    # the messages of the worker are not lost with its exception
+    assert "Processing... 2/2: input_1.parquet" in messages
+
+
+def test_prep_fluxstd_data_healpix_partitions(tmp_path):
+    indir = tmp_path / "input"
+    indir.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(3):
+        pd.DataFrame(
+            {
+                "obj_id": rng.permutation(100) + 100 * i,
+                "ra": rng.uniform(0, 360, 100),
+                "dec": rng.uniform(-60, 60, 100),
+                "is_fstar_gaia": True,
+                "prob_f_star": 0.5,
+            }
+        ).to_parquet(indir / f"input_{i}.parquet", index=False)
+
+    prep_fluxstd_data(str(indir), str(tmp_path / "files"), "v1.0", 3006, None, n_jobs=1)
+    prep_fluxstd_data(
+        str(indir),
+        str(tmp_path / "healpix"),
+        "v1.0",
+        3006,
+        None,
+        n_jobs=2,
+        healpix_nside=2,
+    )
+
+    df_files = pd.concat(
+        [pd.read_parquet(tmp_path / "files" / f"input_{i}.parquet") for i in range(3)]
+    )
+    df_partitions = pd.read_csv(tmp_path / "healpix" / "_partitions.csv")
+    assert df_partitions["n_rows"].sum() == 300
+    for row in df_partitions.itertuples():
+        df = pd.read_parquet(tmp_path / "healpix" / row.file)
+        assert row.file == f"healpix={row.healpix}/part-0.parquet"
+        assert df.columns.tolist() == df_files.columns.tolist()
+        assert np.all(healpix_index(df["ra"], df["dec"], 2) == row.healpix)
+        # sorted by a finer pixel and then obj_id
+        fine = healpix_index(df["ra"], df["dec"], 8192)
+        assert np.all(np.diff(fine) >= 0)
+        assert (row.dec_min, row.dec_max) == pytest.approx(
+            (df["dec"].min(), df["dec"].max())
+        )
+
+    df_healpix = pd.read_parquet(tmp_path / "healpix", partitioning="hive")
+    pd.testing.assert_frame_equal(
+        df_healpix.drop(columns="healpix").sort_values("obj_id", ignore_index=True),
+        df_files.sort_values("obj_id", ignore_index=True),
+    )
+    assert not list((tmp_path / "healpix").glob(".*"))
+
+    with pytest.raises(ValueError):
+        prep_fluxstd_data(
+            str(indir), str(tmp_path / "healpix"), "v1.0", 3006, None, healpix_nside=2
+        )
+    with pytest.raises(ValueError):
+        prep_fluxstd_data(
+            str(indir), str(tmp_path / "fine"), "v1.0", 3006, None, healpix_nside=64
+        )
+
+    # the partitions are found by the duplicate checks, but not other directories
+    (tmp_path / "healpix" / "checkdups").mkdir()
+    df_files.to_parquet(tmp_path / "healpix" / "checkdups" / "old.parquet")
+    check_duplicates(str(tmp_path / "healpix"), str(tmp_path / "healpix" / "checkdups"))
+    df_merged = pd.read_parquet(
+        tmp_path / "healpix" / "checkdups" / "all_merged_nodups.parquet"
+    )
+    assert df_merged.index.size == 300
+    assert set(df_merged["input_file"]) == {
+        f"healpix={pixel}/part-0" for pixel in df_partitions["healpix"]
+    }
+    assert (
+        check_positional_duplicates(
+            str(tmp_path / "healpix"), str(tmp_path / "clusters"), id_column="obj_id"
+        )
+        is not None
+    )
+
+
+def test_prep_fluxstd_data_healpix_rejects_nan_positions(tmp_path):
+    indir = tmp_path / "input"
+    indir.mkdir()
+    pd.DataFrame(
+        {"obj_id": np.arange(3), "ra": [10.0, np.nan, 30.0], "dec": [0.0, 0.0, 0.0]}
+    ).to_parquet(indir / "input_0.parquet", index=False)
+
+    with pytest.raises(ValueError, match="1 positions are not"):
+        prep_fluxstd_data(
+            str(indir),
+            str(tmp_path / "healpix"),
+            "v1.0",
+            3006,
+            None,
+            healpix_nside=2,
+        )
+    # no row is written into an arbitrary partition
+    assert list((tmp_path / "healpix").glob("healpix=*")) == []
+
+
+def test_copy_uploads_fills_defaults_per_upload():
+    class FakeDB:
+        def insert_by_binary_copy(self, table, data, autocommit=True):
+            self.tables = list(data)
+
+    db = FakeDB()
+    _copy_uploads(
+        db,
+        "target",
+        [
+            pd.DataFrame(
+                {
+                    "ob_code": ["a"],
+                    "pmra": [1.5],
+                    "priority": [3.0],
+                    "psf_flux_g": [9.0],
+                }
+            ),
+            pd.DataFrame({"ob_code": ["b"]}),
+        ],
+    )
+
+    # the COPY takes the columns of the first table
+    assert db.tables[0].schema == db.tables[1].schema
+    second = db.tables[1].to_pylist()[0]
+    assert second["pmra"] == 0.0
+    assert second["pmdec"] == 0.0
+    assert second["priority"] == 1.0
+    assert second["epoch"] == "J2000.0"
+    assert second["is_medium_resolution"] is False
+    assert second["psf_flux_g"] is None
+    assert db.tables[0].to_pylist()[0]["pmra"] == 1.5
+
+
+def test_check_positional_duplicates_across_files(tmp_path):
+    indir = tmp_path / "input"
+    indir.mkdir()
+    pd.DataFrame(
+        {"target_id": [1, 2], "ra": [10.0, 20.0], "dec": [0.0, 0.0]}
+    ).to_parquet(indir / "a.parquet", index=False)
+    pd.DataFrame(
+        {"target_id": [3, 4], "ra": [10.0 + 0.5 / 3600, 30.0], "dec": [0.0, 0.0]}
+    ).to_parquet(indir / "b.parquet", index=False)
+
+    df = check_positional_duplicates(
+        indir=str(indir), outdir=str(tmp_path / "output"), radius=1.0
+    )
+
+    assert df["target_id"].tolist() == [1, 3]
+    assert df["cluster_id"].tolist() == [1, 1]
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "output" / "clusters.csv"), df, check_dtype=False
+    )
+
+
+def test_check_positional_duplicates_per_file_columns(tmp_path):
+    indir = tmp_path / "input"
+    indir.mkdir()
+    pd.DataFrame({"obj_id": [1, 2], "ra": [10.0, 20.0], "dec": [0.0, 0.0]}).to_parquet(
+        indir / "a.parquet", index=False
+    )
+    pd.DataFrame(
+        {
+            "obj_id": [3, 4],
+            "ra": [10.0 + 0.5 / 3600, 30.0],
+            "dec": [0.0, 0.0],
+            "input_catalog_id": [1001, 1001],
+        }
+    ).to_parquet(indir / "b.parquet", index=False)
+
+    with pytest.raises(ValueError, match="target_id"):
+        check_positional_duplicates(indir=str(indir), outdir=str(tmp_path / "output"))
+
+    df = check_positional_duplicates(
+        indir=str(indir),
+        outdir=str(tmp_path / "output"),
+        id_column="obj_id",
+        cluster_id_start=101,
+    )
+
+    assert df["target_id"].tolist() == [1, 3]
+    assert df["cluster_id"].tolist() == [101, 101]
+    assert df["input_catalog_id"].isna().tolist() == [True, False]
+    assert df["input_catalog_id"].iloc[1] == 1001
+
+
+def _make_upload_zip(upload_id, n_bytes):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr(
+            f"pfs_target-20240101-000000-{upload_id}/target_{upload_id}.ecsv",
+            np.random.default_rng(0).bytes(n_bytes),
+        )
+    return buf.getvalue()
+
+
+@pytest.fixture
+def upload_server():
+    # a stand-in for the uploader Web API serving ZIP files with Range support;
+    # the uploads in `truncate` are cut in the middle of the first response
+    archives, truncate, requests_log = {}, set(), []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            upload_id = self.path.rsplit("/", 1)[-1]
+            range_header = self.headers.get("Range")
+            requests_log.append((upload_id, range_header))
+            if upload_id not in archives:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            data = archives[upload_id]
+            start = int(range_header[6:-1]) if range_header else 0
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206 if range_header else 200)
+            if range_header:
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}"
+                )
+            self.send_header("Content-Length", str(len(data) - start))
+            self.end_headers()
+            if upload_id in truncate:
+                truncate.discard(upload_id)
+                self.wfile.write(data[start : (start + len(data)) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(data[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield {
+        "url": f"http://127.0.0.1:{server.server_port}/get-upload/",
+        "archives": archives,
+        "truncate": truncate,
+        "requests": requests_log,
+    }
+    server.shutdown()
+    server.server_close()
+
+
+def test_transfer_via_webapi_concurrently_with_resume(tmp_path, upload_server):
+    for upload_id in ["aaaa", "bbbb", "cccc"]:
+        upload_server["archives"][upload_id] = _make_upload_zip(upload_id, 300_000)
+    # an interrupted download left by a previous run
+    data_b = upload_server["archives"]["bbbb"]
+    (tmp_path / ".bbbb.zip.part").write_bytes(data_b[:100_000])
+    # a connection dropped in the middle of the download
+    upload_server["truncate"].add("cccc")
+
+    df_status = transfer_data_from_uploader_via_webapi(
+        pd.DataFrame({"upload_id": ["aaaa", "bbbb", "cccc", "dddd", "aaaa"]}),
+        {"webapi": {"url": upload_server["url"]}},
+        local_dir=tmp_path,
+        n_workers=3,
+    )
+
+    assert df_status["status"].tolist() == [
+        "success",
+        "success",
+        "success",
+        "FAILED",
+        "success",
+    ]
+    for upload_id in ["aaaa", "bbbb", "cccc"]:
+        with zipfile.ZipFile(io.BytesIO(upload_server["archives"][upload_id])) as zf:
+            expected = zf.read(zf.namelist()[0])
+        outfile = tmp_path / f"20240101-000000-{upload_id}" / f"target_{upload_id}.ecsv"
+        assert outfile.read_bytes() == expected
+    assert not list(tmp_path.glob(".*.part"))
+    assert ("bbbb", "bytes=100000-") in upload_server["requests"]
+    # resumed from the bytes written before the connection was dropped
+    ranges_c = [r[1] for r in upload_server["requests"] if r[0] == "cccc"]
+    assert ranges_c[0] is None
+    assert 0 < int(ranges_c[1][6:-1]) <= len(upload_server["archives"]["cccc"]) // 2
+    # a duplicated upload_id is downloaded once
+    assert [r[0] for r in upload_server["requests"]].count("aaaa") == 1
+
+
+def test_extract_zip_only_matching_directory(tmp_path):
+    zip_path = tmp_path / "upload.zip"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        zf.writestr("pfs_target-20240101-000000-aaaa/target.ecsv", "new")
+        zf.writestr("pfs_target-20240101-000000-aaaa/sub/ppc.ecsv", "ppc")
+        zf.writestr("__MACOSX/._target.ecsv", "junk")
+    local_dir = tmp_path / "local"
+    (local_dir / "20240101-000000-aaaa").mkdir(parents=True)
+    (local_dir / "20240101-000000-aaaa" / "stale.ecsv").write_text("old")
+
+    assert _extract_and_validate_zip(
+        zip_path, "aaaa", local_dir, force=True, verify=True
+    ) == (1, "success")
+    # the existing directory is replaced and nothing else is left
+    assert sorted(p.name for p in local_dir.iterdir()) == ["20240101-000000-aaaa"]
+    assert sorted(
+        p.relative_to(local_dir).as_posix() for p in local_dir.rglob("*.ecsv")
+    ) == ["20240101-000000-aaaa/sub/ppc.ecsv", "20240101-000000-aaaa/target.ecsv"]
+
+    # validated before extraction
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        zf.writestr("pfs_target-20240101-000000-bbbb/target.ecsv", "other")
+    assert _extract_and_validate_zip(zip_path, "aaaa", local_dir, force=True) == (
+        0,
+        "WARNING",
+    )
+    assert (local_dir / "20240101-000000-aaaa" / "target.ecsv").read_text() == "new"
+
+
+@pytest.fixture
+def uploader_dir(tmp_path):
+    data_dir = tmp_path / "uploader"
+    for path in [
+        "2024/01/20240101-000000-aaaa",
+        "2024/02/20240201-000000-bbbb",
+        "2024/02/20240202-000000-bbbb",
+        "2024/03/20240301-000000-cccc",
+        "20240401-000000-dddd",
+    ]:
+        (data_dir / path).mkdir(parents=True)
+        (data_dir / path / "target.ecsv").write_text(path)
+    return data_dir
+
+
+def test_list_uploader_directories_in_single_pass(uploader_dir):
+    source_dirs = _list_uploader_directories(
+        {"uploader": {"host": "localhost", "data_dir": str(uploader_dir)}},
+        ["aaaa", "bbbb", "dddd"],
+    )
+
+    assert source_dirs == {
+        "aaaa": [str(uploader_dir / "2024/01/20240101-000000-aaaa")],
+        "bbbb": [
+            str(uploader_dir / "2024/02/20240201-000000-bbbb"),
+            str(uploader_dir / "2024/02/20240202-000000-bbbb"),
+        ],
+        # not in the ????/??/ layout
+        "dddd": [],
+    }
+
+
+@pytest.mark.skipif(shutil.which("rsync") is None, reason="rsync is not installed")
+def test_transfer_from_uploader_in_batch(tmp_path, uploader_dir):
+    local_dir = tmp_path / "local"
+    (local_dir / "20231201-000000-eeee").mkdir(parents=True)
+
+    df_status = transfer_data_from_uploader(
+        pd.DataFrame({"upload_id": ["aaaa", "bbbb", "dddd", "eeee", "aaaa"]}),
+        {"uploader": {"host": "localhost", "data_dir": str(uploader_dir)}},
+        local_dir=local_dir,
+        batch=True,
+        n_workers=2,
+    )
+
+    assert df_status["status"].tolist() == [
+        "success",
+        "WARNING",
+        "FAILED",
+        "skipped",
+        "success",
+    ]
+    assert df_status["n_transfer"].tolist() == [1, 2, 0, 0, 1]
+    assert (local_dir / "20240101-000000-aaaa" / "target.ecsv").read_text() == (
+        "2024/01/20240101-000000-aaaa"
+    )
+    assert (local_dir / "20240202-000000-bbbb").is_dir()